@@ -0,0 +1,343 @@
+"""
+Admission control for the expensive endpoints.
+
+- Per-client token bucket (429 when a client exceeds its rate)
+- Per-lane concurrency limit with a bounded wait queue (chat, voice, ingestion)
+- Early 503 shedding when the expected queue wait exceeds the lane deadline
+- Azure OpenAI tokens-per-minute budget fed by the usage each LLM call reports
+"""
+
+import asyncio
+import contextvars
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+import metrics_helper
+
+# Slot of the request being served, set in the worker thread running its work
+_current_slot = contextvars.ContextVar("admission_slot", default=None)
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+def _networks(value: str) -> list:
+    """Comma-separated IPs / CIDR ranges, e.g. "10.0.0.0/8, 127.0.0.1"."""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in (value or "").split(",") if item.strip()]
+
+# Reverse proxies / load balancers whose X-Forwarded-For is believed
+TRUSTED_PROXIES = _networks(os.getenv("TRUSTED_PROXIES", ""))
+
+def _trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_take(self, n: float = 1) -> float:
+        """Take n tokens. Returns 0 on success, otherwise the seconds until n are available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        return (n - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+class TpmBudget:
+    """Sliding one-minute window of LLM tokens, plus reservations for requests in flight."""
+
+    def __init__(self, tokens_per_minute: float):
+        self.limit = tokens_per_minute
+        self.window = deque()  # (timestamp, tokens)
+        self.used = 0
+        self.reserved = 0
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.window and now - self.window[0][0] >= 60:
+            self.used -= self.window.popleft()[1]
+
+    def record(self, tokens: int, slot=None):
+        """Count used tokens; the part covered by `slot`'s reservation is no longer reserved."""
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            self.window.append((now, tokens))
+            self.used += tokens
+            if slot is not None and slot.reserved:
+                settled = min(tokens, slot.reserved)
+                slot.reserved -= settled
+                self.reserved = max(0, self.reserved - settled)
+
+    def _wait_time(self, now, tokens: float) -> float:
+        excess = self.used + self.reserved + tokens - self.limit
+        if excess <= 0:
+            return 0.0
+        for timestamp, used in self.window:
+            excess -= used
+            if excess <= 0:
+                return 60 - (now - timestamp)
+        return math.inf  # reservations alone exceed the budget
+
+    def wait_time(self, tokens: float) -> float:
+        """Seconds until `tokens` more fit in the budget (0 if they fit now)."""
+        if self.limit <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            return self._wait_time(now, tokens)
+
+    def try_reserve(self, tokens: float) -> float:
+        """Reserve `tokens` if they fit now and return 0, else return the seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            wait = self._wait_time(now, tokens) if self.limit > 0 else 0.0
+            if wait <= 0:
+                self.reserved += tokens
+            return wait
+
+    def release(self, tokens: float):
+        with self.lock:
+            self.reserved = max(0, self.reserved - tokens)
+
+    def usage(self) -> dict:
+        with self.lock:
+            self._expire(time.monotonic())
+            return {"limit": self.limit, "used_last_minute": self.used, "reserved": round(self.reserved)}
+
+class Lane:
+    """Concurrency limit with a bounded queue and a queueing deadline."""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, deadline: float, uses_llm: bool):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.uses_llm = uses_llm
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.avg_service = 1.0           # EWMA of seconds per request
+        self.avg_tokens = 1500.0         # EWMA of LLM tokens per request
+
+    def expected_wait(self) -> float:
+        if self.active < self.concurrency:
+            return 0.0
+        return (self.waiting + 1) / self.concurrency * self.avg_service
+
+    def observe(self, seconds: float, tokens: int):
+        self.avg_service = 0.8 * self.avg_service + 0.2 * seconds
+        if self.uses_llm and tokens:
+            self.avg_tokens = 0.8 * self.avg_tokens + 0.2 * tokens
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "avg_service_seconds": round(self.avg_service, 3),
+            "avg_tokens": round(self.avg_tokens),
+        }
+
+class Slot:
+    """An admitted request. Run its blocking work through run() so LLM usage is attributed to it."""
+
+    def __init__(self, reserved: float = 0):
+        self.tokens = 0
+        self.reserved = reserved  # part of the TPM reservation not yet settled by recorded usage
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.to_thread(self._run, fn, *args, **kwargs)
+
+    def _run(self, fn, *args, **kwargs):
+        token = _current_slot.set(self)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_slot.reset(token)
+
+class AdmissionController:
+    def __init__(self, lanes: dict, client_rate_per_minute: float, client_burst: float, tpm: float):
+        self.lanes = lanes
+        self.client_rate = client_rate_per_minute / 60
+        self.client_burst = client_burst
+        self.buckets = {}
+        self.budget = TpmBudget(tpm)
+
+    @classmethod
+    def from_env(cls):
+        def lane(name, concurrency, queue, deadline, uses_llm):
+            prefix = f"ADMISSION_{name.upper()}"
+            return Lane(
+                name,
+                int(_env_float(f"{prefix}_CONCURRENCY", concurrency)),
+                int(_env_float(f"{prefix}_QUEUE", queue)),
+                _env_float(f"{prefix}_DEADLINE_SECONDS", deadline),
+                uses_llm,
+            )
+
+        return cls(
+            lanes={
+                "chat": lane("chat", 8, 32, 20.0, True),
+                # Voice turns run the chat pipeline: they reserve TPM like chat
+                "voice": lane("voice", 4, 16, 30.0, True),
+                # Bulk work (ingestion, batch chat) only uses the TPM budget through record_usage
+                "ingestion": lane("ingestion", 2, 8, 5.0, False),
+            },
+            client_rate_per_minute=_env_float("RATE_LIMIT_PER_MINUTE", 30),
+            client_burst=_env_float("RATE_LIMIT_BURST", 10),
+            tpm=_env_float("AZURE_OPENAI_TPM", 0),
+        )
+
+    def _client_key(self, request) -> str:
+        """Address of the client: the peer, or behind trusted proxies the last X-Forwarded-For
+        hop they didn't add (hops further left are client-supplied and could be rotated)."""
+        address = request.client.host if request.client else None
+        if address and _trusted(address):
+            hops = [hop.strip() for hop in (request.headers.get("x-forwarded-for") or "").split(",") if hop.strip()]
+            while hops:
+                address = hops.pop()
+                if not _trusted(address):
+                    break
+        return address or "anonymous"
+
+    def _check_rate(self, client: str, lane_name: str):
+        if self.client_rate <= 0:
+            return
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            if len(self.buckets) > 10000:
+                # Drop buckets that have refilled completely; they carry no state
+                now = time.monotonic()
+                self.buckets = {
+                    key: b for key, b in self.buckets.items()
+                    if b.tokens + (now - b.updated) * b.rate < b.capacity
+                }
+            bucket = self.buckets[client] = TokenBucket(self.client_rate, self.client_burst)
+        retry_after = bucket.try_take()
+        if retry_after:
+            metrics_helper.incr(f"admission.{lane_name}.rate_limited")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, please slow down",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+
+    def _shed(self, lane: Lane, reason: str, retry_after: float):
+        metrics_helper.incr(f"admission.{lane.name}.shed.{reason}")
+        print(f"🚦 Shedding {lane.name} request ({reason})")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": str(max(1, math.ceil(min(retry_after, 60))))},
+        )
+
+    @asynccontextmanager
+    async def admit(self, lane_name: str, request, uses_llm: bool = None):
+        """Hold a slot of `lane_name` for the duration of the block, or raise 429/503.
+
+        Yields a Slot; blocking work should go through `await slot.run(fn, ...)`.
+        `uses_llm=False` skips the lane's TPM reservation for work without LLM calls.
+        """
+        lane = self.lanes[lane_name]
+        arrived = time.monotonic()
+        self._check_rate(self._client_key(request), lane_name)
+
+        # Shed early instead of letting the request time out in the queue
+        if lane.waiting >= lane.max_queue:
+            self._shed(lane, "queue_full", lane.expected_wait())
+        if lane.expected_wait() > lane.deadline:
+            self._shed(lane, "deadline", lane.expected_wait())
+
+        # Wait until the estimate fits the TPM budget, re-checking after every sleep so requests
+        # woken together don't all proceed; the reservation is taken as soon as it fits
+        estimate = lane.avg_tokens if (lane.uses_llm if uses_llm is None else uses_llm) else 0
+        delayed = False
+        while estimate:
+            tpm_wait = self.budget.try_reserve(estimate)
+            if not tpm_wait:
+                break
+            if time.monotonic() - arrived + tpm_wait > lane.deadline:
+                self._shed(lane, "tpm", tpm_wait)
+            if not delayed:
+                delayed = True
+                metrics_helper.incr(f"admission.{lane.name}.tpm_delayed")
+            await asyncio.sleep(tpm_wait)
+        slot = Slot(estimate)
+
+        try:
+            if not lane.semaphore.locked():
+                await lane.semaphore.acquire()  # free slot: does not suspend
+            else:
+                lane.waiting += 1
+                try:
+                    remaining = lane.deadline - (time.monotonic() - arrived)
+                    await asyncio.wait_for(lane.semaphore.acquire(), timeout=max(remaining, 0.001))
+                except asyncio.TimeoutError:
+                    self._shed(lane, "timeout", lane.expected_wait())
+                finally:
+                    lane.waiting -= 1
+        except BaseException:
+            self.budget.release(slot.reserved)
+            raise
+
+        metrics_helper.observe(f"admission.{lane.name}.queue_ms", (time.monotonic() - arrived) * 1000)
+        metrics_helper.incr(f"admission.{lane.name}.admitted")
+        lane.active += 1
+        started = time.monotonic()
+        try:
+            yield slot
+        finally:
+            # Whatever recorded usage has not settled yet
+            self.budget.release(slot.reserved)
+            lane.active -= 1
+            lane.semaphore.release()
+            lane.observe(time.monotonic() - started, slot.tokens)
+
+    def stats(self) -> dict:
+        return {
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+            "tpm": self.budget.usage(),
+            "tracked_clients": len(self.buckets),
+        }
+
+admission = AdmissionController.from_env()
+
+def record_usage(response):
+    """Account the tokens reported by an LLM response (OpenAI client or LangChain message)."""
+    tokens = 0
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        tokens = getattr(usage, "total_tokens", 0) or 0
+    else:
+        usage_metadata = getattr(response, "usage_metadata", None) or {}
+        tokens = usage_metadata.get("total_tokens", 0)
+    if not tokens:
+        return
+    slot = _current_slot.get()
+    # Usage of an admitted request replaces its reservation instead of adding to it
+    admission.budget.record(tokens, slot)
+    metrics_helper.incr("llm.tokens", tokens)
+    if slot is not None:
+        slot.tokens += tokens
@@ -0,0 +1,178 @@
+"""
+Audio formats for text-to-speech and speech-to-text, chosen per client.
+
+Text-to-speech formats (ElevenLabs output formats, low to high bitrate):
+
+    opus      opus_48000_32   32 kbps Ogg Opus     best quality per byte (Chrome, Firefox, Safari 17+)
+    mp3-low   mp3_22050_32    32 kbps MP3          plays everywhere, telephone-like
+    mp3       mp3_44100_64    64 kbps MP3          default: clear speech at half the old bitrate
+    mp3-hq    mp3_44100_128   128 kbps MP3         the previous fixed format
+    pcm       pcm_16000       256 kbps WAV         no decoding, for LAN / embedded clients
+
+negotiate() picks one from, in order: an explicit `format` parameter, the Accept header
+(e.g. "audio/ogg;codecs=opus, audio/mpeg;q=0.8") and the client's network hints (Save-Data,
+ECT, Downlink). On a slow or metered connection the smallest acceptable format is used.
+TTS_DEFAULT_FORMAT (default mp3) applies when the client expresses no preference.
+
+Uploads for speech-to-text keep their container (WebM/Ogg/MP3/MP4 are already compressed),
+but WAV uploads are converted to 16 kHz mono 16-bit PCM, which is all the recognizer uses.
+
+Per-format sizes and latencies are recorded as `audio.tts.<format>.bytes` / `audio.tts.<format>_ms`
+and `audio.stt.<container>.bytes` / `audio.stt.<container>_ms` timings in GET /metrics.
+"""
+
+import io
+import os
+import wave
+
+import numpy as np
+
+import metrics_helper
+
+FORMATS = {
+    "opus": {"output_format": "opus_48000_32", "media_type": "audio/ogg; codecs=opus", "kbps": 32},
+    "mp3-low": {"output_format": "mp3_22050_32", "media_type": "audio/mpeg", "kbps": 32},
+    "mp3": {"output_format": "mp3_44100_64", "media_type": "audio/mpeg", "kbps": 64},
+    "mp3-hq": {"output_format": "mp3_44100_128", "media_type": "audio/mpeg", "kbps": 128},
+    "pcm": {"output_format": "pcm_16000", "media_type": "audio/wav", "kbps": 256},
+}
+DEFAULT_FORMAT = os.getenv("TTS_DEFAULT_FORMAT", "mp3")
+STT_SAMPLE_RATE = 16000
+
+# Accepted media type -> formats it covers. ElevenLabs Opus comes in an Ogg container, so a
+# client that only accepts audio/webm gets MP3 rather than a file it can't play.
+_MEDIA_TYPES = {
+    "audio/ogg": ("opus",),
+    "audio/opus": ("opus",),
+    "audio/mpeg": ("mp3", "mp3-low", "mp3-hq"),
+    "audio/mp3": ("mp3", "mp3-low", "mp3-hq"),
+    "audio/wav": ("pcm",),
+    "audio/wave": ("pcm",),
+    "audio/x-wav": ("pcm",),
+    "audio/l16": ("pcm",),
+}
+_UNIVERSAL = ("mp3", "mp3-low", "mp3-hq", "pcm")
+_SLOW_CONNECTIONS = {"slow-2g", "2g", "3g"}
+_LOW_BANDWIDTH_MBPS = 1.5
+
+def low_bandwidth(headers) -> bool:
+    """True when the client asked to save data or reports a slow connection (client hints)."""
+    if (headers.get("save-data") or "").strip().lower() == "on":
+        return True
+    if (headers.get("ect") or "").strip().lower() in _SLOW_CONNECTIONS:
+        return True
+    try:
+        return float(headers.get("downlink") or "inf") < _LOW_BANDWIDTH_MBPS
+    except ValueError:
+        return False
+
+def _accepted(accept: str) -> list:
+    """(q, formats) for each audio entry of an Accept header, highest q first."""
+    entries = []
+    for item in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        media_type = media_type.lower()
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in ("*/*", "audio/*"):
+            formats = _UNIVERSAL  # Opus only when the client names it
+        else:
+            formats = _MEDIA_TYPES.get(media_type, ())
+        if formats and q > 0:
+            entries.append((q, formats))
+    return sorted(entries, key=lambda entry: -entry[0])
+
+def negotiate(headers, requested: str = None) -> str:
+    """Text-to-speech format for a request: `requested` if given, else from Accept and network hints.
+
+    :raises ValueError: when `requested` is not a known format
+    """
+    if requested:
+        if requested not in FORMATS:
+            raise ValueError(f"Unknown audio format '{requested}', expected one of: {', '.join(FORMATS)}")
+        return requested
+    if low_bandwidth(headers):
+        preference = sorted(FORMATS, key=lambda name: (FORMATS[name]["kbps"], name != "opus"))
+    else:
+        preference = [DEFAULT_FORMAT] + [name for name in FORMATS if name != DEFAULT_FORMAT]
+    for _, formats in _accepted(headers.get("accept")):
+        for name in preference:
+            if name in formats:
+                return name
+    return "mp3-low" if low_bandwidth(headers) else DEFAULT_FORMAT
+
+def media_type(name: str) -> str:
+    return FORMATS[name]["media_type"]
+
+def output_format(name: str) -> str:
+    """ElevenLabs output_format of a format."""
+    return FORMATS[name]["output_format"]
+
+def pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    """Wrap mono 16-bit little-endian PCM in a WAV container."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+def finish_tts(name: str, audio: bytes) -> bytes:
+    """Raw synthesized audio as served to the client (PCM is wrapped in WAV)."""
+    if name == "pcm":
+        return pcm_to_wav(audio, STT_SAMPLE_RATE)
+    return audio
+
+def container(audio: bytes) -> str:
+    """Container of uploaded audio, from its magic bytes."""
+    if audio[:4] == b"RIFF" and audio[8:12] == b"WAVE":
+        return "wav"
+    if audio[:4] == b"\x1aE\xdf\xa3":
+        return "webm"
+    if audio[:4] == b"OggS":
+        return "ogg"
+    if audio[4:8] == b"ftyp":
+        return "mp4"
+    if audio[:4] == b"fLaC":
+        return "flac"
+    if audio[:3] == b"ID3" or (len(audio) > 1 and audio[0] == 0xFF and audio[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return "unknown"
+
+def prepare_for_stt(audio: bytes) -> tuple:
+    """(audio to upload, container): 16-bit WAV is downmixed and resampled to 16 kHz mono."""
+    kind = container(audio)
+    if kind != "wav":
+        return audio, kind
+    try:
+        with wave.open(io.BytesIO(audio), "rb") as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return audio, kind
+    if width != 2 or (channels == 1 and rate <= STT_SAMPLE_RATE):
+        return audio, kind
+
+    samples = np.frombuffer(frames[:len(frames) - len(frames) % (2 * channels)], dtype="<i2")
+    samples = samples.reshape(-1, channels).astype(np.float32).mean(axis=1)
+    if rate > STT_SAMPLE_RATE and len(samples):
+        kernel = int(round(rate / STT_SAMPLE_RATE))
+        if kernel > 1:
+            samples = np.convolve(samples, np.ones(kernel) / kernel, mode="same")  # crude low-pass
+        positions = np.arange(0, len(samples), rate / STT_SAMPLE_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+        rate = STT_SAMPLE_RATE
+    pcm = np.clip(np.round(samples), -32768, 32767).astype("<i2").tobytes()
+    return pcm_to_wav(pcm, rate), kind
+
+def record(direction: str, name: str, size: int, elapsed_ms: float):
+    """Record the size and latency of one TTS answer or STT upload (direction "tts" / "stt")."""
+    metrics_helper.observe(f"audio.{direction}.{name}.bytes", size)
+    metrics_helper.observe(f"audio.{direction}.{name}_ms", elapsed_ms)
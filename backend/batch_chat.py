@@ -0,0 +1,83 @@
+"""
+Send a file of chat queries through POST /chat/batch and write the NDJSON results.
+
+Input is JSONL (one {"text": ..., "location": ..., "id": ...} object per line) or a
+JSON array of such objects. Results are printed (or written to --output) as they stream in.
+
+Usage:
+    python batch_chat.py queries.jsonl --url http://localhost:8000 --concurrency 8 -o results.ndjson
+"""
+import argparse
+import json
+import sys
+
+import requests
+
+def load_items(path):
+    """Load batch items from a JSONL file or a JSON array"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        items = json.loads(content)
+    else:
+        items = [json.loads(line) for line in content.splitlines() if line.strip()]
+    for i, item in enumerate(items):
+        if 'text' not in item:
+            raise ValueError(f"Item {i} has no 'text'")
+        item.setdefault('location', '')
+        item.setdefault('id', str(i))
+    return items
+
+def run_batch(items, url, concurrency, out, chunk_size):
+    """Post the items in chunks and copy every NDJSON line to `out`"""
+    failed = 0
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        with requests.post(
+            f"{url.rstrip('/')}/chat/batch",
+            json={"items": chunk, "concurrency": concurrency},
+            stream=True,
+            timeout=(10, None)
+        ) as res:
+            res.raise_for_status()
+            for line in res.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                result = json.loads(line)
+                if 'summary' in result:
+                    summary = result['summary']
+                    print(f"📦 Items {start}-{start + len(chunk) - 1}: {summary['items']} answered, "
+                          f"{summary['failed']} failed in {summary['elapsed_ms'] / 1000:.1f}s, "
+                          f"shared calls: {json.dumps(summary['shared_calls'])}", file=sys.stderr)
+                    continue
+                if 'error' in result:
+                    failed += 1
+                if 'index' in result:
+                    result['index'] += start
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Run chat queries through /chat/batch")
+    parser.add_argument('input', help="JSONL file (or JSON array) of {text, location, id} items")
+    parser.add_argument('--url', default="http://localhost:8000", help="Backend base URL")
+    parser.add_argument('--concurrency', type=int, default=4, help="Items answered at once by the server")
+    parser.add_argument('--chunk-size', type=int, default=500, help="Items sent per request")
+    parser.add_argument('-o', '--output', help="Write NDJSON results here instead of stdout")
+    args = parser.parse_args()
+
+    items = load_items(args.input)
+    print(f"📖 Loaded {len(items)} items from {args.input}", file=sys.stderr)
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        failed = run_batch(items, args.url, args.concurrency, out, args.chunk_size)
+    finally:
+        if args.output:
+            out.close()
+    print(f"✅ Done: {len(items) - failed} succeeded, {failed} failed", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
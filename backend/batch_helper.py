@@ -0,0 +1,117 @@
+"""
+Batch chat utilities: share upstream work across the items of one batch.
+
+Functions decorated with @batch_shared(name) behave normally, except while running
+inside a BatchMemo (see BatchMemo.run): identical calls made by any item of the
+batch, including concurrent ones, then share a single upstream call and its result.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+_current_memo = contextvars.ContextVar("batch_memo", default=None)
+
+def _freeze(value):
+    """Make call arguments hashable so they can be used as a memo key."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+def make_key(name, args, kwargs):
+    """Hashable key for a call of `name` with the given arguments."""
+    return (name, _freeze(args), _freeze(kwargs))
+
+class BatchMemo:
+    """Per-batch memo of upstream calls, keyed by function name and arguments."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = {}  # name -> {"calls": n, "upstream": n}
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn with this memo active (use from worker threads)."""
+        token = _current_memo.set(self)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_memo.reset(token)
+
+    def call(self, name, fn, args, kwargs):
+        key = make_key(name, args, kwargs)
+        with self.lock:
+            stats = self.stats.setdefault(name, {"calls": 0, "upstream": 0})
+            stats["calls"] += 1
+            future = self.calls.get(key)
+            owner = future is None
+            if owner:
+                stats["upstream"] += 1
+                future = self.calls[key] = Future()
+        if owner:
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+def batch_shared(name):
+    """Decorator: share identical calls between the items of the active batch."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            memo = _current_memo.get()
+            if memo is None:
+                return fn(*args, **kwargs)
+            return memo.call(name, fn, args, kwargs)
+        return wrapper
+    return decorator
+
+async def stream_batch(items, answer_fn, concurrency: int = 4):
+    """Answer every item with answer_fn(item) and yield NDJSON lines as each one finishes.
+
+    At most `concurrency` items run at once (each in a worker thread); the last
+    line is a summary with the number of calls that were shared inside the batch.
+    """
+    memo = BatchMemo()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    started = time.perf_counter()
+
+    async def run(index, item):
+        async with semaphore:
+            item_started = time.perf_counter()
+            result = {"index": index, "id": getattr(item, "id", None)}
+            try:
+                result["message"] = await asyncio.to_thread(memo.run, answer_fn, item)
+            except Exception as e:
+                print(f"❌ Batch item {index} failed: {e}")
+                result["error"] = str(e)
+            result["elapsed_ms"] = round((time.perf_counter() - item_started) * 1000, 1)
+            return result
+
+    tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+    failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            failed += "error" in result
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    finally:
+        # Client went away: don't start the items that are still waiting
+        for task in tasks:
+            task.cancel()
+
+    yield json.dumps({
+        "summary": {
+            "items": len(tasks),
+            "failed": failed,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "shared_calls": memo.stats,
+        }
+    }, ensure_ascii=False) + "\n"
@@ -0,0 +1,55 @@
+"""
+Benchmark: bytes and latency of each text-to-speech format.
+
+Usage (from backend/, with the API running):
+    python benchmarks/bench_audio_formats.py --url http://localhost:8000 [--formats opus,mp3-low,mp3,mp3-hq]
+    python benchmarks/bench_audio_formats.py answers.txt       # one answer text per line
+
+Each answer is synthesized through POST /text-to-speech once per format. The report lists the
+median time to the full response and the total bytes for each format, and the ratio to mp3-hq
+(the previous fixed 128 kbps format). The server's own per-format numbers are under
+`audio.tts.*` in GET /metrics.
+"""
+import argparse
+import statistics
+import time
+
+import requests
+
+ANSWERS = [
+    "Phở Hòa Pasteur ở quận 3 là một lựa chọn rất đáng thử, giá khoảng 70.000đ một tô.",
+    "Bạn có thể ghé Cơm Tấm Ba Ghiền ở Phú Nhuận, sườn nướng to và mềm, mở cửa đến 9 giờ tối.",
+    "Gần chợ Bến Thành có nhiều quán bún chả và bánh mì ngon, đi bộ chỉ khoảng năm phút.",
+]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('answers', nargs='?')
+    parser.add_argument('--url', default="http://localhost:8000")
+    parser.add_argument('--formats', default="opus,mp3-low,mp3,mp3-hq")
+    args = parser.parse_args(argv)
+    answers = ANSWERS
+    if args.answers:
+        with open(args.answers, encoding="utf-8") as f:
+            answers = [line.strip() for line in f if line.strip()]
+
+    results = {}
+    for audio_format in args.formats.split(","):
+        sizes, times = [], []
+        for text in answers:
+            started = time.perf_counter()
+            response = requests.post(f"{args.url}/text-to-speech", params={"format": audio_format}, json={"text": text})
+            times.append((time.perf_counter() - started) * 1000)
+            response.raise_for_status()
+            sizes.append(len(response.content))
+        results[audio_format] = (sum(sizes), statistics.median(times))
+
+    baseline = results.get("mp3-hq", (0, 0))[0]
+    print(f"{len(answers)} answers\n")
+    print(f"{'format':>8} {'bytes':>10} {'vs mp3-hq':>10} {'median ms':>10}")
+    for audio_format, (size, ms) in results.items():
+        ratio = f"{baseline / size:.1f}x less" if baseline and size else "-"
+        print(f"{audio_format:>8} {size:>10} {ratio:>10} {ms:>10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark: embedding size and vector storage format vs. retrieval quality and latency.
+
+Usage (from backend/):
+    python benchmarks/bench_embeddings.py [--k 5] [--latency-rows 100000]
+    python benchmarks/bench_embeddings.py --synthetic      # no API calls, random vectors
+
+Restaurants from restaurants_knowledge.md are embedded once at full size (1536) together
+with queries derived from each restaurant (dish + area, cuisine + price). Embeddings are
+cached in --cache so reruns make no API calls. Shortened sizes are obtained by truncating
+and re-normalizing, which is what the API's `dimensions` parameter does.
+
+For each (dimensions, storage) setting it reports:
+- recall@k: overlap of the top-k with the exact full-size float32 top-k
+- hit@k:    share of queries whose source restaurant is in the top-k
+- bytes per vector
+- query latency over --latency-rows synthetic rows of that setting (brute-force scan)
+
+PQ codebooks need more training vectors than centroids (256); with a smaller catalog the PQ
+rows are skipped rather than reporting the recall of codebooks that memorized every document.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from markdown_helper import iter_restaurants, restaurant_to_text
+from vector_codec import FULL_DIMENSIONS, Float32Codec, Int8Codec, PQCodec, normalize, shorten
+
+CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'restaurants_knowledge.md')
+DEFAULT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'bench_embeddings.npz')
+DIMENSIONS = (1536, 1024, 512, 256, 128)
+PQ_CENTROIDS = 256
+
+def build_queries(restaurants):
+    """(query, index of the restaurant it was derived from)"""
+    queries = []
+    for i, r in enumerate(restaurants):
+        dish = (r.get('specialties') or '').split(',')[0].strip()
+        area = r.get('location') or ''
+        if dish:
+            queries.append((f"{dish} ở {area}".strip(), i))
+        if r.get('cuisine'):
+            price = f" giá {r['price_range']}" if r.get('price_range') else ""
+            queries.append((f"quán {r['cuisine']}{price}", i))
+    return queries
+
+def embed_all(texts, batch_size=100):
+    from dotenv import load_dotenv
+    from openai import AzureOpenAI
+    load_dotenv()
+    client = AzureOpenAI(
+        api_version="2024-07-01-preview",
+        azure_endpoint=os.getenv("AZURE_EMBEDDING_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_EMBEDDING_API_KEY"),
+    )
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        response = client.embeddings.create(
+            model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME", "text-embedding-3-small"),
+            input=texts[start:start + batch_size]
+        )
+        vectors.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+    return np.asarray(vectors, dtype=np.float32)
+
+def load_embeddings(doc_texts, query_texts, cache_path, synthetic):
+    if synthetic:
+        rng = np.random.default_rng(0)
+        docs = rng.normal(size=(len(doc_texts), FULL_DIMENSIONS)).astype(np.float32)
+        # Queries close to their source document, so hit@k is meaningful
+        sources = np.array([i for _, i in query_texts])
+        queries = docs[sources] + rng.normal(scale=1.5, size=(len(query_texts), FULL_DIMENSIONS)).astype(np.float32)
+        return docs, queries
+    if os.path.exists(cache_path):
+        cached = np.load(cache_path, allow_pickle=False)
+        if list(cached['doc_texts']) == doc_texts and list(cached['query_texts']) == [q for q, _ in query_texts]:
+            return cached['docs'], cached['queries']
+    docs = embed_all(doc_texts)
+    queries = embed_all([q for q, _ in query_texts])
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    np.savez(cache_path, docs=docs, queries=queries,
+             doc_texts=np.array(doc_texts), query_texts=np.array([q for q, _ in query_texts]))
+    return docs, queries
+
+def top_k(scores, k):
+    return np.argsort(-scores)[:k]
+
+def make_codec(name, dims, train_matrix):
+    if name == "float32":
+        return Float32Codec()
+    if name == "int8":
+        return Int8Codec()
+    # 8 dimensions per sub-vector
+    return PQCodec.train(train_matrix, m=dims // 8, k=PQ_CENTROIDS)
+
+def measure_latency(codec, dims, rows, repeats=20):
+    rng = np.random.default_rng(1)
+    corpus = normalize(rng.normal(size=(rows, dims)))
+    if isinstance(codec, PQCodec):
+        codec = PQCodec.train(corpus[:5000], m=dims // 8, iterations=5)
+    encoded = codec.encode(corpus)
+    query = normalize(rng.normal(size=(1, dims)))[0]
+    codec.scores(encoded, query)  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeats):
+        np.argpartition(-codec.scores(encoded, query), 10)[:10]
+    return (time.perf_counter() - started) / repeats * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--file', default=CATALOG)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--latency-rows', type=int, default=100_000)
+    parser.add_argument('--cache', default=DEFAULT_CACHE)
+    parser.add_argument('--synthetic', action='store_true', help="random vectors instead of API embeddings")
+    args = parser.parse_args(argv)
+
+    restaurants = list(iter_restaurants(args.file))
+    doc_texts = [restaurant_to_text(r) for r in restaurants]
+    queries = build_queries(restaurants)
+    docs, query_vectors = load_embeddings(doc_texts, queries, args.cache, args.synthetic)
+    sources = np.array([i for _, i in queries])
+    print(f"{len(docs)} restaurants, {len(queries)} queries, k={args.k}\n")
+
+    full_docs, full_queries = normalize(docs), normalize(query_vectors)
+    exact = [set(top_k(full_docs @ q, args.k)) for q in full_queries]
+
+    print(f"{'dims':>5} {'storage':>8} {'bytes/vec':>10} {'recall@k':>9} {'hit@k':>7} {'latency ms':>11}")
+    for dims in DIMENSIONS:
+        short_docs, short_queries = shorten(docs, dims), shorten(query_vectors, dims)
+        for name in ("float32", "int8", "pq"):
+            if name == "pq" and len(short_docs) <= PQ_CENTROIDS:
+                print(f"{dims:>5} {name:>8}  skipped: {len(short_docs)} documents, PQ needs more than {PQ_CENTROIDS}")
+                continue
+            codec = make_codec(name, dims, short_docs)
+            encoded = codec.encode(short_docs)
+            recall, hits = 0.0, 0
+            for qi, q in enumerate(short_queries):
+                found = top_k(codec.scores(encoded, q), args.k)
+                recall += len(exact[qi] & set(found)) / args.k
+                hits += int(sources[qi] in found)
+            latency = measure_latency(codec, dims, args.latency_rows)
+            print(f"{dims:>5} {name:>8} {encoded.dtype.itemsize:>10} {recall / len(queries):>9.3f} "
+                  f"{hits / len(queries):>7.3f} {latency:>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark: offline gazetteer lookups (no network).
+
+Usage (from backend/):
+    python benchmarks/bench_gazetteer.py [--runs 20000] [queries.txt]
+
+Times gazetteer.lookup() on typical chat location texts (or one text per line of
+queries.txt) and shows which ones resolve locally and which would still go to Nominatim.
+Results of the built-in queries listed in EXPECTED are checked (exit status 1 on a mismatch).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gazetteer
+
+QUERIES = [
+    "Quận 1", "q1", "Q.3, TP.HCM", "District 7", "Bình Thạnh", "Binh Thnah", "gò vấp",
+    "chợ Bến Thành", "gần Landmark 81", "phố đi bộ Nguyễn Huệ", "Thảo Điền, Thủ Đức",
+    "Hồ Gươm", "phố cổ Hà Nội", "Cầu Giấy, Hà Nội", "quận Hải Châu, Đà Nẵng", "Sài Gòn",
+    "12 Lê Lợi, Quận 1", "Lê Lợi, Bến Nghé, Hồ Chí Minh", "Phường 12, Quận Gò Vấp",
+    "Tân Phú, Hồ Chí Minh", "Tân Phú, Đồng Nai", "An Phú, An Giang", "Quận 3 Đà Nẵng",
+]
+# Expected place name (None: left to Nominatim). A name shared by several places must never
+# resolve to one outside the city named alongside it.
+EXPECTED = {
+    "Q.3, TP.HCM": "Quận 3",
+    "Tân Phú, Hồ Chí Minh": "Quận Tân Phú",
+    "Tân Phú, Đồng Nai": None,
+    "An Phú, An Giang": None,
+    "Quận 3 Đà Nẵng": None,
+    "12 Lê Lợi, Quận 1": None,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('queries', nargs='?')
+    parser.add_argument('--runs', type=int, default=20000)
+    args = parser.parse_args(argv)
+    queries = QUERIES
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    started = time.perf_counter()
+    gz = gazetteer.get_gazetteer()
+    print(f"load: {(time.perf_counter() - started) * 1000:.1f} ms\n")
+    print(f"{'query':<36} {'µs':>7}  result")
+    hits, mismatches = 0, 0
+    for query in queries:
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            place = gz.lookup(query)
+        micros = (time.perf_counter() - started) / args.runs * 1e6
+        hits += place is not None
+        result = f"{place['name']} ({place['kind']}{', typo' if place['fuzzy'] else ''})" if place else "→ Nominatim"
+        if query in EXPECTED and (place and place["name"]) != EXPECTED[query]:
+            mismatches += 1
+            result += f"  ✗ expected {EXPECTED[query] or '→ Nominatim'}"
+        print(f"{query[:36]:<36} {micros:>7.1f}  {result}")
+    print(f"\nresolved locally: {hits}/{len(queries)}")
+    if mismatches:
+        print(f"❌ {mismatches} unexpected results")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
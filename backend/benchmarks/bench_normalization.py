@@ -0,0 +1,62 @@
+"""
+Benchmark: cache hit rate with and without query normalization (no network).
+
+Usage (from backend/):
+    python benchmarks/bench_normalization.py [--runs 20000] [queries.txt]
+
+Replays a stream of chat queries (the built-in variants below, or one query per line of
+queries.txt, e.g. exported from logs) through caches keyed on the raw text, on
+text_normalizer.canonical() and on text_normalizer.cache_key() (canonical without diacritics,
+what the query caches use), and reports distinct keys, hit rates and µs per normalization.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import text_normalizer
+
+# Groups of the same question typed differently
+VARIANTS = [
+    ["quận 1 có quán bún bò huế nào ngon không?", "Q1 có quán BÚN BÒ HẾ nào ngon ko??",
+     "q.1 có quán bún bò huế nào ngon k", "quận 1 có quán bún bò huế nào ngon hok",
+     "quận  1 có quán bún bò huế nào ngon không?", "q.1 co quan bun bo hue nao ngon k?"],
+    ["ăn gì ở sài gòn", "ăn j ở sg", "Ăn gì ở Sài Gòn", "ăn gì ở sài gòn??", "an gi o sai gon"],
+    ["cà phê gần hồ gươm", "cf gần hồ gươm", "cafe gần Hồ Gươm", "ca phe gần hồ gươm", "ca phe gan ho guom"],
+    ["hủ tiếu ở quận 5", "hủ tíu ở q5", "hu tieu ở quận 5", "Hủ tiếu ở Q.5"],
+    ["cơm tấm ngon ở khánh hòa", "com tam ngon ở khánh hoà", "Cơm tấm ngon ở Khánh Hòa"],
+    ["quán bánh mì nào được", "quán banh mi nào dc", "quán bánh mì nào đc"],
+    ["trà sữa quận 3 bao nhiêu tiền", "tra sua q3 bn tiền", "trà sữa Q3 bao nhiêu tiền",
+     "tra sua quan 3 bao nhieu tien"],
+]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('queries', nargs='?')
+    parser.add_argument('--runs', type=int, default=20000)
+    args = parser.parse_args(argv)
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = [query for group in VARIANTS for query in group]
+
+    print(f"{'key':<10} {'distinct':>8} {'hits':>6} {'hit rate':>9}")
+    for label, key in (("raw", lambda q: q), ("canonical", text_normalizer.canonical),
+                       ("cache_key", text_normalizer.cache_key)):
+        seen, hits = set(), 0
+        for query in queries:
+            k = key(query)
+            hits += k in seen
+            seen.add(k)
+        print(f"{label:<10} {len(seen):>8} {hits:>6} {hits / len(queries):>8.0%}")
+
+    started = time.perf_counter()
+    for i in range(args.runs):
+        text_normalizer.canonical(queries[i % len(queries)])
+    print(f"\ncanonical(): {(time.perf_counter() - started) / args.runs * 1e6:.1f} µs per query")
+
+if __name__ == "__main__":
+    main()
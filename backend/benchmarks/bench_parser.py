@@ -0,0 +1,143 @@
+"""
+Micro-benchmark: streaming restaurant parser vs. the two parsers it replaced.
+
+Usage (from backend/):
+    python benchmarks/bench_parser.py [--copies 2000]
+
+The catalog is restaurants_knowledge.md repeated --copies times. Legacy parsers
+print while parsing, so stdout is redirected to /dev/null for all runs.
+"""
+import argparse
+import contextlib
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from markdown_helper import iter_restaurants
+
+CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'restaurants_knowledge.md')
+
+# ---------------------- Legacy implementations (verbatim logic) ----------------------
+def legacy_api_parser(markdown_content):
+    """Former markdown_helper.parse_restaurant_markdown"""
+    restaurants = []
+    current_restaurant = {}
+    for line in markdown_content.split('\n'):
+        line = line.strip()
+        if not line or (line.startswith('#') and not line.startswith('##')) or line.startswith('---') or line.startswith('*'):
+            if current_restaurant:
+                restaurants.append(current_restaurant)
+                current_restaurant = {}
+            continue
+        if line.startswith('##'):
+            if current_restaurant:
+                restaurants.append(current_restaurant)
+            restaurant_name = line.replace('##', '').strip()
+            print(restaurant_name)
+            current_restaurant = {'name': restaurant_name}
+            continue
+        print(current_restaurant)
+        if line.startswith('- **'):
+            key = line.split('**')[1].lower().strip(':')
+            value = line.split('**: ')[1].strip()
+            if key == 'địa chỉ':
+                current_restaurant['address'] = value
+            elif key == 'món đặc sắc':
+                current_restaurant['specialty'] = value
+            elif key == 'giá':
+                current_restaurant['price'] = value
+            elif key == 'mô tả':
+                current_restaurant['description'] = value
+    if current_restaurant:
+        restaurants.append(current_restaurant)
+    return restaurants
+
+LEGACY_CLI_FIELDS = [
+    ('- **Địa chỉ', r'- \*\*Địa chỉ\*\*:\s*', 'address'),
+    ('- **Món đặc sắc', r'- \*\*Món đặc sắc\*\*:\s*', 'specialties'),
+    ('- **Giá', r'- \*\*Giá\*\*:\s*', 'price_range'),
+    ('- **Mô tả', r'- \*\*Mô tả\*\*:\s*', 'description'),
+    ('- **Loại hình', r'- \*\*Loại hình\*\*:\s*', 'cuisine'),
+    ('- **Khu vực', r'- \*\*Khu vực\*\*:\s*', 'location'),
+    ('- **Giờ mở cửa', r'- \*\*Giờ mở cửa\*\*:\s*', 'opening_hours'),
+    ('- **Điện thoại', r'- \*\*Điện thoại\*\*:\s*', 'phone'),
+    ('- **Đánh giá', r'- \*\*Đánh giá\*\*:\s*', 'rating'),
+    ('- **Điểm nổi bật', r'- \*\*Điểm nổi bật\*\*:\s*', 'highlights'),
+]
+
+def legacy_cli_parser(file_path):
+    """Former ingest_restaurants.parse_restaurant_markdown"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    restaurants = []
+    for section in re.split(r'\n## ', content)[1:]:
+        lines = section.split('\n')
+        restaurant = {'name': lines[0].strip()}
+        for _, _, key in LEGACY_CLI_FIELDS:
+            restaurant[key] = ''
+        for line in lines[1:]:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            for prefix, pattern, key in LEGACY_CLI_FIELDS:
+                if line.startswith(prefix):
+                    restaurant[key] = re.sub(pattern, '', line)
+                    break
+        restaurants.append(restaurant)
+    return restaurants
+
+# ---------------------- Harness ----------------------
+def measure(label, fn):
+    # Timed and memory-traced in separate runs: tracemalloc slows allocation-heavy code
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        count = fn()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"{label:<32} {count:>9} records {elapsed:>8.3f}s {count / elapsed:>12,.0f} rec/s  peak {peak / 1e6:>8.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--copies', type=int, default=2000, help="How many times to repeat the catalog")
+    args = parser.parse_args()
+
+    with open(CATALOG, 'r', encoding='utf-8') as f:
+        header, _, body = f.read().partition('\n## ')
+    body = '\n## ' + body + '\n'
+
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.md', delete=False) as tmp:
+        tmp.write(header)
+        for _ in range(args.copies):
+            tmp.write(body)
+        path = tmp.name
+
+    try:
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"Catalog: {args.copies} copies, {size_mb:.1f} MB\n")
+
+        def run_legacy_api():
+            with open(path, 'r', encoding='utf-8') as f:
+                return len(legacy_api_parser(f.read()))
+
+        measure("legacy markdown_helper", run_legacy_api)
+        measure("legacy ingest_restaurants", lambda: len(legacy_cli_parser(path)))
+        measure("iter_restaurants (text file)", lambda: sum(1 for _ in iter_restaurants(path)))
+
+        def run_binary():
+            with open(path, 'rb') as f:
+                return sum(1 for _ in iter_restaurants(f))
+
+        measure("iter_restaurants (byte stream)", run_binary)
+    finally:
+        os.unlink(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark: worker import time and memory, full (LangChain) vs. lean mode.
+
+Usage (from backend/):
+    python benchmarks/bench_startup.py [--runs 5] [--importtime]
+
+    # before/after a change: measure another checkout with the same .env
+    git worktree add /tmp/ai-hoi-before <commit>
+    python benchmarks/bench_startup.py --tree /tmp/ai-hoi-before/backend
+
+Each run imports `main` in a fresh interpreter (as a uvicorn worker does) and reports the
+import wall time, resident memory after import (VmRSS), the number of loaded modules and
+whether LangChain was loaded. Importing main connects to Pinecone; to take the network out
+of the numbers, record a cassette once and replay it
+(UPSTREAM_CASSETTE_MODE=replay UPSTREAM_REPLAY_LATENCY=zero, see upstream_cassette.py).
+With --importtime the slowest top-level packages (python -X importtime) are listed too.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = r"""
+import json, os, sys, time
+sys.path.insert(0, os.getcwd())
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+rss_kb = 0
+try:
+    with open("/proc/self/status") as f:
+        rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+except OSError:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+clients = sys.modules.get("clients")
+print(json.dumps({
+    "import_s": elapsed,
+    "rss_mb": rss_kb / 1024,
+    "modules": len(sys.modules),
+    "langchain": any(name.startswith("langchain") for name in sys.modules),
+    "clients": clients.created() if clients else None,
+}))
+"""
+
+def child_env(mode: str) -> dict:
+    env = dict(os.environ)
+    env_file = os.path.join(BACKEND, '.env')
+    if os.path.exists(env_file):
+        from dotenv import dotenv_values
+        env.update({k: v for k, v in dotenv_values(env_file).items() if v is not None and k not in os.environ})
+    env["LEAN_MODE"] = "1" if mode == "lean" else "0"
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+def run_once(tree: str, mode: str, importtime: bool):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD]
+    result = subprocess.run(command, cwd=tree, env=child_env(mode), capture_output=True, text=True)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"import failed ({mode}):\n{result.stderr[-2000:]}")
+    return json.loads(lines[-1]), result.stderr
+
+def slowest_packages(stderr: str, limit: int = 10):
+    """Cumulative import time (ms) per top-level package from -X importtime output
+    (a package's time includes the packages it imports, e.g. langchain_openai includes openai)."""
+    totals = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name, cumulative = name.strip(), cumulative.strip()
+        if cumulative.isdigit() and "." not in name and name != "main":
+            totals[name] = max(totals[name], int(cumulative) / 1000)
+    return totals.most_common(limit)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--tree', default=BACKEND, help="backend directory to measure")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--modes', default="full,lean")
+    parser.add_argument('--importtime', action='store_true')
+    args = parser.parse_args(argv)
+
+    print(f"Measuring {os.path.abspath(args.tree)} ({args.runs} runs per mode)\n")
+    print(f"{'mode':>5} {'import s (median)':>18} {'RSS MB (median)':>16} {'modules':>8} {'langchain':>10}")
+    for mode in args.modes.split(","):
+        runs = [run_once(args.tree, mode, False)[0] for _ in range(args.runs)]
+        print(f"{mode:>5} {statistics.median(r['import_s'] for r in runs):>18.2f} "
+              f"{statistics.median(r['rss_mb'] for r in runs):>16.1f} "
+              f"{runs[-1]['modules']:>8} {str(runs[-1]['langchain']):>10}")
+        if runs[-1]["clients"] is not None:
+            print(f"      clients: {', '.join(runs[-1]['clients']) or '-'}")
+        if args.importtime:
+            _, stderr = run_once(args.tree, mode, True)
+            for name, ms in slowest_packages(stderr):
+                print(f"      {name:<30} {ms:>8.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark: voice turn-around, three HTTP requests vs. the /voice WebSocket.
+
+Usage (from backend/, with the API running):
+    python benchmarks/bench_voice.py recording.webm --url http://localhost:8000 [--turns 5]
+    python benchmarks/bench_voice.py recording.wav --format pcm16     # 16 kHz mono 16-bit WAV
+
+For each turn, the HTTP flow posts the clip to /speech-to-text, the text to /chat and the
+answer to /text-to-speech (what the web client does today). The WebSocket flow sends the same
+clip in 100 ms chunks followed by {"type": "end"}. Both are timed from the moment the whole
+clip has been sent until the first audio byte arrives (turn-around) and until the last one.
+Run it against a replayed cassette (UPSTREAM_CASSETTE_MODE=replay) to compare like for like.
+"""
+import argparse
+import json
+import statistics
+import time
+import wave
+
+import requests
+
+def http_turn(url, audio, file_name, location, session_id, audio_format):
+    started = time.perf_counter()
+    text = requests.post(f"{url}/speech-to-text", files={"audio": (file_name, audio)}).json().get("text", "")
+    stt = time.perf_counter()
+    chat = requests.post(f"{url}/chat", json={"text": text, "location": location, "session_id": session_id}).json()
+    answered = time.perf_counter()
+    with requests.post(f"{url}/text-to-speech", params={"format": audio_format},
+                       json={"text": chat.get("message", "")}, stream=True) as response:
+        first_audio = None
+        for chunk in response.iter_content(4096):
+            if chunk and first_audio is None:
+                first_audio = time.perf_counter()
+    done = time.perf_counter()
+    return chat.get("session_id"), {
+        "stt": (stt - started) * 1000,
+        "chat": (answered - stt) * 1000,
+        "first_audio": ((first_audio or done) - started) * 1000,
+        "total": (done - started) * 1000,
+    }
+
+def websocket_turn(connection, audio, chunk_bytes):
+    for start in range(0, len(audio), chunk_bytes):
+        connection.send(audio[start:start + chunk_bytes])
+    connection.send(json.dumps({"type": "end"}))
+    started = time.perf_counter()
+    first_audio = None
+    while True:
+        message = connection.recv()
+        if isinstance(message, bytes):
+            first_audio = first_audio or time.perf_counter()
+            continue
+        payload = json.loads(message)
+        if payload["type"] == "error":
+            raise RuntimeError(payload)
+        if payload["type"] == "turn_end":
+            done = time.perf_counter()
+            server = payload.get("latency_ms", {})
+            return {
+                "stt": server.get("stt", 0.0),
+                "chat": server.get("chat", 0.0),
+                "first_audio": ((first_audio or done) - started) * 1000,
+                "total": (done - started) * 1000,
+            }
+
+def summarize(name, turns):
+    print(f"{name:>10} " + " ".join(
+        f"{statistics.median(t[phase] for t in turns):>12.0f}" for phase in ("stt", "chat", "first_audio", "total")
+    ))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('audio')
+    parser.add_argument('--url', default="http://localhost:8000")
+    parser.add_argument('--format', default="webm", choices=("webm", "pcm16"))
+    parser.add_argument('--location', default="10.7769,106.7009")
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--audio-format', default="mp3", help="answer audio format (see audio_formats.py)")
+    args = parser.parse_args(argv)
+    from websockets.sync.client import connect
+
+    with open(args.audio, 'rb') as f:
+        clip = f.read()
+    sample_rate = 16000
+    if args.format == "pcm16":
+        with wave.open(args.audio, 'rb') as wav:
+            sample_rate, ws_audio = wav.getframerate(), wav.readframes(wav.getnframes())
+        chunk_bytes = sample_rate * 2 // 10
+    else:
+        ws_audio, chunk_bytes = clip, max(1, len(clip) // 20)
+
+    http_turns, session_id = [], None
+    for _ in range(args.turns):
+        session_id, timings = http_turn(args.url, clip, args.audio, args.location, session_id, args.audio_format)
+        http_turns.append(timings)
+
+    ws_turns = []
+    with connect(args.url.replace("http", "ws", 1) + "/voice", max_size=None) as connection:
+        connection.send(json.dumps({"type": "start", "location": args.location,
+                                    "format": args.format, "sample_rate": sample_rate,
+                                    "audio_format": args.audio_format}))
+        json.loads(connection.recv())  # ready
+        for _ in range(args.turns):
+            ws_turns.append(websocket_turn(connection, ws_audio, chunk_bytes))
+
+    print(f"median ms over {args.turns} turns (first_audio = turn-around)\n")
+    print(f"{'flow':>10} {'stt':>12} {'chat':>12} {'first_audio':>12} {'total':>12}")
+    summarize("http", http_turns)
+    summarize("websocket", ws_turns)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Minimal OpenAI-compatible server for exercising the deployment pool without Azure.
+
+Usage (from backend/):
+    python benchmarks/openai_stub.py --port 9001 --latency-ms 300
+    python benchmarks/openai_stub.py --port 9002 --latency-ms 1500 --jitter-ms 500 --error-rate 0.2
+
+then point the pool at the stubs:
+    AZURE_OPENAI_CHAT_POOL='[{"name": "fast", "base_url": "http://localhost:9001/v1", "deployment": "stub"},
+                             {"name": "slow", "base_url": "http://localhost:9002/v1", "deployment": "stub"}]'
+
+Serves POST /v1/chat/completions and /v1/embeddings (plus the Azure-style
+/openai/deployments/<name>/... paths) with a configurable latency, error rate and
+rate-limit (429) rate. Embeddings are deterministic per input text.
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+def make_handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *_):
+            pass
+
+        def _send(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(max(0.0, args.latency_ms + random.uniform(-args.jitter_ms, args.jitter_ms)) / 1000)
+
+            roll = random.random()
+            if roll < args.rate_limit_rate:
+                return self._send(429, {"error": {"message": "Rate limit exceeded (stub)"}}, {"Retry-After": "5"})
+            if roll < args.rate_limit_rate + args.error_rate:
+                return self._send(500, {"error": {"message": "Internal error (stub)"}})
+
+            path = self.path.split("?")[0]
+            if path.endswith("/chat/completions"):
+                return self._send(200, self._chat(request))
+            if path.endswith("/embeddings"):
+                return self._send(200, self._embeddings(request))
+            self._send(404, {"error": {"message": f"Unknown path {path}"}})
+
+        def _chat(self, request):
+            prompt_tokens = len(json.dumps(request.get("messages", []), ensure_ascii=False)) // 3
+            content = f"[{args.name}] stub answer"
+            return {
+                "id": f"chatcmpl-{random.getrandbits(32):x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 5,
+                          "total_tokens": prompt_tokens + 5},
+            }
+
+        def _embeddings(self, request):
+            inputs = request.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            dims = request.get("dimensions") or 1536
+            data = []
+            for i, text in enumerate(inputs):
+                seed = int.from_bytes(hashlib.sha1(str(text).encode("utf-8")).digest()[:4], "big")
+                vector = np.random.default_rng(seed).normal(size=dims)
+                data.append({"object": "embedding", "index": i,
+                             "embedding": (vector / np.linalg.norm(vector)).tolist()})
+            tokens = sum(len(str(text)) // 3 for text in inputs)
+            return {"object": "list", "data": data, "model": request.get("model", "stub"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    return Handler
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument('--port', type=int, default=9001)
+    parser.add_argument('--name', default=None, help="shown in chat answers (default: stub-<port>)")
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    args = parser.parse_args(argv)
+    args.name = args.name or f"stub-{args.port}"
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args))
+    print(f"🧪 OpenAI stub '{args.name}' on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
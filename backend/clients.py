@@ -0,0 +1,100 @@
+"""
+Process-wide registry of upstream clients (Azure OpenAI, Pinecone, ElevenLabs).
+
+Every module gets its clients from here instead of building its own, so a worker holds one
+HTTP connection pool per service no matter how many modules use it. Clients are created on
+first use (after .env is loaded); the SDKs of services a worker never calls are not imported.
+
+Embeddings use AZURE_EMBEDDING_ENDPOINT / AZURE_OPENAI_EMBEDDING_API_KEY /
+AZURE_OPENAI_EMBEDDING_MODEL_NAME everywhere. AZURE_OPENAI_ENDPOINT is only used for
+embeddings when AZURE_EMBEDDING_ENDPOINT is unset (db_helper used to read it).
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit
+
+API_VERSION = "2024-07-01-preview"
+
+_lock = threading.RLock()
+_clients = {}
+_ensured_indexes = set()
+_warned_embedding_fallback = False
+
+def _shared(key, factory):
+    with _lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+def azure_openai(endpoint=None, api_key=None):
+    """Shared AzureOpenAI client per endpoint and key (the main chat endpoint by default)."""
+    endpoint = endpoint or os.getenv("AZURE_OPENAI_ENDPOINT")
+    api_key = api_key or os.getenv("AZURE_OPENAI_API_KEY")
+
+    def create():
+        from openai import AzureOpenAI
+        return AzureOpenAI(api_version=API_VERSION, azure_endpoint=endpoint, api_key=api_key)
+
+    return _shared(("azure_openai", endpoint, api_key), create)
+
+def embedding_settings() -> dict:
+    """Endpoint, key and deployment of the embedding model."""
+    global _warned_embedding_fallback
+    endpoint = os.getenv("AZURE_EMBEDDING_ENDPOINT")
+    if not endpoint and os.getenv("AZURE_OPENAI_ENDPOINT"):
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        if not _warned_embedding_fallback:
+            _warned_embedding_fallback = True
+            print("⚠️ AZURE_EMBEDDING_ENDPOINT is not set, using AZURE_OPENAI_ENDPOINT for embeddings")
+    return {
+        "endpoint": endpoint,
+        "api_key": os.getenv("AZURE_OPENAI_EMBEDDING_API_KEY"),
+        "deployment": os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME", "text-embedding-3-small"),
+    }
+
+def pinecone():
+    def create():
+        from pinecone import Pinecone
+        return Pinecone(api_key=os.getenv("PINECONE_DB_API_KEY"))
+
+    return _shared("pinecone", create)
+
+def pinecone_index(name: str, dimension: int = None):
+    """Shared handle of a Pinecone index; with `dimension`, the index is created if missing."""
+    if dimension is not None:
+        with _lock:
+            if name not in _ensured_indexes:
+                pc = pinecone()
+                if name not in pc.list_indexes().names():
+                    from pinecone import ServerlessSpec
+                    pc.create_index(
+                        name=name,
+                        dimension=dimension,
+                        metric="cosine",
+                        spec=ServerlessSpec(cloud="aws", region="us-east-1")
+                    )
+                    print(f"🆕 Created Pinecone index '{name}' ({dimension} dimensions)")
+                _ensured_indexes.add(name)
+    return _shared(("pinecone_index", name), lambda: pinecone().Index(name))
+
+def elevenlabs():
+    def create():
+        from elevenlabs import ElevenLabs
+        return ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+
+    return _shared("elevenlabs", create)
+
+def created() -> list:
+    """The clients this process has built (for GET /metrics; never includes keys)."""
+    with _lock:
+        keys = list(_clients)
+    names = []
+    for key in keys:
+        if isinstance(key, str):
+            names.append(key)
+        elif key[0] == "azure_openai":
+            names.append(f"azure_openai:{urlsplit(key[1] or '').netloc}")
+        else:
+            names.append(f"pinecone_index:{key[1]}")
+    return sorted(names)
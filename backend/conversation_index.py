@@ -0,0 +1,415 @@
+"""
+Local search index over individual conversation records.
+
+Every saved conversation is also written to Pinecone (`conv_<session id>` in the
+ai-hoi-conversations index), but /search-history is served from this local index so its
+latency stays predictable as history grows:
+- vectors are appended to a flat file (float32 or int8, see vector_codec.py), memory-mapped
+  and scored in fixed-size chunks
+- time range, district and dish filters are NumPy masks / an inverted index, applied before scoring
+- results are paginated with a keyset cursor (last score or timestamp, and conversation ID), which
+  stays valid while records are added and across compactions
+
+Files (in CONVERSATION_INDEX_DIR, default backend/data/conversations):
+    vectors.<codec>  one L2-normalized row per record, in append order
+                     (CONVERSATION_INDEX_STORAGE=float32|int8; rebuild after changing it)
+    records.jsonl    one JSON line per row; a later row with the same id supersedes earlier ones
+
+A conversation is re-saved on every turn, so superseded rows accumulate. Once they make up more
+than CONVERSATION_INDEX_COMPACT_FRACTION (default 0.5) of at least 1000 rows, a background
+thread rewrites both files with only the latest row per conversation; workers notice the new
+files and reload them.
+
+    python conversation_index.py rebuild          # reload from the Pinecone conversation index
+    python conversation_index.py compact          # drop superseded rows now
+    python conversation_index.py migrate-legacy   # split the old single "all-conversations" vector
+"""
+
+import argparse
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from fusion_helper import fold
+from trend_views import district_of
+from vector_codec import get_codec
+
+INDEX_DIR = os.getenv(
+    "CONVERSATION_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'conversations')
+)
+STORAGE = os.getenv("CONVERSATION_INDEX_STORAGE", "float32")
+RECORD_PREFIX = "conv_"
+SCORE_CHUNK_ROWS = 65536   # rows scored per matrix product (bounds memory per query)
+MAX_PAGE_SIZE = 100
+COMPACT_FRACTION = float(os.getenv("CONVERSATION_INDEX_COMPACT_FRACTION", "0.5"))
+COMPACT_MIN_ROWS = 1000
+
+def to_timestamp(value) -> int:
+    """Epoch seconds from an epoch number or an ISO date/datetime string."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+def _query_fingerprint(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:12]
+
+def encode_cursor(key: float, record_id: str, fingerprint: str) -> str:
+    # The conversation ID, not the row: compaction renumbers rows
+    payload = json.dumps({"k": key, "i": record_id, "q": fingerprint}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+def decode_cursor(cursor: str, fingerprint: str):
+    """(key, conversation ID) of the last result of the previous page; ValueError if it belongs
+    to another query."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        key, record_id, query = float(data["k"]), str(data["i"]), data["q"]
+    except Exception:
+        raise ValueError("Malformed cursor")
+    if query != fingerprint:
+        raise ValueError("Cursor does not belong to this query")
+    return key, record_id
+
+class ConversationIndex:
+    def __init__(self, directory: str = INDEX_DIR, storage: str = STORAGE):
+        self.directory = directory
+        self.codec = get_codec(storage)
+        self.vectors_path = os.path.join(directory, f"vectors.{self.codec.name}")
+        self.records_path = os.path.join(directory, "records.jsonl")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self.lock = threading.Lock()
+        self.compacting = False
+        self._reset()
+
+    def _reset(self):
+        self.dim = None
+        self.rows = 0
+        self.records_inode = None   # compaction replaces the files: reload when this changes
+        self.records_file = None    # open records.jsonl of the loaded rows (survives a replace)
+        self.records_offset = 0     # bytes of records.jsonl already loaded
+        self.ids = []
+        self.line_offsets = []      # byte offset of each row's record line
+        self.latest = {}            # id -> latest row
+        self.alive = np.zeros(0, dtype=bool)
+        self.timestamps = np.zeros(0, dtype=np.int64)
+        self.districts = np.zeros(0, dtype=np.int32)
+        self.district_codes = {}    # folded district -> code
+        self.dish_rows = {}         # folded dish -> list of rows
+        self.vectors = None
+
+    def __len__(self):
+        self.refresh()
+        return len(self.latest)
+
+    # ---------------------- Writing ----------------------
+    def add(self, record_id: str, vector, metadata: dict):
+        """Append (or supersede) one conversation record."""
+        row = self.codec.encode(vector)
+        record = {
+            "id": record_id,
+            "summary": metadata.get("summary", ""),
+            "location": metadata.get("location", ""),
+            "district": metadata.get("district") or district_of(metadata.get("location", "")),
+            "dishes": list(metadata.get("dishes") or []),
+            "timestamp": to_timestamp(metadata.get("timestamp")) or int(datetime.now().timestamp()),
+            "message_count": metadata.get("message_count", 0),
+            "session_id": metadata.get("session_id"),
+            "dim": len(vector),
+        }
+        with self._file_lock(fcntl.LOCK_EX):
+            # The vector is written before its record line, so readers never see a record without one
+            with open(self.vectors_path, 'ab') as f:
+                f.write(row.tobytes())
+            with open(self.records_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    @contextmanager
+    def _file_lock(self, mode):
+        """Lock shared by the workers: exclusive for writers and compaction, shared for loading."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---------------------- Loading ----------------------
+    def refresh(self):
+        """Load records appended since the last call (by this or another worker)."""
+        with self.lock:
+            try:
+                stat = os.stat(self.records_path)
+            except OSError:
+                return
+            if stat.st_ino == self.records_inode and stat.st_size == self.records_offset:
+                return
+
+            with self._file_lock(fcntl.LOCK_SH):
+                try:
+                    stat = os.stat(self.records_path)
+                except OSError:
+                    return
+                if stat.st_ino != self.records_inode or stat.st_size < self.records_offset:
+                    self._reset()  # rebuilt or compacted
+                    self.records_inode = stat.st_ino
+                    self.records_file = open(self.records_path, 'rb')
+                new_rows = []
+                f = self.records_file
+                f.seek(self.records_offset)
+                offset = self.records_offset
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # partially written line, picked up next time
+                    new_rows.append((offset, json.loads(line)))
+                    offset += len(line)
+                self.records_offset = offset
+                self._append_rows(new_rows)
+
+            superseded = self.rows - len(self.latest)
+            if self.rows >= COMPACT_MIN_ROWS and superseded > COMPACT_FRACTION * self.rows and not self.compacting:
+                self.compacting = True
+                threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"⚠️ Conversation index compaction failed: {e}")
+        finally:
+            self.compacting = False
+
+    def compact(self) -> int:
+        """Rewrite the files with only the latest row of each conversation.
+        Returns the number of superseded rows dropped."""
+        with self._file_lock(fcntl.LOCK_EX):
+            if not os.path.exists(self.records_path):
+                return 0
+            latest, lines, dim = {}, 0, None
+            with open(self.records_path, 'rb') as f:
+                for line in f:
+                    record = json.loads(line)
+                    latest[record["id"]] = lines
+                    dim = dim or record["dim"]
+                    lines += 1
+            dropped = lines - len(latest)
+            if not dropped:
+                return 0
+
+            keep = np.zeros(lines, dtype=bool)
+            keep[list(latest.values())] = True
+            vectors = np.memmap(self.vectors_path, dtype=self.codec.row_dtype(dim), mode='r', shape=(lines,))
+            with open(f"{self.vectors_path}.tmp", 'wb') as f:
+                for start in range(0, lines, SCORE_CHUNK_ROWS):
+                    f.write(vectors[start:start + SCORE_CHUNK_ROWS][keep[start:start + SCORE_CHUNK_ROWS]].tobytes())
+            del vectors
+            with open(self.records_path, 'rb') as source, open(f"{self.records_path}.tmp", 'wb') as f:
+                for row, line in enumerate(source):
+                    if keep[row]:
+                        f.write(line)
+            # Vectors first: a reader that sees the new records file also finds the new vectors
+            os.replace(f"{self.vectors_path}.tmp", self.vectors_path)
+            os.replace(f"{self.records_path}.tmp", self.records_path)
+        print(f"🧹 Compacted conversation index: {len(latest)} records, {dropped} superseded rows dropped")
+        return dropped
+
+    def _append_rows(self, new_rows):
+        if not new_rows:
+            return
+        start = self.rows
+        count = len(new_rows)
+        self.alive = np.concatenate([self.alive, np.ones(count, dtype=bool)])
+        timestamps = np.empty(count, dtype=np.int64)
+        districts = np.empty(count, dtype=np.int32)
+        for i, (offset, record) in enumerate(new_rows):
+            row = start + i
+            previous = self.latest.get(record["id"])
+            if previous is not None:
+                self.alive[previous] = False
+            self.latest[record["id"]] = row
+            self.ids.append(record["id"])
+            self.line_offsets.append(offset)
+            timestamps[i] = record["timestamp"]
+            district = fold(record.get("district"))
+            districts[i] = self.district_codes.setdefault(district, len(self.district_codes))
+            for dish in {fold(d) for d in record.get("dishes", [])}:
+                if dish:
+                    self.dish_rows.setdefault(dish, []).append(row)
+        self.timestamps = np.concatenate([self.timestamps, timestamps])
+        self.districts = np.concatenate([self.districts, districts])
+        self.rows += count
+
+        if self.dim is None:
+            self.dim = new_rows[0][1]["dim"]
+        self.vectors = np.memmap(self.vectors_path, dtype=self.codec.row_dtype(self.dim), mode='r', shape=(self.rows,))
+
+    @staticmethod
+    def _record(records_file, line_offsets, end_offset, row: int) -> dict:
+        start = line_offsets[row]
+        end = line_offsets[row + 1] if row + 1 < len(line_offsets) else end_offset
+        return json.loads(os.pread(records_file.fileno(), end - start, start))
+
+    # ---------------------- Searching ----------------------
+    def _filter_rows(self, since=None, until=None, location=None, dish=None) -> np.ndarray:
+        mask = self.alive.copy()
+        if since is not None:
+            mask &= self.timestamps >= since
+        if until is not None:
+            mask &= self.timestamps <= until
+        if location:
+            code = self.district_codes.get(fold(district_of(location)))
+            if code is None:
+                return np.zeros(0, dtype=np.int64)
+            mask &= self.districts == code
+        if dish:
+            dish_mask = np.zeros(self.rows, dtype=bool)
+            dish_mask[self.dish_rows.get(fold(dish), [])] = True
+            mask &= dish_mask
+        return np.nonzero(mask)[0]
+
+    def _scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SCORE_CHUNK_ROWS):
+            chunk = rows[start:start + SCORE_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = self.codec.scores(self.vectors[chunk], query)
+        return scores
+
+    def search(self, vector=None, since=None, until=None, location=None, dish=None,
+               limit: int = 10, cursor: str = None, query_text: str = None):
+        """
+        Conversations matching the filters, most similar to `vector` first (newest first
+        without a vector). Returns (results, next_cursor); next_cursor is None on the last page.
+        `query_text` (the text `vector` embeds) ties cursors to the query that produced them.
+        """
+        self.refresh()
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        since, until = to_timestamp(since), to_timestamp(until)
+        fingerprint = _query_fingerprint(
+            query_text if vector is not None else None,
+            since, until, fold(location or ""), fold(dish or "")
+        )
+
+        with self.lock:
+            rows = self._filter_rows(since, until, location, dish)
+            if vector is not None and len(rows):
+                query = np.asarray(vector, dtype=np.float32)
+                keys = self._scores(rows, query / max(float(np.linalg.norm(query)), 1e-12))
+            else:
+                keys = self.timestamps[rows].astype(np.float64)
+            # Kept for reading the records: a compaction may replace the files meanwhile
+            records_file, line_offsets, end_offset = self.records_file, self.line_offsets, self.records_offset
+            ids = self.ids
+
+        if cursor:
+            last_key, last_id = decode_cursor(cursor, fingerprint)
+            after = keys < last_key
+            for i in np.nonzero(keys == last_key)[0]:
+                after[i] = ids[rows[i]] > last_id
+            rows, keys = rows[after], keys[after]
+
+        # Best first, ties broken by conversation ID so pages never overlap. Rows tied with the
+        # last one of the page are all kept until the IDs are compared.
+        if len(rows) > limit + 1:
+            threshold = -np.partition(-keys, limit)[limit]
+            top = keys >= threshold
+            rows, keys = rows[top], keys[top]
+        order = np.lexsort((np.array([ids[row] for row in rows], dtype=object), -keys))[:limit + 1]
+        rows, keys = rows[order], keys[order]
+
+        results = []
+        for row, key in zip(rows[:limit], keys[:limit]):
+            record = self._record(records_file, line_offsets, end_offset, int(row))
+            record.pop("dim", None)
+            record["score"] = float(key) if vector is not None else None
+            record["timestamp_iso"] = datetime.fromtimestamp(record["timestamp"]).isoformat()
+            results.append(record)
+
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(float(keys[limit - 1]), ids[rows[limit - 1]], fingerprint)
+        return results, next_cursor
+
+    def clear(self):
+        """Drop all local records (before a rebuild)."""
+        with self.lock:
+            for path in (self.vectors_path, self.records_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._reset()
+
+conversation_index = ConversationIndex()
+
+# ---------------------- Maintenance CLI ----------------------
+def _pinecone_index():
+    from dotenv import load_dotenv
+    import clients
+    load_dotenv()
+    return clients.pinecone_index("ai-hoi-conversations")
+
+def rebuild(index):
+    """Replace the local index with the conversation records stored in Pinecone."""
+    conversation_index.clear()
+    total = 0
+    for ids in index.list(prefix=RECORD_PREFIX):
+        for start in range(0, len(ids), 100):
+            fetched = index.fetch(ids=ids[start:start + 100])
+            for vector_id, vector in fetched.vectors.items():
+                conversation_index.add(vector_id, vector.values, vector.metadata or {})
+                total += 1
+    print(f"✅ Rebuilt local conversation index with {total} records")
+
+def migrate_legacy(index):
+    """Split the summaries packed into the old "all-conversations" vector into individual records."""
+    from db_helper import get_embeddings
+    existing = index.fetch(ids=["all-conversations"])
+    if "all-conversations" not in existing.vectors:
+        print("📭 No legacy conversation vector found")
+        return
+    summaries = json.loads(existing.vectors["all-conversations"].metadata.get("summaries_json", "[]"))
+    for start in range(0, len(summaries), 100):
+        batch = summaries[start:start + 100]
+        embeddings = get_embeddings([s["summary"] for s in batch])
+        vectors = []
+        for offset, (entry, embedding) in enumerate(zip(batch, embeddings)):
+            record_id = f"{RECORD_PREFIX}legacy_{start + offset}"
+            metadata = {
+                "summary": entry["summary"],
+                "location": entry.get("location", ""),
+                "district": district_of(entry.get("location", "")),
+                "dishes": [],
+                "timestamp": to_timestamp(entry.get("timestamp")) or int(datetime.now().timestamp()),
+                "message_count": entry.get("message_count", 0),
+            }
+            vectors.append({"id": record_id, "values": embedding, "metadata": metadata})
+            conversation_index.add(record_id, embedding, metadata)
+        index.upsert(vectors=vectors)
+    print(f"✅ Migrated {len(summaries)} legacy conversation summaries")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the local conversation search index")
+    parser.add_argument('command', choices=['rebuild', 'migrate-legacy', 'compact'])
+    args = parser.parse_args(argv)
+    if args.command == 'compact':
+        conversation_index.compact()
+        return
+    index = _pinecone_index()
+    if args.command == 'rebuild':
+        rebuild(index)
+    else:
+        migrate_legacy(index)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
-from openai import AzureOpenAI
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
 import os
+import hashlib
+import clients
+from batch_helper import batch_shared
+from deployment_pool import get_pool
+from singleflight import single_flight
+from vector_codec import embedding_dimensions, embedding_params
 
 load_dotenv()
 def is_env_missing(var):
@@ -9,67 +13,56 @@ def is_env_missing(var):
     return v is None or v.strip() == ""
 
 if (
-    is_env_missing("AZURE_OPENAI_ENDPOINT") or
+    (is_env_missing("AZURE_EMBEDDING_ENDPOINT") and is_env_missing("AZURE_OPENAI_ENDPOINT")) or
     is_env_missing("AZURE_OPENAI_EMBEDDING_API_KEY") or
     is_env_missing("AZURE_OPENAI_EMBEDDING_MODEL_NAME") or
     is_env_missing("PINECONE_DB_API_KEY")
 ):
     raise ValueError("Please set your environment variables.")
 
-embedding_client = AzureOpenAI(
-    api_version="2024-07-01-preview",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_key=os.getenv("AZURE_OPENAI_EMBEDDING_API_KEY"),
-)
-pc = Pinecone(api_key=os.getenv("PINECONE_DB_API_KEY"))
-
 index_name = "ai-hoi"
 
-# Create index if it doesn't exist
-if index_name not in [index["name"] for index in pc.list_indexes()]:
-    pc.create_index(name=index_name, dimension=1536, metric="cosine", spec=ServerlessSpec(cloud="aws", region="us-east-1"))
-
-index = pc.Index(index_name)
+def get_index():
+    """Shared handle of the restaurant index (created on first use if it doesn't exist)."""
+    return clients.pinecone_index(index_name, dimension=embedding_dimensions())
 
+@batch_shared("db_embedding")
+@single_flight("db_embedding")
 def get_embedding(text):
-    response = embedding_client.embeddings.create(
-        input=text,
-        model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME")
-    )
+    response = get_pool("embedding").embed(text, **embedding_params())
     return response.data[0].embedding
 
+def get_embeddings(texts):
+    """Embed several texts with a single API call, preserving input order."""
+    response = get_pool("embedding").embed(texts, **embedding_params())
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
 # Upsert embeddings into Pinecone
-def upsert_data(text, namespace):
+def upsert_data(text, namespace, vector_id=None):
     try:
         embedding = get_embedding(text)
         # Create vector with ID and metadata
         vector = {
-            'id': str(hash(text)),  # Create a unique ID for the vector
+            # Content-derived ID: re-ingesting the same text overwrites instead of duplicating
+            'id': vector_id or hashlib.sha1(text.encode('utf-8')).hexdigest(),
             'values': embedding,
             'metadata': {'text': text}
         }
         # Upsert to specified namespace
-        index.upsert(vectors=[vector], namespace=namespace)
+        get_index().upsert(vectors=[vector], namespace=namespace)
         return True
     except Exception as e:
         print(f"Error upserting data: {e}")
         return False
     
-def query_data(query_text, top_k=5, namespace=None):
-    try:
-        query_embedding = get_embedding(query_text)
-        response = index.query(
-            vector=query_embedding,
-            top_k=top_k,
-            include_metadata=True,
-            namespace=namespace
-        )
-        # Extract and return only the text from metadata
-        results = []
-        for match in response['matches']:
-            if match['metadata'] and 'text' in match['metadata']:
-                results.append(match['metadata']['text'])
-        return results
-    except Exception as e:
-        print(f"Error querying data: {e}")
-        return []
\ No newline at end of file
+# Bulk variant of upsert_data: one embedding call and one upsert request per batch.
+# Errors are raised (not swallowed) so callers can report which batch failed.
+def upsert_batch(texts, namespace, vector_ids=None):
+    embeddings = get_embeddings(texts)
+    vector_ids = vector_ids or [hashlib.sha1(text.encode('utf-8')).hexdigest() for text in texts]
+    vectors = [
+        {'id': vector_id, 'values': embedding, 'metadata': {'text': text}}
+        for vector_id, embedding, text in zip(vector_ids, embeddings, texts)
+    ]
+    get_index().upsert(vectors=vectors, namespace=namespace)
+    return len(vectors)
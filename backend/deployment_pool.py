@@ -0,0 +1,292 @@
+"""
+Pools of Azure OpenAI (or OpenAI-compatible) deployments for chat completions and embeddings.
+
+Each call goes to the healthy deployment with the lowest expected latency, weighted by the
+requests it already has in flight and skipping deployments whose tokens-per-minute budget is
+used up. Deployments that keep failing (or return 429) are ejected for a cool-down that grows
+while they keep failing; the call itself fails over to the next deployment. Rejected requests
+(400, 422 content filter) are the caller's fault and count against no deployment. Slow calls can
+optionally be hedged: after AZURE_OPENAI_<KIND>_HEDGE_AFTER_SECONDS a second deployment gets
+the same request and the first answer wins.
+
+Pools are configured with a JSON list per kind (CHAT or EMBEDDING):
+
+    AZURE_OPENAI_CHAT_POOL='[
+        {"name": "eastus", "endpoint": "https://...", "api_key": "...", "deployment": "gpt-4o", "tpm": 150000},
+        {"name": "stub", "base_url": "http://localhost:9001/v1", "api_key": "x", "deployment": "stub"}
+    ]'
+
+Entries with "base_url" use the plain OpenAI client (e.g. local stubs, see
+benchmarks/openai_stub.py). Without a pool variable the pool holds the single deployment
+from AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_MODEL_NAME (chat) or AZURE_EMBEDDING_ENDPOINT /
+AZURE_OPENAI_EMBEDDING_MODEL_NAME (embeddings).
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from openai import OpenAI
+
+import clients
+import metrics_helper
+from admission_helper import TpmBudget
+
+EJECT_AFTER_FAILURES = int(os.getenv("AZURE_OPENAI_EJECT_AFTER_FAILURES", "3"))
+EJECT_BASE_SECONDS = float(os.getenv("AZURE_OPENAI_EJECT_SECONDS", "30"))
+EJECT_MAX_SECONDS = 300
+LATENCY_SMOOTHING = 0.2  # EWMA weight of the newest sample
+
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+def _retryable(error: Exception) -> bool:
+    """Errors worth retrying on another deployment (not invalid requests)."""
+    status = getattr(error, "status_code", None)
+    return status is None or status in (408, 409, 429) or status >= 500
+
+def _retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+def estimate_tokens(payload, max_tokens=None) -> int:
+    """Rough token count of a request (≈ 3 characters per token for Vietnamese text)."""
+    return len(json.dumps(payload, ensure_ascii=False)) // 3 + (max_tokens or 0)
+
+class Backend:
+    def __init__(self, name: str, client, deployment: str, tpm: float = 0):
+        self.name = name
+        self.client = client
+        self.deployment = deployment
+        self.budget = TpmBudget(tpm)
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.latency_ms = None   # EWMA of successful calls
+        self.failures = 0        # consecutive
+        self.ejections = 0       # consecutive, grows the cool-down
+        self.ejected_until = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def load(self) -> float:
+        """Expected wait: smoothed latency times requests already in flight (+1 for this one)."""
+        return ((self.latency_ms or 0.0) + 1.0) * (self.outstanding + 1)
+
+    def started(self):
+        with self.lock:
+            self.outstanding += 1
+            self.calls += 1
+
+    def succeeded(self, elapsed_ms: float, tokens: int):
+        with self.lock:
+            self.outstanding -= 1
+            self.failures = self.ejections = 0
+            self.latency_ms = elapsed_ms if self.latency_ms is None else (
+                LATENCY_SMOOTHING * elapsed_ms + (1 - LATENCY_SMOOTHING) * self.latency_ms
+            )
+        if tokens:
+            self.budget.record(tokens)
+
+    def failed(self, error: Exception):
+        with self.lock:
+            self.outstanding -= 1
+            if not _retryable(error):
+                # The request was rejected (400, 422 content filter...), the deployment is fine:
+                # bad prompts must not eject it
+                return
+            self.errors += 1
+            self.failures += 1
+            rate_limited = getattr(error, "status_code", None) == 429
+            if not (rate_limited or self.failures >= EJECT_AFTER_FAILURES):
+                return
+            cool_down = _retry_after(error) or min(EJECT_BASE_SECONDS * 2 ** self.ejections, EJECT_MAX_SECONDS)
+            self.ejected_until = time.monotonic() + cool_down
+            self.ejections += 1
+            self.failures = 0
+        print(f"⚠️ Deployment '{self.name}' ejected for {cool_down:.0f}s after: {error}")
+
+    def to_dict(self) -> dict:
+        now = time.monotonic()
+        return {
+            "deployment": self.deployment,
+            "healthy": self.healthy(now),
+            "ejected_for_seconds": round(max(0.0, self.ejected_until - now), 1),
+            "outstanding": self.outstanding,
+            "avg_latency_ms": round(self.latency_ms or 0.0, 1),
+            "calls": self.calls,
+            "errors": self.errors,
+            "tpm": self.budget.usage(),
+        }
+
+class DeploymentPool:
+    def __init__(self, kind: str, backends: list, hedge_after: float = 0):
+        if not backends:
+            raise ValueError(f"Deployment pool '{kind}' has no deployments")
+        self.kind = kind
+        self.backends = backends
+        self.hedge_after = hedge_after
+
+    def __len__(self):
+        return len(self.backends)
+
+    @classmethod
+    def from_env(cls, kind: str) -> "DeploymentPool":
+        prefix = f"AZURE_OPENAI_{kind.upper()}"
+        raw = os.getenv(f"{prefix}_POOL")
+        if raw:
+            entries = json.loads(raw)
+        elif kind == "chat":
+            entries = [{"name": "default", "endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+                        "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+                        "deployment": os.getenv("AZURE_OPENAI_MODEL_NAME")}]
+        else:
+            entries = [{"name": "default", **clients.embedding_settings()}]
+
+        backends = []
+        for position, entry in enumerate(entries):
+            if entry.get("base_url"):
+                client = OpenAI(base_url=entry["base_url"], api_key=entry.get("api_key") or "unused")
+            else:
+                client = clients.azure_openai(entry["endpoint"], entry["api_key"])
+            backends.append(Backend(
+                entry.get("name") or f"{kind}-{position}",
+                client,
+                entry["deployment"],
+                float(entry.get("tpm", 0)),
+            ))
+        hedge_after = float(os.getenv(f"{prefix}_HEDGE_AFTER_SECONDS") or 0)
+        return cls(kind, backends, hedge_after)
+
+    def _pick(self, exclude: set, tokens: int):
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b.name not in exclude]
+        if not candidates:
+            return None
+        healthy = [b for b in candidates if b.healthy(now)]
+        if not healthy:
+            # Everything is ejected: try the one that comes back first rather than failing outright
+            return min(candidates, key=lambda b: b.ejected_until)
+        within_budget = [b for b in healthy if b.budget.wait_time(tokens) == 0]
+        return min(within_budget or healthy, key=lambda b: b.load())
+
+    def _run(self, backend: Backend, fn):
+        backend.started()
+        started = time.perf_counter()
+        try:
+            response = fn(backend.client, backend.deployment)
+        except Exception as e:
+            backend.failed(e)
+            metrics_helper.incr(f"pool.{self.kind}.{backend.name}.errors")
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        usage = getattr(response, "usage", None)
+        backend.succeeded(elapsed_ms, getattr(usage, "total_tokens", 0) or 0)
+        metrics_helper.observe(f"pool.{self.kind}.{backend.name}.latency_ms", elapsed_ms)
+        return response
+
+    def call(self, fn, tokens: int = 0):
+        """
+        Run `fn(client, deployment)` on the best deployment, failing over to the others on
+        retryable errors (and hedging slow calls when enabled).
+        """
+        if self.hedge_after > 0 and len(self.backends) > 1:
+            return self._call_hedged(fn, tokens)
+        tried, last_error = set(), None
+        while True:
+            backend = self._pick(tried, tokens)
+            if backend is None:
+                raise last_error
+            tried.add(backend.name)
+            try:
+                return self._run(backend, fn)
+            except Exception as e:
+                if not _retryable(e):
+                    raise
+                last_error = e
+                metrics_helper.incr(f"pool.{self.kind}.failovers")
+
+    def _call_hedged(self, fn, tokens: int):
+        tried, pending, last_error = set(), {}, None
+
+        def submit():
+            backend = self._pick(tried, tokens)
+            if backend is None:
+                return False
+            tried.add(backend.name)
+            # Copy the context so token usage is still accounted to the admitted request
+            context = contextvars.copy_context()
+            pending[_hedge_executor.submit(context.run, self._run, backend, fn)] = backend
+            return True
+
+        submit()
+        primary = next(iter(pending.values()))
+        hedged = False
+        while pending:
+            timeout = self.hedge_after if not hedged else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                if submit():
+                    metrics_helper.incr(f"pool.{self.kind}.hedged")
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    if not _retryable(e):
+                        raise
+                    last_error = e
+                    continue
+                if backend is not primary:
+                    metrics_helper.incr(f"pool.{self.kind}.hedge_wins")
+                return response
+            if not pending:
+                metrics_helper.incr(f"pool.{self.kind}.failovers")
+                submit()
+        raise last_error
+
+    def chat(self, messages: list, **kwargs):
+        tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+        return self.call(
+            lambda client, deployment: client.chat.completions.create(model=deployment, messages=messages, **kwargs),
+            tokens
+        )
+
+    def embed(self, input, **kwargs):
+        return self.call(
+            lambda client, deployment: client.embeddings.create(model=deployment, input=input, **kwargs),
+            estimate_tokens(input)
+        )
+
+    def stats(self) -> dict:
+        counters = metrics_helper.snapshot()["counters"]
+        return {
+            "hedge_after_seconds": self.hedge_after,
+            "failovers": int(counters.get(f"pool.{self.kind}.failovers", 0)),
+            "hedged": int(counters.get(f"pool.{self.kind}.hedged", 0)),
+            "hedge_wins": int(counters.get(f"pool.{self.kind}.hedge_wins", 0)),
+            "deployments": {backend.name: backend.to_dict() for backend in self.backends},
+        }
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(kind: str) -> DeploymentPool:
+    """The process-wide pool for "chat" or "embedding" (built on first use, after .env is loaded)."""
+    with _pools_lock:
+        if kind not in _pools:
+            _pools[kind] = DeploymentPool.from_env(kind)
+        return _pools[kind]
+
+def stats() -> dict:
+    return {kind: pool.stats() for kind, pool in _pools.items()}
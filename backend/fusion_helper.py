@@ -0,0 +1,207 @@
+"""
+Candidate fusion: merge restaurant records from the RAG knowledge base and Foursquare
+into one de-duplicated, ranked and bounded list for the prompt.
+
+Scoring and de-duplication are vectorized with NumPy:
+- relevance: RAG similarity score, or search rank for Foursquare results
+- distance: from the search centre (Foursquare distance or coordinates)
+- price fit: against the budget found in the user's question
+- duplicates: fuzzy name match (character trigram cosine) plus proximity
+"""
+
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+MAX_CANDIDATES = 8
+TRIGRAM_DIMS = 512            # hashed character-trigram space for fuzzy name matching
+NAME_SIMILARITY = 0.75        # cosine above which two names are considered the same place
+ADDRESS_SIMILARITY = 0.45
+SAME_PLACE_METERS = 250
+DISTANCE_SCALE_METERS = 1500  # distance score halves roughly every ~1 km
+
+WEIGHTS = {"relevance": 0.5, "distance": 0.3, "price": 0.2}
+
+# Approximate spend per person (VND) for Foursquare price tiers 1..4
+PRICE_TIER_VND = {1: 50_000, 2: 150_000, 3: 350_000, 4: 700_000}
+
+_AMOUNT_RE = re.compile(r'(\d+(?:[.,]\d{3})*(?:[.,]\d+)?)\s*(k|nghìn|ngàn|ngan|nghin|tr|triệu|trieu|đ|d|vnd|vnđ)?\b', re.IGNORECASE)
+_BUDGET_HINT_RE = re.compile(r'(dưới|duoi|không quá|khong qua|tối đa|toi da|<=?|max|under|below|budget|khoảng|khoang|tầm|tam)\s*', re.IGNORECASE)
+
+def fold(text: str) -> str:
+    """Lowercase, strip Vietnamese diacritics and punctuation."""
+    text = unicodedata.normalize("NFD", (text or "").lower()).replace("đ", "d")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+def _amount_vnd(number: str, unit: str) -> float:
+    unit = (unit or "").lower()
+    if unit in ("k", "nghìn", "ngàn", "ngan", "nghin"):
+        return float(number.replace(",", ".")) * 1000
+    if unit in ("tr", "triệu", "trieu"):
+        return float(number.replace(",", ".")) * 1_000_000
+    return float(number.replace(",", "").replace(".", ""))
+
+def parse_budget(text: str):
+    """Budget per person in VND mentioned in the question ("dưới 50k", "tầm 100 nghìn"), or None."""
+    hint = _BUDGET_HINT_RE.search(text or "")
+    if not hint:
+        return None
+    match = _AMOUNT_RE.search(text, hint.end())
+    if not match or match.start() - hint.end() > 3:
+        return None
+    amount = _amount_vnd(match.group(1), match.group(2))
+    # Bare small numbers ("dưới 50") mean thousands of VND
+    return amount * 1000 if amount < 1000 else amount
+
+def parse_price_range(price_range: str):
+    """Midpoint of a "25,000 - 45,000 VNĐ" style range, or None."""
+    amounts = [_amount_vnd(m.group(1), m.group(2) or "đ") for m in _AMOUNT_RE.finditer(price_range or "")]
+    amounts = [a * 1000 if a < 1000 else a for a in amounts]
+    return sum(amounts) / len(amounts) if amounts else None
+
+def _trigram_matrix(texts: list) -> np.ndarray:
+    """L2-normalized hashed character-trigram counts, one row per text."""
+    matrix = np.zeros((len(texts), TRIGRAM_DIMS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        padded = f"  {fold(text)} "
+        for i in range(len(padded) - 2):
+            matrix[row, zlib.crc32(padded[i:i + 3].encode()) % TRIGRAM_DIMS] += 1
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def _haversine_matrix(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Pairwise distances in metres (NaN where a coordinate is missing)."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin(dlon / 2) ** 2
+    return 2 * 6_371_000 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def _float_array(records: list, key: str) -> np.ndarray:
+    return np.array([np.nan if r.get(key) is None else float(r[key]) for r in records], dtype=np.float64)
+
+def score_candidates(records: list, budget=None, origin=None) -> np.ndarray:
+    """Combined relevance / distance / price-fit score for each record."""
+    n = len(records)
+    relevance = _float_array(records, "score")
+    # Foursquare results carry no similarity score: use their rank within the source
+    ranks = np.array([r.get("rank", 0) for r in records], dtype=np.float64)
+    relevance = np.where(np.isnan(relevance), 1.0 - 0.5 * ranks, relevance)
+
+    distance = _float_array(records, "distance")
+    if origin is not None:
+        lat, lon = _float_array(records, "lat"), _float_array(records, "lon")
+        computed = _haversine_matrix(np.append(lat, origin[0]), np.append(lon, origin[1]))[-1, :-1]
+        distance = np.where(np.isnan(distance), computed, distance)
+    distance_score = np.where(np.isnan(distance), 0.5, np.exp(-np.nan_to_num(distance) / DISTANCE_SCALE_METERS))
+
+    price = _float_array(records, "price_vnd")
+    if budget:
+        over = np.maximum(np.nan_to_num(price, nan=budget) - budget, 0) / budget
+        price_score = np.where(np.isnan(price), 0.5, np.exp(-2 * over))
+    else:
+        price_score = np.full(n, 0.5)
+
+    return (
+        WEIGHTS["relevance"] * relevance
+        + WEIGHTS["distance"] * distance_score
+        + WEIGHTS["price"] * price_score
+    )
+
+def duplicate_groups(records: list) -> np.ndarray:
+    """Group label per record; records sharing a label are the same restaurant."""
+    n = len(records)
+    names = _trigram_matrix([r.get("name", "") for r in records])
+    addresses = _trigram_matrix([r.get("address", "") for r in records])
+    name_sim = names @ names.T
+    address_sim = addresses @ addresses.T
+    has_address = np.array([bool(r.get("address")) for r in records])
+
+    lat, lon = _float_array(records, "lat"), _float_array(records, "lon")
+    meters = _haversine_matrix(lat, lon)
+    has_coords = ~(np.isnan(lat) | np.isnan(lon))
+    both_coords = has_coords[:, None] & has_coords[None, :]
+    both_addresses = has_address[:, None] & has_address[None, :]
+
+    near = np.where(
+        both_coords,
+        np.nan_to_num(meters, nan=np.inf) < SAME_PLACE_METERS,
+        np.where(both_addresses, address_sim >= ADDRESS_SIMILARITY, True),
+    )
+    same = (name_sim >= NAME_SIMILARITY) & near
+
+    # Connected components over the (small) duplicate graph
+    labels = np.arange(n)
+    for i, j in zip(*np.nonzero(np.triu(same, k=1))):
+        old, new = labels[j], labels[i]
+        labels[labels == old] = new
+    return labels
+
+def fuse_candidates(rag_records: list, place_records: list, budget=None, origin=None,
+                    max_results: int = MAX_CANDIDATES) -> list:
+    """Merge, de-duplicate and rank candidates from both sources (best first, at most max_results)."""
+    records = []
+    for source in (rag_records, place_records):
+        for rank, record in enumerate(source):
+            record = dict(record, rank=rank / len(source))  # 0 = top result of its source
+            if record.get("price_vnd") is None:
+                if record.get("price_range"):
+                    record["price_vnd"] = parse_price_range(record["price_range"])
+                elif record.get("price") in PRICE_TIER_VND:
+                    record["price_vnd"] = PRICE_TIER_VND[record["price"]]
+            records.append(record)
+    if not records:
+        return []
+
+    scores = score_candidates(records, budget, origin)
+    labels = duplicate_groups(records)
+
+    fused = []
+    for label in np.unique(labels):
+        members = np.nonzero(labels == label)[0]
+        members = members[np.argsort(-scores[members])]
+        best = dict(records[members[0]])
+        for other in members[1:]:
+            for key, value in records[other].items():
+                if best.get(key) in (None, "", []) and value not in (None, "", []):
+                    best[key] = value
+        sources = sorted({records[m]["source"] for m in members})
+        best["sources"] = sources
+        # Found by both the knowledge base and Foursquare: corroborated, rank it higher
+        best["fused_score"] = float(scores[members[0]]) + 0.05 * (len(sources) - 1)
+        best.pop("rank", None)
+        fused.append(best)
+
+    fused.sort(key=lambda r: r["fused_score"], reverse=True)
+    return fused[:max_results]
+
+def format_candidates(candidates: list) -> str:
+    """Ranked candidate list for the LLM prompt."""
+    if not candidates:
+        return "Không tìm thấy nhà hàng phù hợp."
+    lines = []
+    for idx, c in enumerate(candidates, start=1):
+        parts = [f"{idx}. **{c['name']}**"]
+        if c.get("address"):
+            parts.append(f"— {c['address']}")
+        if c.get("distance") is not None:
+            parts.append(f"(≈ {int(c['distance'])} m)")
+        details = []
+        if c.get("specialties"):
+            details.append(f"Món đặc sắc: {c['specialties']}")
+        if c.get("price_range"):
+            details.append(f"Giá: {c['price_range']}")
+        elif c.get("price") in PRICE_TIER_VND:
+            details.append(f"Mức giá: {'$' * c['price']}")
+        if c.get("categories"):
+            details.append(f"Loại: {', '.join(c['categories'])}")
+        if c.get("description"):
+            details.append(f"Mô tả: {c['description']}")
+        line = " ".join(parts)
+        if details:
+            line += " | " + " | ".join(details)
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,211 @@
+"""
+Offline geocoder for well-known Vietnamese places (cities, districts, wards, landmarks).
+
+Place names from data/gazetteer_vn.txt (override with GAZETTEER_PATH) are indexed in a
+token trie over their folded form (lowercase, no diacritics), so "Quận 1", "quan 1", "Q.1",
+"q1" and "District 1" are the same key, and "TP.HCM" / "Sài Gòn" / "SG" all name the city.
+One typo per name is tolerated for words of four letters or more ("Binh Thnah").
+
+lookup() only answers when the whole text is made of known names (plus filler words such as
+"gần", "khu vực", "Việt Nam"): "Chợ Bến Thành, Quận 1" resolves locally, while a street
+address like "12 Lê Lợi, Quận 1" is left to Nominatim, which knows streets. So is a district
+or ward named with a city it is not in ("Quận 3, Đà Nẵng").
+"""
+
+import math
+import os
+import re
+import threading
+
+from fusion_helper import fold
+
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer_vn.txt')
+)
+
+# Most specific first: the most specific place named in a text wins
+KIND_RANK = {"landmark": 0, "ward": 1, "district": 2, "city": 3}
+PREFIXES = ("quan", "huyen", "phuong", "xa", "thi tran", "thi xa", "thanh pho", "tinh")
+ABBREVIATIONS = {
+    "q": "quan", "dist": "quan", "district": "quan",
+    "p": "phuong", "ward": "phuong",
+    "h": "huyen", "tx": "thi xa", "tt": "thi tran",
+    "tp": "thanh pho", "city": "thanh pho",
+}
+FILLER_WORDS = {
+    "o", "tai", "gan", "quanh", "khu", "vuc", "day", "thanh", "pho", "tinh",
+    "viet", "nam", "vietnam", "vn", "in", "at", "near", "around", "the", "area",
+}
+MIN_FUZZY_LENGTH = 4
+
+# "q1", "P.12", "quận 01", "D7" -> "quan 1" / "phuong 12" / "quan 7"
+_NUMBERED_RE = re.compile(r"\b(q|quan|d|dist|district|p|phuong|ward)\s*0*(\d{1,2})\b")
+_NUMBERED_PREFIX = {"q": "quan", "quan": "quan", "d": "quan", "dist": "quan", "district": "quan",
+                    "p": "phuong", "phuong": "phuong", "ward": "phuong"}
+
+def normalize(text: str) -> list:
+    """Folded tokens of a place text with administrative abbreviations expanded."""
+    text = _NUMBERED_RE.sub(lambda m: f"{_NUMBERED_PREFIX[m.group(1)]} {m.group(2)}", fold(text))
+    return " ".join(ABBREVIATIONS.get(token, token) for token in text.split()).split()
+
+def _deletions(token: str) -> set:
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+def _one_edit(a: str, b: str) -> bool:
+    """True when a and b differ by one insertion, deletion, substitution or adjacent swap."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1
+                                  and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    shorter, longer = (a, b) if len(a) < len(b) else (b, a)
+    return any(longer[:i] + longer[i + 1:] == shorter for i in range(len(longer)))
+
+class _Node:
+    __slots__ = ("children", "places")
+
+    def __init__(self):
+        self.children = {}
+        self.places = []
+
+class Gazetteer:
+    def __init__(self, places: list):
+        self.places = places
+        self._root = _Node()
+        self._near = {}  # deletion variant -> vocabulary words (typo candidates)
+        for place in places:
+            for name in [place["name"]] + place["aliases"]:
+                tokens = normalize(name)
+                self._insert(tokens, place)
+                for prefix in PREFIXES:
+                    rest = tokens[len(prefix.split()):]
+                    if " ".join(tokens).startswith(prefix + " ") and rest and not rest[0].isdigit():
+                        self._insert(rest, place)  # "Quận Bình Thạnh" is also "Bình Thạnh"
+                        break
+
+    @classmethod
+    def load(cls, path: str = GAZETTEER_PATH):
+        places = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                kind, name, parent, lat, lon, aliases = line.split("|")
+                places.append({
+                    "name": name, "kind": kind, "parent": parent or None,
+                    "lat": float(lat), "lon": float(lon),
+                    "aliases": [alias.strip() for alias in aliases.split(";") if alias.strip()],
+                })
+        return cls(places)
+
+    def _insert(self, tokens: list, place: dict):
+        node = self._root
+        for token in tokens:
+            node = node.children.setdefault(token, _Node())
+            if len(token) >= MIN_FUZZY_LENGTH and not token.isdigit():
+                for variant in _deletions(token) | {token}:
+                    self._near.setdefault(variant, set()).add(token)
+        if place not in node.places:
+            node.places.append(place)
+
+    def _typo_candidates(self, token: str) -> set:
+        if len(token) < MIN_FUZZY_LENGTH or token.isdigit():
+            return set()
+        found = set()
+        for variant in _deletions(token) | {token}:
+            found |= self._near.get(variant, set())
+        found.discard(token)
+        return {word for word in found if _one_edit(token, word)}
+
+    def _longest_match(self, tokens: list, start: int):
+        """(end, typos, places) of the longest name starting at tokens[start], fewest typos first."""
+        best = None
+        stack = [(self._root, start, 0)]
+        while stack:
+            node, i, typos = stack.pop()
+            if node.places and i > start and (best is None or (i, -typos) > (best[0], -best[1])):
+                best = (i, typos, node.places)
+            if i == len(tokens):
+                continue
+            child = node.children.get(tokens[i])
+            if child is not None:
+                stack.append((child, i + 1, typos))
+            if typos == 0:
+                for word in self._typo_candidates(tokens[i]):
+                    if word in node.children:
+                        stack.append((node.children[word], i + 1, 1))
+        return best
+
+    def lookup(self, text: str):
+        """The most specific place named in `text`, or None when the text is not fully made of
+        known names (e.g. it contains a street address)."""
+        tokens = normalize(text or "")
+        matches, i = [], 0
+        while i < len(tokens):
+            match = self._longest_match(tokens, i)
+            if tokens[i] in FILLER_WORDS and (match is None or match[1] > 0):
+                i += 1  # "tỉnh Khánh Hòa" is not a typo of "Vĩnh Khánh"
+            elif match is not None:
+                matches.append(match)
+                i = match[0]
+            else:
+                return None
+        if not matches:
+            return None
+
+        # Names shared by several places ("Tân Phú") are resolved with the city named alongside.
+        # A name with no candidate in that city is a place we don't know ("Tân Phú, Đồng Nai" is
+        # not the Tân Phú of Hồ Chí Minh): leave it to Nominatim
+        cities = {place["name"] for _, _, places in matches for place in places if place["kind"] == "city"}
+        chosen = []
+        for _, typos, places in matches:
+            if cities:
+                places = [p for p in places if p["kind"] == "city" or p["parent"] in cities]
+                if not places:
+                    return None
+            place = places[0]
+            chosen.append((KIND_RANK.get(place["kind"], len(KIND_RANK)), typos, place))
+        _, typos, place = min(chosen, key=lambda item: (item[0], item[1]))
+        return _result(place, typos > 0)
+
+    def nearest(self, lat: float, lon: float, kind: str = "district", max_km: float = 8.0):
+        """The place of `kind` whose centroid is closest to (lat, lon), within max_km, or None."""
+        best, best_km = None, max_km
+        for place in self.places:
+            if place["kind"] != kind:
+                continue
+            # Equirectangular approximation: plenty at city scale
+            dx = math.radians(place["lon"] - lon) * math.cos(math.radians((place["lat"] + lat) / 2))
+            km = 6371.0 * math.hypot(dx, math.radians(place["lat"] - lat))
+            if km <= best_km:
+                best, best_km = place, km
+        return _result(best, False) if best else None
+
+def _result(place: dict, fuzzy: bool) -> dict:
+    return {
+        "name": place["name"], "kind": place["kind"], "parent": place["parent"],
+        "lat": place["lat"], "lon": place["lon"], "fuzzy": fuzzy,
+    }
+
+_gazetteer = None
+_lock = threading.Lock()
+
+def get_gazetteer() -> Gazetteer:
+    global _gazetteer
+    if _gazetteer is None:
+        with _lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer.load()
+                print(f"🗺️ Gazetteer loaded: {len(_gazetteer.places)} places")
+    return _gazetteer
+
+def lookup(text: str):
+    """Place record ({name, kind, parent, lat, lon, fuzzy}) for a well-known place text, or None."""
+    return get_gazetteer().lookup(text)
+
+def nearest(lat: float, lon: float, kind: str = "district", max_km: float = 8.0):
+    """Place record of the nearest known place of `kind` within max_km, or None."""
+    return get_gazetteer().nearest(lat, lon, kind, max_km)
@@ -0,0 +1,99 @@
+"""
+Idempotency keys for POST /chat.
+
+A client that may retry sends a unique `Idempotency-Key` header (e.g. a UUID per message).
+Every request with the same key gets the answer of the first one:
+- while the first request is still being answered, retries wait for that same computation
+  (nothing is re-run, and the computation continues even if the first client gave up)
+- once it is answered, the stored response is replayed for IDEMPOTENCY_TTL_SECONDS
+  (default 600) with an `Idempotent-Replayed: true` header
+- a failed computation is not stored, so the next retry runs it again
+
+Reusing a key for a different message is rejected with 422. Responses are kept in this
+worker's memory, so retries must reach the same worker to be de-duplicated.
+
+claim_save() lets one conversation save per (session, Idempotency-Key) through per TTL, so a
+retried message is not summarized and upserted again even when its first computation failed
+after saving (failed computations are re-run). A message repeated later in the conversation
+("thêm nữa", "ok") comes with a new key and is saved normally. Requests without a key can't be
+told apart from a new message and are always saved.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+
+from fastapi import HTTPException
+
+import metrics_helper
+from cache_helper import TTLCache
+
+TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+MAX_KEY_LENGTH = 255
+
+def fingerprint(payload: dict) -> str:
+    """Stable hash of a request body (a key may only be reused for the same body)."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class IdempotencyStore:
+    def __init__(self, ttl: float = TTL_SECONDS, max_entries: int = 10000):
+        self._entries = TTLCache(ttl, max_entries)  # key -> (fingerprint, task)
+
+    async def run(self, key: str, request_fingerprint: str, compute):
+        """Result of `compute()` (a coroutine function) for `key`, computed at most once.
+        Returns (result, replayed).
+
+        :raises HTTPException: 400 for an invalid key, 422 when the key was used for another request
+        """
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] != request_fingerprint:
+                metrics_helper.incr("idempotency.conflicts")
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            task = entry[1]
+            metrics_helper.incr("idempotency.replayed" if task.done() else "idempotency.attached")
+            print(f"🔁 Idempotency-Key {key[:16]} {'replayed' if task.done() else 'attached to in-flight request'}")
+            return await asyncio.shield(task), True
+
+        # The computation runs as its own task: a client giving up doesn't cancel it for its retries
+        task = asyncio.ensure_future(compute())
+        self._entries.set(key, (request_fingerprint, task))
+        task.add_done_callback(lambda done: self._forget_failed(key, done))
+        metrics_helper.incr("idempotency.computed")
+        return await asyncio.shield(task), False
+
+    def _forget_failed(self, key, task):
+        if task.cancelled() or task.exception() is not None:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is task:
+                self._entries.pop(key)
+            metrics_helper.incr("idempotency.failed")
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "ttl_seconds": self._entries.ttl}
+
+store = IdempotencyStore()
+
+# ---------------------- Conversation saves ----------------------
+_saves = TTLCache(TTL_SECONDS, 10000)
+_saves_lock = threading.Lock()
+
+def claim_save(session_id: str, message_key: str) -> bool:
+    """True for the first save of the message `message_key` (its Idempotency-Key) within the TTL;
+    False for a retry of a message already saved."""
+    key = (session_id, message_key)
+    with _saves_lock:
+        if key in _saves:
+            metrics_helper.incr("idempotency.saves_suppressed")
+            return False
+        _saves.set(key, True)
+        return True
+
+def release_save(session_id: str, message_key: str):
+    """Let a later retry save this message (the claimed save failed)."""
+    _saves.pop((session_id, message_key))
@@ -0,0 +1,156 @@
+"""
+Background ingestion jobs for POST /ingest-restaurants.
+
+The endpoint spools the uploaded markdown to a temporary file and enqueues a job;
+a single worker thread streams restaurants out of the file and writes them to
+Pinecone in batches (one embedding call + one upsert per batch).
+"""
+
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from markdown_helper import iter_restaurants, restaurant_to_text, restaurant_id
+from db_helper import upsert_batch
+
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+MAX_FINISHED_JOBS = 100   # finished jobs kept around for status queries
+MAX_REPORTED_FAILURES = 50
+
+class IngestJob:
+    """State of one ingestion job. Mutated by the worker, read by the status endpoint."""
+
+    def __init__(self, path: str, namespace: str):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.namespace = namespace
+        self.status = "queued"
+        self.error = None
+        self.parsed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.failures = []
+        self.created_at = datetime.now().isoformat()
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            end = self.finished or time.monotonic()
+            elapsed = (end - self.started) if self.started else 0.0
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "namespace": self.namespace,
+                "created_at": self.created_at,
+                "parsed": self.parsed,
+                "successful": self.succeeded,
+                "failed": self.failed,
+                "elapsed_seconds": round(elapsed, 3),
+                "records_per_second": round(self.succeeded / elapsed, 2) if elapsed > 0 else 0.0,
+                "failures": list(self.failures),
+                "error": self.error,
+            }
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_queue = queue.Queue()
+_worker = None
+
+def submit(path: str, namespace: str) -> IngestJob:
+    """Enqueue the markdown file at `path` for ingestion. The file is deleted once processed."""
+    job = IngestJob(path, namespace)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        _prune_finished()
+    _ensure_worker()
+    _queue.put(job)
+    print(f"📥 Queued ingestion job {job.id} ({os.path.getsize(path)} bytes)")
+    return job
+
+def get_job(job_id: str):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def _prune_finished():
+    finished = [job_id for job_id, job in _jobs.items() if job.status in ("completed", "failed")]
+    for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del _jobs[job_id]
+
+def _ensure_worker():
+    global _worker
+    with _jobs_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name="ingest-worker", daemon=True)
+            _worker.start()
+
+def _worker_loop():
+    while True:
+        job = _queue.get()
+        try:
+            run_job(job)
+        finally:
+            _queue.task_done()
+
+def _flush(job: IngestJob, batch: list):
+    texts = [restaurant_to_text(restaurant) for restaurant in batch]
+    ids = [restaurant_id(restaurant['name']) for restaurant in batch]
+    try:
+        upsert_batch(texts, namespace=job.namespace, vector_ids=ids)
+        with job.lock:
+            job.succeeded += len(batch)
+    except Exception as e:
+        print(f"❌ Ingestion job {job.id}: batch of {len(batch)} failed: {e}")
+        with job.lock:
+            job.failed += len(batch)
+            for restaurant in batch:
+                if len(job.failures) < MAX_REPORTED_FAILURES:
+                    job.failures.append({"name": restaurant['name'], "error": str(e)})
+
+def run_job(job: IngestJob):
+    """Stream restaurants from the job's file and upsert them batch by batch."""
+    with job.lock:
+        job.status = "running"
+        job.started = time.monotonic()
+    print(f"⚙️ Running ingestion job {job.id}")
+    try:
+        batch = []
+        for restaurant in iter_restaurants(job.path):
+            if not restaurant['name']:
+                continue
+            batch.append(restaurant)
+            with job.lock:
+                job.parsed += 1
+            if len(batch) >= BATCH_SIZE:
+                _flush(job, batch)
+                batch = []
+        if batch:
+            _flush(job, batch)
+
+        with job.lock:
+            if job.parsed == 0:
+                job.status = "failed"
+                job.error = "No restaurant information found in the markdown"
+            elif job.succeeded == 0:
+                job.status = "failed"
+                job.error = "All batches failed"
+            else:
+                job.status = "completed"
+    except Exception as e:
+        print(f"❌ Ingestion job {job.id} failed: {e}")
+        with job.lock:
+            job.status = "failed"
+            job.error = str(e)
+    finally:
+        with job.lock:
+            job.finished = time.monotonic()
+        try:
+            os.unlink(job.path)
+        except OSError:
+            pass
+    print(f"✅ Ingestion job {job.id} {job.status}: {job.succeeded}/{job.parsed} restaurants")
@@ -3,181 +3,248 @@ Script to ingest restaurants knowledge from markdown file into Pinecone
 """
 import os
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
-from openai import AzureOpenAI
-import re
+import sys
+import json
+import argparse
 from datetime import datetime
+from markdown_helper import iter_restaurants, restaurant_id, content_hash, RESTAURANT_FIELDS
+from vector_codec import embedding_dimensions, embedding_params
+import clients
+from deployment_pool import get_pool
+import upstream_cassette
+import text_normalizer
 
 # Load environment variables
 load_dotenv()
+upstream_cassette.install_from_env()
 
-# Initialize Pinecone
-pc = Pinecone(api_key=os.getenv("PINECONE_DB_API_KEY"))
 index_name = "ai-hoi"
 
-# Initialize Azure OpenAI for embeddings
-embedding_client = AzureOpenAI(
-    api_version="2024-02-01",
-    azure_endpoint=os.getenv("AZURE_EMBEDDING_ENDPOINT"),
-    api_key=os.getenv("AZURE_OPENAI_EMBEDDING_API_KEY"),
+# Manifest of what is currently indexed, used to sync only the differences
+MANIFEST_PATH = os.getenv(
+    "INGEST_MANIFEST_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ingest_manifest.json')
 )
-
-def parse_restaurant_markdown(file_path):
-    """Parse restaurants_knowledge.md and extract restaurant information"""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    restaurants = []
-    
-    # Split by restaurant sections (## Restaurant Name)
-    sections = re.split(r'\n## ', content)
-    
-    for section in sections[1:]:  # Skip first section (header)
-        lines = section.split('\n')
-        name = lines[0].strip()
-        
-        restaurant = {
-            'name': name,
-            'cuisine': '',
-            'location': '',
-            'address': '',
-            'price_range': '',
-            'specialties': '',
-            'opening_hours': '',
-            'phone': '',
-            'rating': '',
-            'description': '',
-            'highlights': ''
-        }
-        
-        for line in lines[1:]:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            
-            # Parse markdown list items
-            if line.startswith('- **Địa chỉ'):
-                restaurant['address'] = re.sub(r'- \*\*Địa chỉ\*\*:\s*', '', line)
-            elif line.startswith('- **Món đặc sắc'):
-                restaurant['specialties'] = re.sub(r'- \*\*Món đặc sắc\*\*:\s*', '', line)
-            elif line.startswith('- **Giá'):
-                restaurant['price_range'] = re.sub(r'- \*\*Giá\*\*:\s*', '', line)
-            elif line.startswith('- **Mô tả'):
-                restaurant['description'] = re.sub(r'- \*\*Mô tả\*\*:\s*', '', line)
-            elif line.startswith('- **Loại hình'):
-                restaurant['cuisine'] = re.sub(r'- \*\*Loại hình\*\*:\s*', '', line)
-            elif line.startswith('- **Khu vực'):
-                restaurant['location'] = re.sub(r'- \*\*Khu vực\*\*:\s*', '', line)
-            elif line.startswith('- **Giờ mở cửa'):
-                restaurant['opening_hours'] = re.sub(r'- \*\*Giờ mở cửa\*\*:\s*', '', line)
-            elif line.startswith('- **Điện thoại'):
-                restaurant['phone'] = re.sub(r'- \*\*Điện thoại\*\*:\s*', '', line)
-            elif line.startswith('- **Đánh giá'):
-                restaurant['rating'] = re.sub(r'- \*\*Đánh giá\*\*:\s*', '', line)
-            elif line.startswith('- **Điểm nổi bật'):
-                restaurant['highlights'] = re.sub(r'- \*\*Điểm nổi bật\*\*:\s*', '', line)
-        
-        restaurants.append(restaurant)
-    
-    return restaurants
+EMBED_BATCH_SIZE = 100
 
 def create_embedding(text):
     """Create embedding using Azure OpenAI"""
-    response = embedding_client.embeddings.create(
-        model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME", "text-embedding-3-small"),
-        input=text
-    )
-    return response.data[0].embedding
+    return create_embeddings([text])[0]
 
-def ingest_to_pinecone(restaurants):
-    """Ingest restaurant data into Pinecone"""
-    if index_name not in [index["name"] for index in pc.list_indexes()]:
-        pc.create_index(name=index_name, dimension=1536, metric="cosine", spec=ServerlessSpec(cloud="aws", region="us-east-1"))
-    # Connect to index (should already exist)
-    index = pc.Index(index_name)
+def create_embeddings(texts):
+    """Create embeddings for several texts in a single Azure OpenAI call"""
+    response = get_pool("embedding").embed(texts, **embedding_params())
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+def restaurant_text(restaurant):
+    """Build the text representation that gets embedded for a restaurant"""
+    text_parts = [
+        f"Tên quán: {restaurant['name']}",
+    ]
     
-    print(f"\n📊 Starting ingestion of {len(restaurants)} restaurants...")
+    if restaurant['cuisine']:
+        text_parts.append(f"Loại hình: {restaurant['cuisine']}")
+    if restaurant['location']:
+        text_parts.append(f"Khu vực: {restaurant['location']}")
+    if restaurant['address']:
+        text_parts.append(f"Địa chỉ: {restaurant['address']}")
+    if restaurant['price_range']:
+        text_parts.append(f"Giá: {restaurant['price_range']}")
+    if restaurant['specialties']:
+        text_parts.append(f"Món đặc sắc: {restaurant['specialties']}")
+    if restaurant['description']:
+        text_parts.append(f"Mô tả: {restaurant['description']}")
+    if restaurant['highlights']:
+        text_parts.append(f"Điểm nổi bật: {restaurant['highlights']}")
     
-    vectors = []
-    for i, restaurant in enumerate(restaurants):
-        # Create text representation for embedding
-        text_parts = [
-            f"Tên quán: {restaurant['name']}",
-        ]
-        
-        if restaurant['cuisine']:
-            text_parts.append(f"Loại hình: {restaurant['cuisine']}")
-        if restaurant['location']:
-            text_parts.append(f"Khu vực: {restaurant['location']}")
-        if restaurant['address']:
-            text_parts.append(f"Địa chỉ: {restaurant['address']}")
-        if restaurant['price_range']:
-            text_parts.append(f"Giá: {restaurant['price_range']}")
-        if restaurant['specialties']:
-            text_parts.append(f"Món đặc sắc: {restaurant['specialties']}")
-        if restaurant['description']:
-            text_parts.append(f"Mô tả: {restaurant['description']}")
-        if restaurant['highlights']:
-            text_parts.append(f"Điểm nổi bật: {restaurant['highlights']}")
-        
-        text_for_embedding = ". ".join(text_parts)
-        
-        # Create embedding
-        print(f"  {i+1}. Embedding: {restaurant['name']}...")
-        embedding = create_embedding(text_for_embedding)
-        
-        # Prepare metadata
-        metadata = {
-            'name': restaurant['name'],
-            'cuisine': restaurant['cuisine'],
-            'location': restaurant['location'],
-            'address': restaurant['address'],
-            'price_range': restaurant['price_range'],
-            'specialties': restaurant['specialties'],
-            'opening_hours': restaurant['opening_hours'],
-            'phone': restaurant['phone'],
-            'rating': restaurant['rating'],
-            'description': restaurant['description'],
-            'highlights': restaurant['highlights'],
-            'text': text_for_embedding,
-            'ingested_at': datetime.now().isoformat()
-        }
-        
-        # Create vector ID (ASCII only - use index and hash)
-        import hashlib
-        name_hash = hashlib.md5(restaurant['name'].encode()).hexdigest()[:8]
-        vector_id = f"restaurant_{i}_{name_hash}"
-        
-        vectors.append({
-            'id': vector_id,
-            'values': embedding,
-            'metadata': metadata
-        })
-        
-        # Batch upsert every 10 vectors
-        if len(vectors) >= 10:
-            print(f"  ⬆️  Upserting batch of {len(vectors)} vectors...")
-            index.upsert(vectors=vectors)
-            vectors = []
-    
-    # Upsert remaining vectors
-    if vectors:
-        print(f"  ⬆️  Upserting final batch of {len(vectors)} vectors...")
+    # Recomposed like the queries it is matched with; the record and its ID keep the catalog's spelling
+    return text_normalizer.recompose(". ".join(text_parts))
+
+def restaurant_metadata(restaurant, text):
+    """Metadata stored next to the vector, including the hashes used by sync"""
+    fields = {key: restaurant[key] for key in RESTAURANT_FIELDS}
+    return {
+        **fields,
+        'text': text,
+        'content_hash': content_hash(text),
+        'metadata_hash': content_hash(json.dumps(fields, sort_keys=True, ensure_ascii=False)),
+        'ingested_at': datetime.now().isoformat()
+    }
+
+# ============================
+# Manifest: what is currently indexed
+# ============================
+def load_manifest(path=MANIFEST_PATH):
+    """Load the manifest of indexed restaurants ({vector_id: {name, content_hash, metadata_hash}})"""
+    if not os.path.exists(path):
+        return {'index': index_name, 'entries': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    """Write the manifest atomically so an interrupted sync never leaves a truncated file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    manifest['updated_at'] = datetime.now().isoformat()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def rebuild_manifest_from_index(index, force_reembed=False):
+    """Rebuild the manifest from the vectors (and their hashes) already stored in Pinecone.
+
+    Every restaurant vector is listed, including IDs of older schemes (the positional
+    "restaurant_<n>_..." IDs), so vectors that don't match the catalog are deleted by the sync.
+    With force_reembed, hashes are left out so every restaurant is embedded again.
+    """
+    entries = {}
+    for ids in index.list(prefix="restaurant_"):
+        for start in range(0, len(ids), 100):
+            fetched = index.fetch(ids=ids[start:start + 100])
+            for vector_id, vector in fetched.vectors.items():
+                metadata = vector.metadata or {}
+                entries[vector_id] = {
+                    'name': metadata.get('name', ''),
+                    'content_hash': '' if force_reembed else metadata.get('content_hash', ''),
+                    'metadata_hash': metadata.get('metadata_hash', '')
+                }
+    return {'index': index_name, 'entries': entries}
+
+def diff_restaurants(restaurants, manifest):
+    """Compare parsed restaurants with the manifest.
+
+    Returns a dict with 'added', 'changed', 'metadata_only' and 'unchanged' lists of
+    (vector_id, restaurant, text) tuples, and 'removed' as a list of vector IDs.
+    """
+    entries = manifest.get('entries', {})
+    diff = {'added': [], 'changed': [], 'metadata_only': [], 'unchanged': [], 'removed': []}
+    seen = {}
+    
+    for restaurant in restaurants:
+        vector_id = restaurant_id(restaurant['name'])
+        if vector_id in seen:
+            print(f"  ⚠️  Duplicate restaurant '{restaurant['name']}', keeping the last one")
+        seen[vector_id] = restaurant
+    
+    for vector_id, restaurant in seen.items():
+        text = restaurant_text(restaurant)
+        metadata = restaurant_metadata(restaurant, text)
+        entry = entries.get(vector_id)
+        item = (vector_id, restaurant, text)
+        if entry is None:
+            diff['added'].append(item)
+        elif entry.get('content_hash') != metadata['content_hash']:
+            diff['changed'].append(item)
+        elif entry.get('metadata_hash') != metadata['metadata_hash']:
+            diff['metadata_only'].append(item)
+        else:
+            diff['unchanged'].append(item)
+    
+    diff['removed'] = [vector_id for vector_id in entries if vector_id not in seen]
+    return diff
+
+def print_diff(diff, manifest):
+    """Print a human readable report of a diff"""
+    entries = manifest.get('entries', {})
+    print(f"\n📋 Sync plan:")
+    print(f"  ➕ Added:         {len(diff['added'])}")
+    print(f"  ✏️  Changed:       {len(diff['changed'])}")
+    print(f"  🏷️  Metadata only: {len(diff['metadata_only'])}")
+    print(f"  ➖ Removed:       {len(diff['removed'])}")
+    print(f"  ✅ Unchanged:     {len(diff['unchanged'])}")
+    for label, key in (('+', 'added'), ('~', 'changed'), ('m', 'metadata_only')):
+        for _, restaurant, _ in diff[key]:
+            print(f"    {label} {restaurant['name']}")
+    for vector_id in diff['removed']:
+        print(f"    - {entries[vector_id].get('name') or ''} ({vector_id})")
+
+# ============================
+# Ingestion
+# ============================
+def get_index():
+    """Connect to the restaurant index, creating it if needed"""
+    return clients.pinecone_index(index_name, dimension=embedding_dimensions())
+
+def sync_to_pinecone(restaurants, diff=None, manifest=None, index=None):
+    """Apply a diff to Pinecone: embed only added/changed restaurants, patch metadata-only
+    edits without re-embedding and delete restaurants that disappeared from the catalog.
+    """
+    index = index or get_index()
+    manifest = manifest if manifest is not None else load_manifest()
+    diff = diff or diff_restaurants(restaurants, manifest)
+    entries = manifest.setdefault('entries', {})
+    manifest['index'] = index_name
+    
+    to_embed = diff['added'] + diff['changed']
+    print(f"\n📊 Embedding {len(to_embed)} restaurants...")
+    for start in range(0, len(to_embed), EMBED_BATCH_SIZE):
+        batch = to_embed[start:start + EMBED_BATCH_SIZE]
+        embeddings = create_embeddings([text for _, _, text in batch])
+        vectors = []
+        for (vector_id, restaurant, text), embedding in zip(batch, embeddings):
+            vectors.append({
+                'id': vector_id,
+                'values': embedding,
+                'metadata': restaurant_metadata(restaurant, text)
+            })
+        print(f"  ⬆️  Upserting batch of {len(vectors)} vectors...")
         index.upsert(vectors=vectors)
+        for vector in vectors:
+            entries[vector['id']] = {
+                'name': vector['metadata']['name'],
+                'content_hash': vector['metadata']['content_hash'],
+                'metadata_hash': vector['metadata']['metadata_hash']
+            }
+        # Persist progress so an interrupted sync resumes where it stopped
+        save_manifest(manifest)
+    
+    for vector_id, restaurant, text in diff['metadata_only']:
+        metadata = restaurant_metadata(restaurant, text)
+        index.update(id=vector_id, set_metadata=metadata)
+        entries[vector_id]['name'] = metadata['name']
+        entries[vector_id]['metadata_hash'] = metadata['metadata_hash']
+    
+    removed = diff['removed']
+    for start in range(0, len(removed), 1000):
+        batch = removed[start:start + 1000]
+        print(f"  🗑️  Deleting {len(batch)} vectors...")
+        index.delete(ids=batch)
+    for vector_id in removed:
+        entries.pop(vector_id, None)
+    
+    save_manifest(manifest)
     
-    # Get index stats
     stats = index.describe_index_stats()
-    print(f"\n✅ Ingestion complete!")
+    print(f"\n✅ Sync complete!")
     print(f"📊 Index stats: {stats}")
     return stats
 
-def main():
+def ingest_to_pinecone(restaurants):
+    """Ingest all restaurants into Pinecone, re-embedding every one of them and deleting
+    every other restaurant vector of the index"""
+    print(f"\n📊 Starting ingestion of {len(restaurants)} restaurants...")
+    index = get_index()
+    return sync_to_pinecone(restaurants, manifest=rebuild_manifest_from_index(index, force_reembed=True), index=index)
+
+def main(argv=None):
     """Main function"""
+    parser = argparse.ArgumentParser(description="Ingest restaurants_knowledge.md into Pinecone")
+    parser.add_argument('command', nargs='?', choices=['sync', 'ingest'], default='sync',
+                        help="'sync' only re-embeds what changed since the last run (default), "
+                             "'ingest' re-embeds everything")
+    parser.add_argument('--file', default=os.path.join(os.path.dirname(__file__), '..', 'restaurants_knowledge.md'),
+                        help="Path to the markdown catalog")
+    parser.add_argument('--dry-run', action='store_true', help="Only report the diff")
+    parser.add_argument('--rebuild-manifest', action='store_true',
+                        help="Rebuild the manifest from the vectors stored in Pinecone before diffing")
+    parser.add_argument('--yes', '-y', action='store_true', help="Do not ask for confirmation")
+    args = parser.parse_args(argv)
+    
     print("🍜 Restaurant Knowledge Ingestion Tool")
     print("=" * 50)
     
     # Path to markdown file
-    markdown_file = os.path.join(os.path.dirname(__file__), '..', 'restaurants_knowledge.md')
+    markdown_file = args.file
     
     if not os.path.exists(markdown_file):
         print(f"❌ Error: File not found: {markdown_file}")
@@ -185,30 +252,56 @@ def main():
     
     print(f"\n📖 Reading: {markdown_file}")
     
-    # Parse markdown
-    restaurants = parse_restaurant_markdown(markdown_file)
+    # Parse markdown (streaming parser shared with the API)
+    restaurants = list(iter_restaurants(markdown_file))
     print(f"✅ Parsed {len(restaurants)} restaurants")
     
     # Show sample
     if restaurants:
         print(f"\n📝 Sample restaurant:")
-        sample = restaurants[20]  # Show Fsoft sample
+        sample = restaurants[min(20, len(restaurants) - 1)]  # Show Fsoft sample
         print(f"  Name: {sample['name']}")
         print(f"  Address: {sample['address']}")
         print(f"  Specialties: {sample['specialties']}")
         print(f"  Price: {sample['price_range']}")
         print(f"  Description: {sample['description'][:50]}...")
     
+    if args.command == 'ingest':
+        # Starting from the index (not an empty manifest) deletes vectors left under other IDs
+        print(f"\n🔄 Listing the vectors of Pinecone index '{index_name}'...")
+        manifest = rebuild_manifest_from_index(get_index(), force_reembed=True)
+    elif args.rebuild_manifest or not os.path.exists(MANIFEST_PATH):
+        # Without a manifest (first sync, e.g. over an index filled with positional IDs) the
+        # index is the only record of what is stored
+        print(f"\n🔄 Rebuilding manifest from Pinecone index '{index_name}'...")
+        manifest = rebuild_manifest_from_index(get_index())
+    else:
+        manifest = load_manifest()
+    
+    diff = diff_restaurants(restaurants, manifest)
+    print_diff(diff, manifest)
+    
+    pending = len(diff['added']) + len(diff['changed']) + len(diff['metadata_only']) + len(diff['removed'])
+    if args.dry_run:
+        return diff
+    if pending == 0:
+        if args.rebuild_manifest or not os.path.exists(MANIFEST_PATH):
+            save_manifest(manifest)
+        print("\n✅ Index already up to date")
+        return diff
+    
     # Confirm
-    response = input(f"\n❓ Ingest {len(restaurants)} restaurants to Pinecone index '{index_name}'? (yes/no): ")
-    if response.lower() not in ['yes', 'y']:
-        print("❌ Cancelled")
-        return
+    if not args.yes:
+        response = input(f"\n❓ Apply {pending} changes to Pinecone index '{index_name}'? (yes/no): ")
+        if response.lower() not in ['yes', 'y']:
+            print("❌ Cancelled")
+            return diff
     
-    # Ingest to Pinecone
-    ingest_to_pinecone(restaurants)
+    # Sync to Pinecone
+    sync_to_pinecone(restaurants, diff=diff, manifest=manifest)
     
     print("\n🎉 Done!")
+    return diff
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
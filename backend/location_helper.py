@@ -1,6 +1,12 @@
-import requests, os
+import requests, os, re
 from typing import Optional
 from dotenv import load_dotenv
+from batch_helper import batch_shared
+from singleflight import single_flight
+from cache_helper import TTLCache
+import gazetteer
+import metrics_helper
+import text_normalizer
 
 # Envỉonment variables & OpenAI Azure Client Setup
 load_dotenv()
@@ -20,16 +26,83 @@ USER_AGENT = "ai-hoi/1.0 (nhatcp2000@gmail.com)"  # replace with your contact in
 FSQ_HEADERS = {
     "Accept": "application/json",
     "X-Places-Api-Version": "2025-06-17",
-    "Authorization": f"Bearer {os.getenv("FOURSQUARE_API_KEY")}"
+    "Authorization": f"Bearer {os.getenv('FOURSQUARE_API_KEY')}"
 }
 
+# Coordinates rarely change for a given text; nearby results are kept a few minutes.
+# Entries written by the prefetcher (see prefetch_helper) are flagged so their hits are counted.
+_coordinates_cache = TTLCache(float(os.getenv("GEOCODE_CACHE_TTL_SECONDS", "86400")), 50000)
+_places_cache = TTLCache(float(os.getenv("PLACES_CACHE_TTL_SECONDS", "600")), 5000)
+PLACES_CACHE_PRECISION = 7  # geohash cell of ~150 m
+
+# ============================
+# FUNCTION: Geohash
+# ============================
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash_encode(lat: float, lon: float, precision: int = 6) -> str:
+    """Standard geohash of a coordinate (precision 5 ≈ 5 km, 6 ≈ 1 km, 7 ≈ 150 m cells)."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+_LAT_LON_RE = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+def _location_key(location_text: str) -> str:
+    # "Q1", "quan 1" and "Quận 1" are the same place
+    return text_normalizer.cache_key(location_text)
+
+def prime_coordinates(location_text: str, lat: float, lon: float):
+    """Store known coordinates for a location text (used by the prefetcher)."""
+    _coordinates_cache.set(_location_key(location_text), ({"lat": lat, "lon": lon}, True))
+
 # ============================
 # FUNCTION: Get coordinates from location text
 # ============================
+@batch_shared("geocode")
+@single_flight("geocode")
 def get_coordinates_from_text(location_text: str):
     """
     Given a location text (address, city, region…), return latitude and longitude.
     """
+    cached = _coordinates_cache.get(_location_key(location_text))
+    if cached is not None:
+        coords, primed = cached
+        metrics_helper.incr("cache.geocode.hit")
+        if primed:
+            metrics_helper.incr("prefetch.hit.geocode")
+        return coords
+    metrics_helper.incr("cache.geocode.miss")
+
+    # "10.77,106.70" is already a coordinate
+    literal = _LAT_LON_RE.match(location_text or "")
+    if literal:
+        metrics_helper.incr("geocode.literal")
+        return {"lat": float(literal.group(1)), "lon": float(literal.group(2))}
+
+    # Districts, wards and landmarks resolve from the bundled gazetteer; only free-form
+    # (street) addresses need Nominatim
+    place = gazetteer.lookup(location_text)
+    if place is not None:
+        metrics_helper.incr("geocode.gazetteer.hit")
+        print(f"🗺️ Gazetteer: {location_text} → {place['name']} ({place['kind']})")
+        return {"lat": place["lat"], "lon": place["lon"]}
+    metrics_helper.incr("geocode.gazetteer.miss")
+
     url = "https://nominatim.openstreetmap.org/search"
     params = {
         "q": location_text,
@@ -54,6 +127,7 @@ def get_coordinates_from_text(location_text: str):
         first = data[0]
         lat = float(first["lat"])
         lon = float(first["lon"])
+        _coordinates_cache.set(_location_key(location_text), ({"lat": lat, "lon": lon}, False))
         return {"lat": lat, "lon": lon}
 
     except Exception as e:
@@ -110,26 +184,45 @@ def get_location_from_coordinates(lat: float, lon: float):
 
 
 # ===========================
-# FUNCTION: Search restaurants and return as formatted string
+# FUNCTION: Search restaurants (structured records)
 # ===========================
-def search_restaurants_as_string(
+@batch_shared("foursquare")
+@single_flight("foursquare")
+def search_restaurants_page(
     lat: float,
     lon: float,
     dish_name: Optional[str] = None,
     radius: int = 3000,
-    limit: int = 5
-) -> str:
+    limit: int = 5,
+    cursor: Optional[str] = None,
+    primed: bool = False
+) -> tuple:
     """
-    Searches for restaurants near the specified latitude & longitude using Foursquare Places API v3,
-    optionally filters by dish name, then returns a single formatted string of results.
-    
+    One page of a Foursquare Places search near the specified latitude & longitude,
+    optionally filtered by dish name.
+
     :param lat: latitude of the search centre
     :param lon: longitude of the search centre
     :param dish_name: optional keyword for dish/food item to filter restaurants
     :param radius: search radius in metres
-    :param limit: maximum number of results to return
-    :return: a formatted string summarising found restaurants
+    :param limit: maximum number of results per page
+    :param cursor: next-page URL returned with a previous page of the same search
+    :param primed: set by the prefetcher, marks the cached result as prefetched
+    :return: (records, next-page cursor or None); records are dicts with name, address,
+        distance, categories, lat, lon, price, rating
+    :raises RuntimeError: when the API does not answer with status 200
     """
+    cache_key = (geohash_encode(lat, lon, PLACES_CACHE_PRECISION), text_normalizer.cache_key(dish_name or "restaurant"),
+                 radius, limit, cursor)
+    cached = _places_cache.get(cache_key)
+    if cached is not None:
+        page, was_primed = cached
+        metrics_helper.incr("cache.foursquare.hit")
+        if was_primed:
+            metrics_helper.incr("prefetch.hit.foursquare")
+        return page
+    metrics_helper.incr("cache.foursquare.miss")
+
     url = "https://places-api.foursquare.com/places/search"
     params = {
         "ll": f"{lat},{lon}",
@@ -137,41 +230,84 @@ def search_restaurants_as_string(
         "radius": radius,
         "limit": limit
     }
+    if cursor:
+        # The next-page link already carries the query and the cursor
+        url, params = cursor, None
     
-    try:
-        res = requests.get(url, headers=FSQ_HEADERS, params=params, timeout=10)
-        status_code = res.status_code
-        # Log status for debugging
-        print("📡 API Response Status:", status_code)
-        print("📡 API Requested with:", params)
-        
-        if status_code != 200:
-            # Return error message as string
-            return f"Error: Foursquare API returned status {status_code}. Response: {res.text}"
-        
-        data = res.json()
-        results = data.get("results", [])
-        if not results:
-            return "No restaurants found."
-        
-        # Build string result
-        lines = []
-        for idx, r in enumerate(results, start=1):
-            name = r.get("name", "Unnamed")
-            address = r.get("location", {}).get("formatted_address", "No address provided")
-            distance = r.get("distance", None)
-            categories = [c.get("name") for c in r.get("categories", [])]
-            cat_str = ", ".join(categories) if categories else "No categories"
-            if distance is not None:
-                line = f"{idx}. {name} — {address} (≈ {distance} m) | Categories: {cat_str}"
-            else:
-                line = f"{idx}. {name} — {address} | Categories: {cat_str}"
-            lines.append(line)
-        
-        # Join lines into single string
-        result_string = "\n".join(lines)
-        return result_string
+    res = requests.get(url, headers=FSQ_HEADERS, params=params, timeout=10)
+    # Log status for debugging
+    print("📡 API Response Status:", res.status_code)
+    print("📡 API Requested with:", params or url)
+    if res.status_code != 200:
+        raise RuntimeError(f"Foursquare API returned status {res.status_code}. Response: {res.text}")
     
+    records = [place_to_record(r) for r in res.json().get("results", [])]
+    next_cursor = res.links.get("next", {}).get("url")
+    _places_cache.set(cache_key, ((records, next_cursor), primed))
+    return records, next_cursor
+
+def search_restaurants(
+    lat: float,
+    lon: float,
+    dish_name: Optional[str] = None,
+    radius: int = 3000,
+    limit: int = 5,
+    primed: bool = False
+) -> list:
+    """First page of search_restaurants_page() (see restaurant_search for ring / multi-query search)."""
+    return search_restaurants_page(lat, lon, dish_name, radius, limit, primed=primed)[0]
+
+def place_to_record(place: dict) -> dict:
+    """Convert a Foursquare place into the restaurant record used for ranking."""
+    return {
+        "id": place.get("fsq_place_id") or place.get("fsq_id"),
+        "name": place.get("name", "Unnamed"),
+        "address": place.get("location", {}).get("formatted_address", ""),
+        "distance": place.get("distance"),
+        "categories": [c.get("name") for c in place.get("categories", []) if c.get("name")],
+        "lat": place.get("latitude"),
+        "lon": place.get("longitude"),
+        "price": place.get("price"),      # 1 (cheap) .. 4 (very expensive), when available
+        "rating": place.get("rating"),    # 0..10, when available
+        "source": "foursquare",
+    }
+
+def format_restaurants(restaurants: list) -> str:
+    """Format restaurant records as a numbered list."""
+    if not restaurants:
+        return "No restaurants found."
+    lines = []
+    for idx, r in enumerate(restaurants, start=1):
+        address = r.get("address") or "No address provided"
+        cat_str = ", ".join(r.get("categories") or []) or "No categories"
+        if r.get("distance") is not None:
+            line = f"{idx}. {r['name']} — {address} (≈ {r['distance']} m) | Categories: {cat_str}"
+        else:
+            line = f"{idx}. {r['name']} — {address} | Categories: {cat_str}"
+        lines.append(line)
+    return "\n".join(lines)
+
+# ===========================
+# FUNCTION: Search restaurants and return as formatted string
+# ===========================
+def search_restaurants_as_string(
+    lat: float,
+    lon: float,
+    dish_name: Optional[str] = None,
+    radius: int = 3000,
+    limit: int = 5
+) -> str:
+    """
+    Restaurants found by restaurant_search.search() (adaptive radius), returned as a single
+    formatted string of results (errors are returned as text as well).
+    `radius` is the widest ring searched.
+    """
+    import restaurant_search  # imports this module
+    try:
+        radii = tuple(r for r in restaurant_search.RADII if r < radius) + (radius,)
+        return format_restaurants(restaurant_search.search(lat, lon, [dish_name or ""], radii=radii, max_results=limit))
+    except RuntimeError as e:
+        return f"Error: {e}"
     except Exception as e:
         # Return exception message as string
-        return f"Exception during Foursquare API call: {e}"
\ No newline at end of file
+        return f"Exception during Foursquare API call: {e}"
@@ -1,23 +1,48 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import Response, JSONResponse, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from markdown_helper import parse_restaurant_markdown, restaurant_to_text
 import os 
-from openai import AzureOpenAI
+import tempfile
+from typing import Optional
 from dotenv import load_dotenv
-from location_helper import get_coordinates_from_text, get_location_from_coordinates, search_restaurants_as_string
-from elevenlabs import ElevenLabs
-from db_helper import query_data, upsert_data
-from pinecone import Pinecone, ServerlessSpec
+from location_helper import get_coordinates_from_text, get_location_from_coordinates
+from fusion_helper import fuse_candidates, format_candidates, parse_budget
+import ingest_jobs
+from batch_helper import batch_shared, stream_batch
+from cache_helper import TTLCache
+import singleflight
+import metrics_helper
+from admission_helper import admission
+import model_router
+import deployment_pool
+import clients
+import profiling_helper
+import upstream_cassette
+import voice_pipeline
+import audio_formats
+import idempotency
+import text_normalizer
+from profiling_helper import stage
+import session_store
+import prefetch_helper
+import retrieval_service
+import restaurant_search
+from retrieval_service import embed_query, match_to_record
+import trend_views
+from trend_views import district_of
+from conversation_index import conversation_index, RECORD_PREFIX
+from vector_codec import embedding_dimensions
 from datetime import datetime
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from contextlib import AsyncExitStack
+import asyncio
+import time
 from prompt_loader import load_system_prompt
 
 # ---------------------- Setup ----------------------
 load_dotenv()
+upstream_cassette.install_from_env()
 
 # Clear any proxy settings to avoid 407 errors
 os.environ['NO_PROXY'] = '*'
@@ -31,43 +56,23 @@ if 'http_proxy' in os.environ:
 if 'https_proxy' in os.environ:
     del os.environ['https_proxy']
 
-client = AzureOpenAI(
-    api_version="2024-07-01-preview",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-)
-
-# Initialize embedding client
-embedding_client = AzureOpenAI(
-    api_version="2024-07-01-preview",
-    azure_endpoint=os.getenv("AZURE_EMBEDDING_ENDPOINT"),
-    api_key=os.getenv("AZURE_OPENAI_EMBEDDING_API_KEY"),
-)
+# Chat completions go through model_router (per-task deployments, falling back to the chat
+# deployment pool); embeddings through the embedding deployment pool (deployment_pool.py)
 
-# Initialize ElevenLabs client
-elevenlabs_client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+# Upstream clients (Pinecone, Azure OpenAI, ElevenLabs) are shared through clients.py;
+# the ElevenLabs client is only built on the first voice request
 
 # Initialize Pinecone
 try:
-    pc = Pinecone(api_key=os.getenv("PINECONE_DB_API_KEY"))
-    
     # Index for conversation history
     conversation_index_name = "ai-hoi-conversations"
-    # Create index if it doesn't exist (text-embedding-3-small has 1536 dimensions)
-    if conversation_index_name not in pc.list_indexes().names():
-        pc.create_index(
-            name=conversation_index_name,
-            dimension=1536,  # text-embedding-3-small dimension
-            metric="cosine",
-            spec=ServerlessSpec(cloud="aws", region="us-east-1")
-        )
-    # Connect to conversation index
-    index = pc.Index(conversation_index_name)
+    # Created if it doesn't exist (text-embedding-3-small: 1536 dimensions unless shortened)
+    index = clients.pinecone_index(conversation_index_name, dimension=embedding_dimensions())
     
     # Index for restaurant knowledge base (RAG)
     rag_index_name = "ai-hoi"
     # Connect to RAG index (should already exist with restaurant data)
-    rag_index = pc.Index(rag_index_name)
+    rag_index = clients.pinecone_index(rag_index_name)
     
     print("✅ Pinecone initialized successfully")
     print(f"   - Conversation index: {conversation_index_name}")
@@ -77,32 +82,47 @@ except Exception as e:
     index = None
     rag_index = None
 
-# Initialize LangChain components
-try:
-    llm = AzureChatOpenAI(
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version="2024-07-01-preview",
-        model=os.getenv("AZURE_OPENAI_MODEL_NAME"),
-        temperature=0.7
-    )
-    print("✅ LangChain LLM initialized successfully")
-except Exception as e:
-    print(f"⚠️ LangChain initialization failed: {e}")
-    llm = None
-    embeddings = None
-
 # Load system prompt from external file for easy management
 system_content = load_system_prompt("system_prompt")
 
 # A dict usable for the fallback OpenAI client
 system_message = {"role": "system", "content": system_content}
 
-# Create LangChain prompt template (use the same system_content)
-prompt_template = ChatPromptTemplate.from_messages([
-    SystemMessage(content=system_content),
-    ("human", "{context}")
-])
+# Lean mode answers through the chat completions API directly and never imports LangChain
+LEAN_MODE = os.getenv("LEAN_MODE", "false").lower() in ("1", "true", "yes")
+llm = None
+prompt_template = None
+if LEAN_MODE:
+    print("🪶 Lean mode: LangChain not loaded, answers use the chat completions API")
+else:
+    # Initialize LangChain components
+    try:
+        from langchain_openai import AzureChatOpenAI
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from langchain_core.messages import SystemMessage
+
+        # Same deployment, max_tokens and timeout as model_router's "answer" task
+        answer_config = model_router.task_config("answer")
+        llm = AzureChatOpenAI(
+            azure_endpoint=answer_config["endpoint"],
+            api_key=answer_config["api_key"],
+            api_version=clients.API_VERSION,
+            model=answer_config["deployment"],
+            max_tokens=answer_config["max_tokens"],
+            timeout=answer_config["timeout"],
+            temperature=0.7
+        )
+        # Create LangChain prompt template (same system_content and session history as the pool path)
+        prompt_template = ChatPromptTemplate.from_messages([
+            SystemMessage(content=system_content),
+            MessagesPlaceholder("history", optional=True),
+            ("human", "{context}")
+        ])
+        print("✅ LangChain LLM initialized successfully")
+    except Exception as e:
+        print(f"⚠️ LangChain initialization failed: {e}")
+        llm = None
+        prompt_template = None
 
 
 # ---------------------- Models ----------------------
@@ -113,7 +133,17 @@ class Message(BaseModel):
 class ChatMessage(BaseModel):
     text: str
     location: str  # current location text, e.g. "10.762622,106.660172"
-    history: list[Message] = []  # Conversation history
+    session_id: Optional[str] = None  # server-side session; the server keeps the history
+    history: list[Message] = []  # Only used to seed a new session (first turn, or after a 409 session_expired)
+
+class ChatBatchItem(BaseModel):
+    text: str
+    location: str
+    id: Optional[str] = None  # echoed back so callers can match results
+
+class ChatBatch(BaseModel):
+    items: list[ChatBatchItem]
+    concurrency: int = 4  # max items answered at once (bounds concurrent LLM calls)
 
 class Location(BaseModel):
     lat: float
@@ -137,279 +167,80 @@ def summarize_conversation(messages: list):
     Summary (1-2 sentences):"""
     
     try:
-        response = client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_MODEL_NAME"),
+        response = model_router.complete(
+            "summarization",
             messages=[{"role": "user", "content": summary_prompt}],
-            temperature=0.5,
-            max_tokens=150
+            temperature=0.5
         )
         return response.choices[0].message.content.strip()
     except Exception as e:
         print(f"❌ Error summarizing conversation: {e}")
         return None
 
-def save_conversation_to_pinecone(conversation_history: list, location: str):
-    """Save conversation summary to Pinecone - append to single vector."""
+def save_conversation_to_pinecone(conversation_history: list, location: str, session_id: str, dishes: list = None):
+    """Save one record per conversation (session) to Pinecone and the local search index.
+    Returns True when the record was written."""
     if not index:
         print("⚠️ Pinecone not available, skipping save")
-        return
+        return False
     
     try:
         # Generate summary
         summary = summarize_conversation(conversation_history)
         if not summary:
             print("⚠️ No summary generated, skipping Pinecone save")
-            return
+            return False
         
         print(f"📝 Summary: {summary}")
         
-        # Use a fixed ID for all conversations
-        conversation_id = "all-conversations"
-        
-        import json
+        # One record per session: later turns of the same conversation update it
+        conversation_id = f"{RECORD_PREFIX}{session_id}"
+        embedding = embed_query(summary, cache=False)
+        metadata = {
+            "summary": summary,
+            "location": location,
+            "district": district_of(location),
+            "dishes": sorted({dish for dish in dishes or [] if dish}),
+            "timestamp": int(datetime.now().timestamp()),
+            "message_count": len(conversation_history),
+            "session_id": session_id
+        }
         
-        # Try to fetch existing vector to append to it
-        try:
-            existing = index.fetch(ids=[conversation_id])
-            if conversation_id in existing.vectors:
-                # Get existing metadata
-                existing_metadata = existing.vectors[conversation_id].metadata or {}
-                existing_summaries_json = existing_metadata.get("summaries_json", "[]")
-                existing_summaries = json.loads(existing_summaries_json)
-                
-                # Append new summary
-                existing_summaries.append({
-                    "summary": summary,
-                    "location": location,
-                    "timestamp": datetime.now().isoformat(),
-                    "message_count": len(conversation_history),
-                    "user_prompts": [msg['content'] for msg in conversation_history if msg['role'] == 'user']
-                })
-                
-                # Create combined text for embedding
-                combined_text = "\n".join([s["summary"] for s in existing_summaries])
-                
-                # Generate new embedding from combined text
-                embedding_response = embedding_client.embeddings.create(
-                    model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME"),
-                    input=combined_text
-                )
-                embedding = embedding_response.data[0].embedding
-                
-                # Create overall summary from all conversations
-                # Collect all user prompts for trend analysis
-                all_user_prompts = []
-                for s in existing_summaries:
-                    all_user_prompts.extend(s.get("user_prompts", []))
-                
-                overall_summary_prompt = f"""Analyze and synthesize the following set of conversation summaries into a comprehensive written analysis (10-15 sentences).
-                Place special emphasis on trends and user preferences inferred from their questions.
-
-                Please include the following details:
-                1. The most frequently asked dishes
-                2. Frequently mentioned locations
-                3. Users' cuisine preference trends (e.g., Vietnamese, international, street food, etc.)
-                4. Search behavior patterns (e.g., prefer nearby options, willing to travel, search by dish vs. by location)
-                5. Restaurants that were recommended and any noted feedback
-
-                The summarized conversations:
-                {combined_text}
-
-                USER QUESTIONS (most important for analyzing preferences):
-                {chr(10).join(all_user_prompts)}
-
-                Overall synthesized summary (8-10 sentences, focusing on trends derived from user questions):"""
-                
-                try:
-                    overall_response = client.chat.completions.create(
-                        model=os.getenv("AZURE_OPENAI_MODEL_NAME"),
-                        messages=[{"role": "user", "content": overall_summary_prompt}],
-                        temperature=0.5,
-                        max_tokens=400
-                    )
-                    overall_summary = overall_response.choices[0].message.content.strip()
-                except Exception as e:
-                    print(f"⚠️ Error creating overall summary: {e}")
-                    overall_summary = summary  # Fallback to latest summary
-                
-                # Update metadata (store as JSON string)
-                metadata = {
-                    "summaries_json": json.dumps(existing_summaries),
-                    "total_conversations": len(existing_summaries),
-                    "last_updated": datetime.now().isoformat(),
-                    "latest_summary": overall_summary,  # Overall summary of all conversations
-                    "latest_location": location
-                }
-                
-                print(f"📚 Appending to existing vector (total: {len(existing_summaries)} conversations)")
-            else:
-                # First conversation - create initial vector
-                embedding_response = embedding_client.embeddings.create(
-                    model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME"),
-                    input=summary
-                )
-                embedding = embedding_response.data[0].embedding
-                
-                summaries = [{
-                    "summary": summary,
-                    "location": location,
-                    "timestamp": datetime.now().isoformat(),
-                    "message_count": len(conversation_history),
-                    "user_prompts": [msg['content'] for msg in conversation_history if msg['role'] == 'user']
-                }]
-                
-                metadata = {
-                    "summaries_json": json.dumps(summaries),
-                    "total_conversations": 1,
-                    "last_updated": datetime.now().isoformat(),
-                    "latest_summary": summary,
-                    "latest_location": location
-                }
-                
-                print(f"📝 Creating first conversation vector")
-        except Exception as fetch_error:
-            print(f"⚠️ Fetch error (creating new): {fetch_error}")
-            # First time - create initial vector
-            embedding_response = embedding_client.embeddings.create(
-                model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME"),
-                input=summary
-            )
-            embedding = embedding_response.data[0].embedding
-            
-            summaries = [{
-                "summary": summary,
-                "location": location,
-                "timestamp": datetime.now().isoformat(),
-                "message_count": len(conversation_history),
-                "user_prompts": [msg['content'] for msg in conversation_history if msg['role'] == 'user']
-            }]
-            
-            metadata = {
-                "summaries_json": json.dumps(summaries),
-                "total_conversations": 1,
-                "last_updated": datetime.now().isoformat(),
-                "latest_summary": summary,
-                "latest_location": location
-            }
-            
-            print(f"📝 Creating first conversation vector")
-        
-        # Upsert (update or insert) the single vector
         index.upsert(vectors=[{
             "id": conversation_id,
             "values": embedding,
             "metadata": metadata
         }])
+        conversation_index.add(conversation_id, embedding, metadata)
         
-        print(f"✅ Updated conversation vector (ID: {conversation_id})")
+        print(f"✅ Saved conversation record (ID: {conversation_id})")
+        return True
         
     except Exception as e:
         print(f"❌ Error saving to Pinecone: {e}")
+        return False
 
-def retrieve_restaurant_knowledge(query: str, top_k: int = 5):
-    """Retrieve relevant restaurant information from Pinecone RAG knowledge base."""
+def load_rag_shard(area_name: str, size: int):
+    """Restaurants of the RAG index closest to an area, with their vectors (for the prefetcher)."""
     if not rag_index:
-        print("⚠️ RAG index not available")
-        return ""
-    
-    try:
-        print(f"🔍 Searching RAG for: '{query}'")
-        
-        # Create embedding for the query
-        embedding_response = embedding_client.embeddings.create(
-            model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME"),
-            input=query
-        )
-        query_embedding = embedding_response.data[0].embedding
-        
-        # Query Pinecone RAG index for relevant restaurants
-        results = rag_index.query(
-            vector=query_embedding,
-            top_k=top_k,
-            include_metadata=True
-        )
-        
-        print(f"📊 RAG query returned {len(results.matches)} matches")
-        
-        if not results.matches:
-            print("📭 No restaurant matches found in RAG")
-            return ""
-        
-        # Debug: print all matches
-        for i, match in enumerate(results.matches):
-            print(f"  Match {i+1}: {match.metadata.get('name', 'N/A')} (score: {match.score:.4f})")
-        
-        # Format restaurant information
-        restaurant_info = []
-        for match in results.matches:
-            metadata = match.metadata
-            score = match.score
-            
-            # Use the 'text' field if available, otherwise construct info
-            if metadata.get('text'):
-                info = f"""
-**{metadata.get('name', 'N/A')}** (Độ phù hợp: {score:.2f})
-{metadata.get('text')}
-"""
-            else:
-                info = f"""
-**{metadata.get('name', 'N/A')}** (Độ phù hợp: {score:.2f})
-- Loại hình: {metadata.get('cuisine', 'N/A')}
-- Khu vực: {metadata.get('location', 'N/A')}
-- Địa chỉ: {metadata.get('address', 'N/A')}
-- Giá: {metadata.get('price_range', 'N/A')}
-- Món đặc trưng: {metadata.get('specialties', 'N/A')}
-"""
-            
-            restaurant_info.append(info)
-        
-        if not restaurant_info:
-            return ""
-        
-        result = f"🍽️ **Thông tin từ cơ sở dữ liệu nhà hàng:**\n\n" + "\n---\n".join(restaurant_info)
-        print(f"✅ Retrieved {len(restaurant_info)} restaurants from RAG knowledge base")
-        return result
-        
-    except Exception as e:
-        print(f"❌ Error retrieving restaurant knowledge: {e}")
-        return ""
+        return [], []
+    results = rag_index.query(
+        vector=embed_query(f"Nhà hàng, quán ăn ở {area_name}"),
+        top_k=size,
+        include_metadata=True,
+        include_values=True
+    )
+    matches = [match for match in results.matches if match.values]
+    return [match_to_record(match) for match in matches], [match.values for match in matches]
 
-def retrieve_similar_conversations(query: str, top_k: int = 3):
-    """Retrieve overall summary of all conversations from Pinecone."""
-    if not index:
-        print("⚠️ Pinecone not available")
-        return "Không có cuộc hội thoại tương tự từ trước."
-    
-    try:
-        import json
-        
-        # Fetch the single vector containing all conversations
-        conversation_id = "all-conversations"
-        existing = index.fetch(ids=[conversation_id])
-        
-        if conversation_id not in existing.vectors:
-            print("📭 No conversation history found")
-            return "Không có cuộc hội thoại tương tự từ trước."
-        
-        # Get overall summary from metadata
-        metadata = existing.vectors[conversation_id].metadata
-        latest_summary = metadata.get("latest_summary", "")
-        total_conversations = metadata.get("total_conversations", 0)
-        
-        if not latest_summary:
-            return "Không có cuộc hội thoại tương tự từ trước."
-        
-        print(f"📚 Retrieved overall summary from {total_conversations} conversations")
-        return f"Tóm tắt từ {total_conversations} cuộc hội thoại trước:\n{latest_summary}"
-    
-    except Exception as e:
-        print(f"❌ Error retrieving from Pinecone: {e}")
-        return "Không có cuộc hội thoại tương tự từ trước."
+# Extracted (food, location) per query, keyed on its folded canonical form
+_extractions = TTLCache(float(os.getenv("EXTRACTION_CACHE_SECONDS", "600")), 5000)
 
+@batch_shared("extract_entities")
 def extract_entities(input_text: str):
     """Use Azure OpenAI function calling to extract food and location info."""
-    response = client.chat.completions.create(
-        model=os.getenv("AZURE_OPENAI_MODEL_NAME"),
+    response = model_router.complete(
+        "extraction",
         messages=[
             {"role": "system", "content": """Extract structured text data from user requests about food and location.
              If user don't mention a specific dish, return None for food property.
@@ -442,79 +273,115 @@ def extract_entities(input_text: str):
     return parsed.get("food"), parsed.get("location")
 
 # ---------------------- Chat Logic ----------------------
-def gen_answer(user_input, current_location, conversation_history=None):
-    """Main chat logic with context injection, conversation history, and RAG from Pinecone."""
-    food, place_text = extract_entities(user_input)
+MAX_PROMPT_CANDIDATES = int(os.getenv("MAX_PROMPT_CANDIDATES", "8"))
+
+def gen_answer(user_input, current_location, conversation_history=None, turn_facts=None):
+    """Main chat logic with context injection, conversation history, and RAG from Pinecone.
+    `turn_facts`, if given, is filled with the dish, place and recommended restaurants."""
+    # Equivalent phrasings ("Q1 bún bò hế ko?") share the extraction, embedding and search caches
+    user_input = text_normalizer.normalize_query(user_input)
+    # The query embedding only depends on the text: compute it while entities are extracted
+    query_embedding = retrieval_service.embed_in_background(user_input)
+    with stage("extract_entities"):
+        extraction_key = text_normalizer.fold(user_input)
+        extracted = _extractions.get(extraction_key)
+        if extracted is None:
+            extracted = extract_entities(user_input)
+            _extractions.set(extraction_key, extracted)
+        else:
+            metrics_helper.incr("cache.extraction.hit")
+        food, place_text = extracted
+    food = text_normalizer.canonical(food) if food else food
     print(f"🍜 Extracted food: {food}, location: {place_text}")
     
     context = ""
-    if ((food is not None or food != "") or (place_text is not None or place_text != "")):
-        query = f"'{food}' '{place_text}'."
-    else: 
-        query = user_input
-        results = query_data(query, top_k=5, namespace="restaurants")
-        if results and len(results) > 0:
-            context += "Thông tin tham khảo từ cơ sở dữ liệu:\n"
-            for res in results:
-                context += f"- {res}\n"
-            context += "\n"
-        print(f"🗄️ Retrieved {len(results)} context entries from DB.")
-    
     coords = None
     # Determine coordinates
-    if place_text not in [None, ""]:
-        coords = get_coordinates_from_text(place_text)
-    if coords is None and current_location not in [None, ""]:
-        coords = get_coordinates_from_text(current_location)
+    with stage("geocode"):
+        if place_text not in [None, ""]:
+            coords = get_coordinates_from_text(place_text)
+        if coords is None and current_location not in [None, ""]:
+            coords = get_coordinates_from_text(current_location)
     if coords is None and current_location in [None, ""]:
         return "Xin lỗi, tôi không thể xác định vị trí của bạn. Vui lòng cung cấp vị trí hợp lệ."
+    prefetch_helper.note_chat(coords)
 
-    # Use Foursquare search to get nearby restaurants
-    nearby_restaurants = search_restaurants_as_string(coords["lat"], coords["lon"], food or "")
+    # Foursquare search for every dish mentioned, widening the radius until enough places are found
+    nearby_places = []
+    if coords is not None:
+        try:
+            with stage("foursquare"):
+                nearby_places = restaurant_search.search(coords["lat"], coords["lon"], food)
+        except Exception as e:
+            print(f"❌ Foursquare search failed: {e}")
     
-    # Retrieve similar conversations from Pinecone
-    similar_conversations = retrieve_similar_conversations(user_input)
-    print(f"📚 Retrieved similar conversations:\n{similar_conversations}")
+    # One embedding, all retrievers at once: restaurant knowledge, ingested snippets, past conversations
+    with stage("rag"):
+        retrieval = retrieval_service.retrieve(user_input, coords=coords, vector=query_embedding)
+    rag_matches = retrieval.results["knowledge"]
+    snippets = retrieval.results["restaurants"]
+    if snippets:
+        context += "Thông tin tham khảo từ cơ sở dữ liệu:\n"
+        for snippet in snippets:
+            context += f"- {snippet['text']}\n"
+        context += "\n"
+    memories = retrieval.results["conversations"]
+    if memories:
+        context += "Các cuộc trò chuyện tương tự trước đây:\n"
+        for memory in memories:
+            context += f"- {memory['summary']}\n"
+        context += "\n"
     
-    # Retrieve restaurant knowledge from RAG
-    restaurant_knowledge = retrieve_restaurant_knowledge(user_input, top_k=5)
-    if restaurant_knowledge:
-        print(f"🍽️ Retrieved restaurant knowledge from RAG")
-
-    # Compose context - prioritize RAG knowledge
-    if restaurant_knowledge:
-        context += f"{restaurant_knowledge}\n\n"
+    # Merge both sources into one de-duplicated, ranked list
+    with stage("fusion"):
+        candidates = fuse_candidates(
+            rag_matches,
+            nearby_places,
+            budget=parse_budget(user_input),
+            origin=(coords["lat"], coords["lon"]) if coords else None,
+            max_results=MAX_PROMPT_CANDIDATES
+        )
+    print(f"🔀 Fused {len(rag_matches)} RAG + {len(nearby_places)} Foursquare candidates into {len(candidates)}")
+    if turn_facts is not None:
+        turn_facts.update(food=food, place=place_text, restaurants=[c["name"] for c in candidates[:3]])
+    
+    # Precomputed trends from past conversations (materialized offline, no LLM call here)
+    trends = trend_views.trend_context(place_text or current_location)
+    if trends:
+        context += f"{trends}\n\n"
     
-    context += f"Những nhà hàng liên quan ở gần đó:\n{nearby_restaurants}\n\nNgười dùng hỏi: {user_input}"
+    context += f"Các nhà hàng phù hợp (đã xếp hạng theo độ liên quan, khoảng cách và giá):\n{format_candidates(candidates)}\n\nNgười dùng hỏi: {user_input}"
     print(f"🗒️ Context for LLM:\n{context}")
     
-    # Use LangChain if available, otherwise fallback to OpenAI client
-    if llm and prompt_template:
+    # Session history: the rolling summary (as a system message) and the recent messages
+    history_messages = [{"role": msg["role"], "content": msg["content"]} for msg in conversation_history or []]
+
+    # Use LangChain if available (single chat deployment), otherwise the pooled OpenAI client
+    if llm and prompt_template and len(deployment_pool.get_pool("chat")) == 1:
         # Use LangChain prompt template
         formatted_prompt = prompt_template.invoke({
-            "similar_conversations": similar_conversations,
+            "history": history_messages,
             "context": context
         })
 
         # Generate response using LangChain
-        response = llm.invoke(formatted_prompt)
+        started = time.perf_counter()
+        with stage("answer"):
+            response = llm.invoke(formatted_prompt)
+        model_router.record("answer", started, response)
         return response.content.strip()
     else:
-        # Fallback to original OpenAI client
-        print("⚠️ Using fallback OpenAI client (LangChain not available)")
-        messages = [system_message]
-        
-        if conversation_history:
-            for msg in conversation_history:
-                messages.append({"role": msg.role, "content": msg.content})
-        
-        messages.append({"role": "user", "content": context})
+        # OpenAI client through the chat deployment pool
+        if not llm and not LEAN_MODE:
+            print("⚠️ Using fallback OpenAI client (LangChain not available)")
+        messages = [system_message, *history_messages, {"role": "user", "content": context}]
     
-    response = client.chat.completions.create(
-        model=os.getenv("AZURE_OPENAI_MODEL_NAME"),
-        messages=messages,
-        temperature=0.7
-    )
+    with stage("answer"):
+        response = model_router.complete(
+            "answer",
+            messages=messages,
+            temperature=0.7
+        )
 
     return response.choices[0].message.content.strip()
 
@@ -527,96 +394,196 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Audio-Format"],
 )
 
+trend_views.start_background_refresh()
+
+def answer_chat(message: ChatMessage, reseed_expired: bool = True, message_key: Optional[str] = None):
+    """Generate the answer for a chat message and save meaningful conversations.
+
+    `message_key` (the request's Idempotency-Key) identifies retries of the same message, which
+    save the conversation only once.
+
+    :raises HTTPException: 409 "session_expired" when `message.session_id` is unknown and no
+        history was sent to seed a new session (unless reseed_expired is False, e.g. for voice,
+        where the turn starts a new session instead)
+    """
+    # The client's history only seeds a new session
+    seed_history = [{"role": msg.role, "content": msg.content} for msg in message.history]
+    session = session_store.find_session(message.session_id)
+    if session is None:
+        if message.session_id and not seed_history and reseed_expired:
+            metrics_helper.incr("sessions.expired")
+            raise HTTPException(status_code=409, detail="session_expired")
+        session = session_store.new_session(seed_history)
+    history = session.history()
+    
+    facts = {}
+    answer = gen_answer(message.text, message.location, history, turn_facts=facts)
+    print(f"✅ Generated answer successfully")
+    session.append(message.text, answer)
+    if facts:
+        trend_views.record_turn(message.location, facts)
+        if facts.get("food"):
+            session.dishes.append(facts["food"])
+    
+    # Save conversation to Pinecone if there's meaningful history (at least 2 exchanges),
+    # once per message when retries can be recognized by their key
+    if len(history) >= 2 and (message_key is None or idempotency.claim_save(session.id, message_key)):
+        # Compact history (rolling summary + recent messages) plus the current exchange
+        full_conversation = history + [
+            {"role": "user", "content": message.text},
+            {"role": "assistant", "content": answer}
+        ]
+        saved = save_conversation_to_pinecone(full_conversation, message.location, session.id, session.dishes)
+        if not saved and message_key is not None:
+            idempotency.release_save(session.id, message_key)
+    return answer, session.id
+
 @app.post("/chat")
-async def chat(message: ChatMessage):
-    print(f"📝 Received chat request: {message.dict()}")
-    print(f"📚 Conversation history length: {len(message.history)}")
-    try:
-        answer = gen_answer(message.text, message.location, message.history)
-        print(f"✅ Generated answer successfully")
-        # Save conversation to Pinecone if there's meaningful history (at least 2 exchanges)
-        if len(message.history) >= 2:
-            # Convert Message objects to dicts
-            full_conversation = [
-                {"role": msg.role, "content": msg.content} for msg in message.history
-            ]
-            # Add current exchange
-            full_conversation.extend([
-                {"role": "user", "content": message.text},
-                {"role": "assistant", "content": answer}
-            ])
-            save_conversation_to_pinecone(full_conversation, message.location)
-        return {"message": answer}
-    except Exception as e:
-        print(f"❌ Error generating answer: {str(e)}")
-        raise
+async def chat(message: ChatMessage, request: Request):
+    print(f"📝 Received chat request: session={message.session_id}, text={message.text!r}")
+    print(f"📚 Client-sent history length: {len(message.history)}")
+
+    key = request.headers.get("idempotency-key")
+
+    async def compute():
+        async with admission.admit("chat", request) as slot:
+            try:
+                answer, session_id = await slot.run(profiling_helper.profiled, "chat", answer_chat, message, True, key)
+                return {"message": answer, "session_id": session_id}
+            except Exception as e:
+                print(f"❌ Error generating answer: {str(e)}")
+                raise
+
+    if key is None:
+        return await compute()
+    # Retries with the same key share the first computation (see idempotency.py)
+    request_fingerprint = idempotency.fingerprint(
+        {"text": message.text, "location": message.location, "session_id": message.session_id}
+    )
+    result, replayed = await idempotency.store.run(key, request_fingerprint, compute)
+    return JSONResponse(content=result, headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    """Forget a server-side chat session."""
+    session_store.drop_session(session_id)
+    return {"message": "Session ended"}
+
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "5000"))
+MAX_BATCH_CONCURRENCY = int(os.getenv("MAX_BATCH_CONCURRENCY", "16"))
+
+@app.post("/chat/batch")
+async def chat_batch(batch: ChatBatch, request: Request):
+    """
+    Answer many {text, location} items in one request, streamed back as NDJSON.
+    Geocoding, embeddings, Foursquare lookups and entity extraction are shared between
+    identical items; one JSON line is written per item as soon as it finishes.
+    """
+    if len(batch.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    print(f"📦 Received chat batch: {len(batch.items)} items, concurrency {batch.concurrency}")
+    concurrency = min(max(1, batch.concurrency), MAX_BATCH_CONCURRENCY)
+    # Batches are bulk work: admit them in the ingestion lane and hold the slot while streaming
+    slot_holder = AsyncExitStack()
+    await slot_holder.enter_async_context(admission.admit("ingestion", request))
+
+    async def body():
+        async with slot_holder:
+            async for line in stream_batch(batch.items, lambda item: gen_answer(item.text, item.location), concurrency):
+                yield line
+
+    # The background task runs once the response is over, also when the client left before the
+    # body was iterated; closing the stack again after body() released the slot is a no-op
+    return StreamingResponse(body(), media_type="application/x-ndjson", background=BackgroundTask(slot_holder.aclose))
 
 @app.post("/location")
 async def reverse_geocode(location: Location):
-    return get_location_from_coordinates(location.lat, location.lon)
+    location_info = await asyncio.to_thread(get_location_from_coordinates, location.lat, location.lon)
+    if location_info:
+        # The first /chat usually follows shortly: warm caches for this area in the background
+        prefetch_helper.schedule(location.lat, location.lon, location_info, load_rag_shard)
+    return location_info
 
 @app.get("/search-history")
-async def search_conversation_history(query: str, limit: int = 5):
-    """Search similar conversations from Pinecone using semantic search."""
+async def search_conversation_history(
+    query: Optional[str] = None,
+    limit: int = 5,
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    location: Optional[str] = None,
+    dish: Optional[str] = None
+):
+    """
+    Search individual conversations: semantic similarity to `query` (newest first without one),
+    filtered by time range (ISO date or epoch `since`/`until`), district (`location`) and `dish`.
+    Pass the returned `next_cursor` as `cursor` to get the next page.
+    """
     try:
-        # Generate embedding for the search query using new embedding model
-        embedding_response = embedding_client.embeddings.create(
-            model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL_NAME"),
-            input=query
-        )
-        query_embedding = embedding_response.data[0].embedding
-        
-        # Search in Pinecone
-        results = index.query(
-            vector=query_embedding,
-            top_k=limit,
-            include_metadata=True
+        query_embedding = None
+        if query:
+            # Shared with /chat and cached, so every page of a search uses the same vector
+            query_embedding = await asyncio.to_thread(embed_query, text_normalizer.normalize_query(query))
+        
+        conversations, next_cursor = await asyncio.to_thread(
+            conversation_index.search,
+            query_embedding,
+            since=since,
+            until=until,
+            location=location,
+            dish=dish,
+            limit=limit,
+            cursor=cursor,
+            query_text=query
         )
         
-        # Format results
-        conversations = []
-        for match in results.matches:
-            conversations.append({
-                "score": match.score,
-                "summary": match.metadata.get("summary"),
-                "location": match.metadata.get("location"),
-                "timestamp": match.metadata.get("timestamp"),
-                "message_count": match.metadata.get("message_count")
-            })
-        
-        print(f"🔍 Found {len(conversations)} similar conversations")
-        return {"results": conversations}
+        print(f"🔍 Found {len(conversations)} matching conversations")
+        return {"results": conversations, "next_cursor": next_cursor}
         
+    except ValueError as e:
+        # Bad cursor or date
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"❌ Error searching Pinecone: {e}")
-        return {"error": str(e), "results": []}
-
+        print(f"❌ Error searching conversation history: {e}")
+        return {"error": str(e), "results": [], "next_cursor": None}
+
+
+def transcribe_audio(audio_content: bytes):
+    """Transcribe Vietnamese speech with ElevenLabs Speech-to-Text."""
+    from io import BytesIO
+    started = time.perf_counter()
+    # WAV is reduced to 16 kHz mono; compressed containers are sent as they are
+    audio_content, audio_container = audio_formats.prepare_for_stt(audio_content)
+    transcription = clients.elevenlabs().speech_to_text.convert(
+        file=BytesIO(audio_content),
+        model_id="scribe_v1",  # Only scribe_v1 is supported
+        language_code="vi"  # Explicitly set to Vietnamese for better accuracy
+    )
+    audio_formats.record("stt", audio_container, len(audio_content), (time.perf_counter() - started) * 1000)
+    return transcription
 
 @app.post("/speech-to-text")
-async def speech_to_text(audio: UploadFile = File(...)):
+async def speech_to_text(request: Request, audio: UploadFile = File(...)):
     """Convert audio file to text using ElevenLabs Speech-to-Text API optimized for Vietnamese"""
     try:
         # Read the uploaded audio file
         audio_content = await audio.read()
         print(f"🎙️ Received audio file: {len(audio_content)} bytes")
         
-        # Create BytesIO object from audio content
-        from io import BytesIO
-        audio_data = BytesIO(audio_content)
-        
         # Use ElevenLabs Speech-to-Text with Vietnamese language specification
         print("🎙️ Calling ElevenLabs Speech-to-Text API...")
-        transcription = elevenlabs_client.speech_to_text.convert(
-            file=audio_data,
-            model_id="scribe_v1",  # Only scribe_v1 is supported
-            language_code="vi"  # Explicitly set to Vietnamese for better accuracy
-        )
+        async with admission.admit("voice", request, uses_llm=False) as slot:
+            transcription = await slot.run(transcribe_audio, audio_content)
         
         print(f"✅ Transcription successful: {transcription.text}")
         return {"text": transcription.text}
     
+    except HTTPException:
+        # Rate limited / shed by admission control
+        raise
     except TimeoutError as e:
         print(f"⏱️ Speech-to-text timeout: {e}")
         return {"error": "Request timeout. Please try again.", "text": ""}
@@ -624,36 +591,65 @@ async def speech_to_text(audio: UploadFile = File(...)):
         print(f"🎙️ Speech-to-text error: {e}")
         return {"error": f"Transcription failed: {str(e)}", "text": ""}
 
+def synthesize_speech(text: str, audio_format: str = audio_formats.DEFAULT_FORMAT) -> bytes:
+    """Synthesize Vietnamese speech with ElevenLabs TTS and return the audio bytes
+    in `audio_format` (see audio_formats.FORMATS)."""
+    started = time.perf_counter()
+    # Use ElevenLabs TTS with turbo v2.5 model (v3) for better Vietnamese support
+    audio_generator = clients.elevenlabs().text_to_speech.convert(
+        text=text,
+        voice_id="deC6NEXcbavaVWbzjgzb",
+        model_id="eleven_v3",  # Human-like and expressive speech generation
+        output_format=audio_formats.output_format(audio_format),
+        voice_settings={
+            "stability": 0.5,  # Balanced stability for clear Vietnamese pronunciation
+            "similarity_boost": 0.75,  # Higher similarity for natural Vietnamese tone
+            "style": 0.5,  # Moderate style for conversational Vietnamese
+            "use_speaker_boost": True  # Enhanced clarity for Vietnamese speech
+        }
+    )
+    
+    # Convert generator to bytes
+    audio = audio_formats.finish_tts(audio_format, b"".join(audio_generator))
+    audio_formats.record("tts", audio_format, len(audio), (time.perf_counter() - started) * 1000)
+    return audio
+
+def answer_voice_turn(text: str, location: str, session_id: str = None):
+    """Chat pipeline for one transcribed voice turn; returns (answer, session_id)."""
+    return profiling_helper.profiled("voice", answer_chat, ChatMessage(text=text, location=location, session_id=session_id),
+                                     reseed_expired=False)
+
+@app.websocket("/voice")
+async def voice(websocket: WebSocket):
+    """Full-duplex voice conversation: audio in, transcript + answer + sentence audio out (see voice_pipeline.py)."""
+    await voice_pipeline.serve(websocket, admission, transcribe_audio, answer_voice_turn, synthesize_speech)
+
 @app.post("/text-to-speech")
-async def text_to_speech(message: dict):
-    """Convert text to speech using ElevenLabs TTS API"""
+async def text_to_speech(message: dict, request: Request, format: Optional[str] = None):
+    """Convert text to speech using ElevenLabs TTS API.
+    The audio format comes from `format` (query or body), else the Accept header and network hints."""
+    try:
+        audio_format = audio_formats.negotiate(request.headers, format or message.get("format"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Audio-Format": audio_format, "Vary": "Accept, Save-Data, ECT, Downlink"}
+    media_type = audio_formats.media_type(audio_format)
     try:
         text = message.get("text", "")
         if not text:
-            return Response(content=b"", media_type="audio/mpeg")
-        
-        # Use ElevenLabs TTS with turbo v2.5 model (v3) for better Vietnamese support
-        audio_generator = elevenlabs_client.text_to_speech.convert(
-            text=text,
-            voice_id="deC6NEXcbavaVWbzjgzb",
-            model_id="eleven_v3",  # Human-like and expressive speech generation
-            output_format="mp3_44100_128",
-            voice_settings={
-                "stability": 0.5,  # Balanced stability for clear Vietnamese pronunciation
-                "similarity_boost": 0.75,  # Higher similarity for natural Vietnamese tone
-                "style": 0.5,  # Moderate style for conversational Vietnamese
-                "use_speaker_boost": True  # Enhanced clarity for Vietnamese speech
-            }
-        )
+            return Response(content=b"", media_type=media_type, headers=headers)
         
-        # Convert generator to bytes
-        audio_bytes = b"".join(audio_generator)
+        async with admission.admit("voice", request, uses_llm=False) as slot:
+            audio_bytes = await slot.run(synthesize_speech, text, audio_format)
         
-        return Response(content=audio_bytes, media_type="audio/mpeg")
+        return Response(content=audio_bytes, media_type=media_type, headers=headers)
     
+    except HTTPException:
+        # Rate limited / shed by admission control
+        raise
     except Exception as e:
         print(f"🔊 Text-to-speech error: {e}")
-        return Response(content=b"", media_type="audio/mpeg")
+        return Response(content=b"", media_type=media_type, headers=headers)
     
 
 
@@ -661,37 +657,103 @@ class MarkdownData(BaseModel):
     content: str
     namespace: str = "restaurants"
 
-@app.post("/ingest-restaurants")
-async def ingest_restaurants(data: MarkdownData):
+@app.post("/ingest-restaurants", status_code=202)
+async def ingest_restaurants(request: Request, namespace: str = "restaurants"):
     """
-    Ingest restaurants data from markdown text into the vector database.
+    Queue restaurants markdown for ingestion into the vector database and return a job ID.
     The markdown should follow the specified format with ## headers for each restaurant.
+
+    Accepts either JSON ({"content": "...", "namespace": "..."}) or the raw markdown as the
+    request body (e.g. Content-Type: text/markdown, chunked uploads are streamed to disk).
+    Poll GET /ingest-jobs/{job_id} for progress.
     """
+    async with admission.admit("ingestion", request):
+        return await _queue_ingestion(request, namespace)
+
+async def _queue_ingestion(request: Request, namespace: str):
+    spool = tempfile.NamedTemporaryFile(mode="wb", suffix=".md", delete=False)
     try:
-        # Parse markdown content
-        restaurants = parse_restaurant_markdown(data.content)
-        if not restaurants:
-            raise HTTPException(status_code=400, detail="No restaurant information found in the markdown")
-        
-        # Store each restaurant in the database
-        success_count = 0
-        for restaurant in restaurants:
-            text = restaurant_to_text(restaurant)
-            if upsert_data(text, namespace="restaurants"):
-                success_count += 1
-        
-        return JSONResponse(
-            content={
-                "message": f"Successfully ingested {success_count} restaurants into the database",
-                "total_processed": len(restaurants),
-                "successful": success_count
-            },
-            status_code=200
-        )
-    
+        with spool:
+            if request.headers.get("content-type", "").startswith("application/json"):
+                data = MarkdownData(**(await request.json()))
+                namespace = data.namespace
+                spool.write(data.content.encode("utf-8"))
+            else:
+                async for chunk in request.stream():
+                    spool.write(chunk)
+        if os.path.getsize(spool.name) == 0:
+            raise HTTPException(status_code=400, detail="Empty markdown payload")
+        job = ingest_jobs.submit(spool.name, namespace)
+    except HTTPException:
+        os.unlink(spool.name)
+        raise
     except Exception as e:
+        os.unlink(spool.name)
         raise HTTPException(status_code=500, detail=f"Error processing markdown: {str(e)}")
 
+    return JSONResponse(
+        content={
+            "message": "Ingestion job queued",
+            "job_id": job.id,
+            "status_url": f"/ingest-jobs/{job.id}"
+        },
+        status_code=202
+    )
+
+@app.get("/ingest-jobs/{job_id}")
+async def ingest_job_status(job_id: str):
+    """Progress, throughput and failures of an ingestion job."""
+    job = ingest_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job")
+    return job.to_dict()
+
+@app.get("/metrics")
+async def metrics():
+    """Counters and timings of this worker, including single-flight coalescing ratios."""
+    return {
+        **metrics_helper.snapshot(),
+        "singleflight": singleflight.stats(),
+        "admission": admission.stats(),
+        "llm_tasks": model_router.stats(),
+        "active_sessions": session_store.active_sessions(),
+        "prefetch": prefetch_helper.stats(),
+        "deployment_pools": deployment_pool.stats(),
+        "cassette": upstream_cassette.stats(),
+        "idempotency": idempotency.store.stats(),
+        "normalization": text_normalizer.stats(),
+        "clients": clients.created(),
+        "lean_mode": LEAN_MODE
+    }
+
+def _require_admin(request: Request):
+    """Admin endpoints need ADMIN_TOKEN set and sent as the X-Admin-Token header."""
+    token = os.getenv("ADMIN_TOKEN")
+    if not token or request.headers.get("x-admin-token") != token:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.post("/admin/profile")
+async def capture_profile(request: Request, seconds: float = 10):
+    """Sample every thread of this worker for `seconds` and write a flame-graph profile."""
+    _require_admin(request)
+    try:
+        return await asyncio.to_thread(profiling_helper.sampler.capture_all, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/admin/profiles")
+async def list_profiles(request: Request):
+    _require_admin(request)
+    return {"profiles": profiling_helper.list_profiles()}
+
+@app.get("/admin/profiles/{file_name}")
+async def download_profile(file_name: str, request: Request):
+    _require_admin(request)
+    path = profiling_helper.profile_path(file_name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Unknown profile")
+    return FileResponse(path, filename=file_name)
+
 @app.get("/")
 async def root():
     return {"message": "AI-HOI Backend is running with ElevenLabs Voice features."}
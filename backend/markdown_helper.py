@@ -1,48 +1,133 @@
-def parse_restaurant_markdown(markdown_content: str):
-    """Parse markdown content and extract restaurant information."""
-    restaurants = []
-    current_restaurant = {}
-    
-    lines = markdown_content.split('\n')
-    for line in lines:
+import codecs
+import hashlib
+import io
+import os
+import re
+import unicodedata
+
+import text_normalizer
+
+_NUMBERING_RE = re.compile(r'^\d+\.\s*')
+
+# Every field a restaurant can carry, in the order they are written to the index
+RESTAURANT_FIELDS = (
+    'name', 'cuisine', 'location', 'address', 'price_range', 'specialties',
+    'opening_hours', 'phone', 'rating', 'description', 'highlights'
+)
+
+# "- **<label>**: value" -> record key. One dict lookup per line instead of a regex per field.
+FIELD_LABELS = {
+    'địa chỉ': 'address',
+    'món đặc sắc': 'specialties',
+    'giá': 'price_range',
+    'mô tả': 'description',
+    'loại hình': 'cuisine',
+    'khu vực': 'location',
+    'giờ mở cửa': 'opening_hours',
+    'điện thoại': 'phone',
+    'đánh giá': 'rating',
+    'điểm nổi bật': 'highlights',
+}
+
+def _new_restaurant(name: str) -> dict:
+    restaurant = dict.fromkeys(RESTAURANT_FIELDS, '')
+    # Drop the "1. " numbering so the name (and its ID) survives re-ordering
+    restaurant['name'] = _NUMBERING_RE.sub('', name)
+    return restaurant
+
+def iter_chunk_lines(chunks, encoding: str = 'utf-8'):
+    """Turn an iterable of arbitrary byte (or str) chunks, e.g. a request body, into lines.
+
+    Multi-byte characters split across chunk boundaries are decoded correctly.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk) if isinstance(chunk, (bytes, bytearray)) else chunk
+        *lines, pending = pending.split('\n')
+        yield from lines
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+def iter_restaurants(source):
+    """Stream restaurant records out of a markdown catalog, one at a time.
+
+    `source` is a file path, a text or binary file object, or any iterable of lines
+    (str or bytes). Only the restaurant being parsed is held in memory, so catalogs
+    of any size are parsed in constant memory.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'r', encoding='utf-8') as f:
+            yield from iter_restaurants(f)
+        return
+    if isinstance(source, io.IOBase) and not isinstance(source, io.TextIOBase):
+        source = io.TextIOWrapper(source, encoding='utf-8', errors='replace')
+
+    current = None
+    for line in source:
+        if isinstance(line, (bytes, bytearray)):
+            line = line.decode('utf-8', errors='replace')
         line = line.strip()
-        if not line or (line.startswith('#') and not line.startswith('##')) or line.startswith('---') or line.startswith('*'):
-            if current_restaurant:
-                restaurants.append(current_restaurant)
-                current_restaurant = {}
-            continue
-            
-        if line.startswith('##'):
-            if current_restaurant:
-                restaurants.append(current_restaurant)
-            # Simply remove '##' and any leading/trailing whitespace
-            restaurant_name = line.replace('##', '').strip()
-            print(restaurant_name)
-            current_restaurant = {'name': restaurant_name}
+        if not line:
             continue
-        print(current_restaurant)  
-        if line.startswith('- **'):
-            key = line.split('**')[1].lower().strip(':')
-            value = line.split('**: ')[1].strip()
-            if key == 'địa chỉ':
-                current_restaurant['address'] = value
-            elif key == 'món đặc sắc':
-                current_restaurant['specialty'] = value
-            elif key == 'giá':
-                current_restaurant['price'] = value
-            elif key == 'mô tả':
-                current_restaurant['description'] = value
-                
-    # Add the last restaurant if exists
-    if current_restaurant:
-        restaurants.append(current_restaurant)
-        
-    return restaurants
+
+        if line.startswith('## '):
+            if current is not None:
+                yield current
+            current = _new_restaurant(line[3:].strip())
+        elif line.startswith('- **'):
+            if current is None:
+                continue
+            label_end = line.find('**', 4)
+            if label_end == -1:
+                continue
+            # Accept both "**Giá**: x" and "**Giá:** x"
+            label = line[4:label_end].rstrip(':').strip()
+            key = FIELD_LABELS.get(label.lower()) or FIELD_LABELS.get(unicodedata.normalize('NFC', label).lower())
+            if key:
+                current[key] = line[label_end + 2:].lstrip(':').strip()
+        elif line.startswith('---') or (line.startswith('#') and not line.startswith('##')):
+            # Separators and top-level headings close the current restaurant
+            if current is not None:
+                yield current
+                current = None
+
+    if current is not None:
+        yield current
+
+def parse_restaurant_markdown(markdown_content: str):
+    """Parse markdown content and extract restaurant information."""
+    return list(iter_restaurants(io.StringIO(markdown_content)))
 
 def restaurant_to_text(restaurant: dict) -> str:
-    """Convert restaurant information to searchable text format."""
-    return f"""Nhà hàng: {restaurant.get('name', '')}
+    """Convert restaurant information to searchable text format.
+
+    The text is recomposed (NFC, "Hoà" -> "Hòa") to match the canonical queries it is searched
+    with; the record itself, and so its ID, keeps the catalog's spelling.
+    """
+    text = f"""Nhà hàng: {restaurant.get('name', '')}
 Địa chỉ: {restaurant.get('address', '')}
-Món đặc sắc: {restaurant.get('specialty', '')}
-Giá: {restaurant.get('price', '')}
-Mô tả: {restaurant.get('description', '')}"""
\ No newline at end of file
+Món đặc sắc: {restaurant.get('specialties', '')}
+Giá: {restaurant.get('price_range', '')}
+Mô tả: {restaurant.get('description', '')}"""
+    # Optional fields are only written when the catalog provides them
+    for label, key in (('Loại hình', 'cuisine'), ('Khu vực', 'location'), ('Giờ mở cửa', 'opening_hours'),
+                       ('Điện thoại', 'phone'), ('Đánh giá', 'rating'), ('Điểm nổi bật', 'highlights')):
+        if restaurant.get(key):
+            text += f"\n{label}: {restaurant[key]}"
+    return text_normalizer.recompose(text)
+
+def restaurant_id(name: str) -> str:
+    """Stable vector ID for a restaurant, derived from its name only.
+
+    The "1. " numbering of the markdown headings is ignored so inserting or
+    removing a restaurant does not shift the IDs of the ones after it.
+    """
+    key = unicodedata.normalize('NFC', _NUMBERING_RE.sub('', name.strip()))
+    key = ' '.join(key.lower().split())
+    return f"restaurant_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+def content_hash(text: str) -> str:
+    """Hash of the content, stable across processes (unlike the builtin hash())."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
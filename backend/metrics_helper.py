@@ -0,0 +1,42 @@
+"""
+In-process metrics: counters and timings, exposed by GET /metrics.
+"""
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_timings = {}
+
+def incr(name: str, value: float = 1):
+    """Increment a counter."""
+    with _lock:
+        _counters[name] += value
+
+def observe(name: str, value: float):
+    """Record one observation (e.g. a latency in ms) for a timing."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {"count": 0, "total": 0.0, "max": 0.0}
+        timing["count"] += 1
+        timing["total"] += value
+        timing["max"] = max(timing["max"], value)
+
+def ratio(numerator: str, denominator: str) -> float:
+    """Ratio of two counters (0 when the denominator is 0)."""
+    with _lock:
+        total = _counters.get(denominator, 0)
+        return round(_counters.get(numerator, 0) / total, 4) if total else 0.0
+
+def snapshot() -> dict:
+    """Current value of every counter and timing."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "timings": {
+                name: {**timing, "avg": round(timing["total"] / timing["count"], 3)}
+                for name, timing in _timings.items()
+            },
+        }
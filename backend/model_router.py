@@ -0,0 +1,131 @@
+"""
+Per-task model routing for Azure OpenAI chat completions.
+
+Internal calls (entity extraction, conversation summaries) don't need
+the deployment that writes user-facing answers. Each task can be pointed at its own
+deployment, optionally on its own Azure resource, with its own max_tokens and timeout:
+
+    AZURE_OPENAI_<TASK>_MODEL_NAME    deployment name (default: AZURE_OPENAI_MODEL_NAME)
+    AZURE_OPENAI_<TASK>_ENDPOINT      endpoint        (default: AZURE_OPENAI_ENDPOINT)
+    AZURE_OPENAI_<TASK>_API_KEY       API key         (default: AZURE_OPENAI_API_KEY)
+    AZURE_OPENAI_<TASK>_MAX_TOKENS    completion limit
+    AZURE_OPENAI_<TASK>_TIMEOUT       seconds
+
+with <TASK> one of EXTRACTION, SUMMARIZATION, ANSWER. When a task deployment
+fails, the call is retried once on the main deployment.
+
+Calls to the main deployment go through the chat deployment pool (deployment_pool.py), which
+balances them across AZURE_OPENAI_CHAT_POOL when several deployments are configured.
+"""
+
+import os
+import time
+
+import clients
+import metrics_helper
+from admission_helper import record_usage
+from deployment_pool import get_pool
+
+# max_tokens / timeout used when the environment does not override them
+TASK_DEFAULTS = {
+    "extraction": {"max_tokens": 200, "timeout": 10},
+    "summarization": {"max_tokens": 150, "timeout": 15},
+    "answer": {"max_tokens": None, "timeout": 60},
+}
+
+def get_client(endpoint=None, api_key=None):
+    """Shared AzureOpenAI client per endpoint (the main endpoint by default)."""
+    return clients.azure_openai(endpoint, api_key)
+
+def task_config(task: str) -> dict:
+    """Deployment, endpoint, key, max_tokens and timeout for a task."""
+    prefix = f"AZURE_OPENAI_{task.upper()}"
+    defaults = TASK_DEFAULTS[task]
+    max_tokens = os.getenv(f"{prefix}_MAX_TOKENS")
+    timeout = os.getenv(f"{prefix}_TIMEOUT")
+    return {
+        "deployment": os.getenv(f"{prefix}_MODEL_NAME") or os.getenv("AZURE_OPENAI_MODEL_NAME"),
+        "endpoint": os.getenv(f"{prefix}_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT"),
+        "api_key": os.getenv(f"{prefix}_API_KEY") or os.getenv("AZURE_OPENAI_API_KEY"),
+        "max_tokens": int(max_tokens) if max_tokens else defaults["max_tokens"],
+        "timeout": float(timeout) if timeout else defaults["timeout"],
+    }
+
+def _is_main_deployment(config: dict) -> bool:
+    return (
+        config["deployment"] == os.getenv("AZURE_OPENAI_MODEL_NAME")
+        and config["endpoint"] == os.getenv("AZURE_OPENAI_ENDPOINT")
+    )
+
+def record(task: str, started: float, response, fallback: bool = False):
+    """Record latency and token metrics of one call made for `task`."""
+    metrics_helper.incr(f"llm.{task}.calls")
+    metrics_helper.observe(f"llm.{task}.latency_ms", (time.perf_counter() - started) * 1000)
+    if fallback:
+        metrics_helper.incr(f"llm.{task}.fallbacks")
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    else:
+        # LangChain AIMessage
+        usage_metadata = getattr(response, "usage_metadata", None) or {}
+        prompt_tokens = usage_metadata.get("input_tokens", 0)
+        completion_tokens = usage_metadata.get("output_tokens", 0)
+    metrics_helper.incr(f"llm.{task}.prompt_tokens", prompt_tokens)
+    metrics_helper.incr(f"llm.{task}.completion_tokens", completion_tokens)
+    record_usage(response)
+
+def complete(task: str, messages: list, **kwargs):
+    """Chat completion for `task`, falling back to the main deployment if the task deployment fails."""
+    config = task_config(task)
+    params = dict(kwargs)
+    if config["max_tokens"] and "max_tokens" not in params:
+        params["max_tokens"] = config["max_tokens"]
+
+    started = time.perf_counter()
+    try:
+        if _is_main_deployment(config):
+            response = get_pool("chat").chat(messages, timeout=config["timeout"], **params)
+        else:
+            response = get_client(config["endpoint"], config["api_key"]).chat.completions.create(
+                model=config["deployment"],
+                messages=messages,
+                timeout=config["timeout"],
+                **params
+            )
+        record(task, started, response)
+        return response
+    except Exception as e:
+        metrics_helper.incr(f"llm.{task}.errors")
+        if _is_main_deployment(config):
+            raise
+        print(f"⚠️ {task} deployment '{config['deployment']}' failed ({e}), falling back to main deployment")
+
+    started = time.perf_counter()
+    response = get_pool("chat").chat(
+        messages,
+        timeout=max(config["timeout"], TASK_DEFAULTS["answer"]["timeout"]),
+        **params
+    )
+    record(task, started, response, fallback=True)
+    return response
+
+def stats() -> dict:
+    """Per-task deployment, calls, average latency and tokens per call."""
+    snapshot = metrics_helper.snapshot()
+    counters, timings = snapshot["counters"], snapshot["timings"]
+    result = {}
+    for task in TASK_DEFAULTS:
+        calls = counters.get(f"llm.{task}.calls", 0)
+        latency = timings.get(f"llm.{task}.latency_ms", {})
+        result[task] = {
+            "deployment": task_config(task)["deployment"],
+            "calls": int(calls),
+            "fallbacks": int(counters.get(f"llm.{task}.fallbacks", 0)),
+            "errors": int(counters.get(f"llm.{task}.errors", 0)),
+            "avg_latency_ms": latency.get("avg", 0.0),
+            "avg_prompt_tokens": round(counters.get(f"llm.{task}.prompt_tokens", 0) / calls, 1) if calls else 0.0,
+            "avg_completion_tokens": round(counters.get(f"llm.{task}.completion_tokens", 0) / calls, 1) if calls else 0.0,
+        }
+    return result
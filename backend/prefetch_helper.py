@@ -0,0 +1,141 @@
+"""
+Speculative prefetch when the client reports its location (POST /location).
+
+The frontend reverse-geocodes the device position well before the first /chat.
+We use that moment to warm, in the background, everything the first answer for this
+area will need:
+- the coordinates cache for the location text the frontend will send with /chat
+- generic "restaurant" Foursquare results around the position
+- a local shard of the RAG index for the area (vectors + metadata): the restaurants closest
+  to one "restaurants in <area>" query. It is only a subset of the index, so its matches are
+  merged with the Pinecone results (and used alone only when Pinecone fails), never
+  substituted for them
+
+Prefetching is rate-limited globally and once per geohash cell per cooldown period.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics_helper
+import restaurant_search
+from admission_helper import TokenBucket
+from cache_helper import TTLCache
+from location_helper import geohash_encode, prime_coordinates
+
+CELL_PRECISION = 6    # ~1.2 x 0.6 km: one prefetch per cell
+SHARD_PRECISION = 5   # ~5 km: one RAG shard per district-sized cell
+COOLDOWN_SECONDS = float(os.getenv("PREFETCH_COOLDOWN_SECONDS", "600"))
+SHARD_TTL_SECONDS = float(os.getenv("PREFETCH_SHARD_TTL_SECONDS", "1800"))
+SHARD_SIZE = int(os.getenv("PREFETCH_SHARD_SIZE", "50"))
+MAX_PENDING = 8
+
+_enabled = os.getenv("PREFETCH_ENABLED", "true").lower() not in ("0", "false", "no")
+_bucket = TokenBucket(float(os.getenv("PREFETCH_PER_MINUTE", "30")) / 60, 10)
+_bucket_lock = threading.Lock()
+_cells = TTLCache(COOLDOWN_SECONDS, 20000)      # cell -> {"used": bool}
+_shards = TTLCache(SHARD_TTL_SECONDS, 500)      # shard cell -> (records, normalized matrix)
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+_pending = threading.BoundedSemaphore(MAX_PENDING)
+
+def frontend_location_text(address: dict) -> str:
+    """The location string the frontend builds from the reverse-geocoded address."""
+    parts = [address.get("road"), address.get("suburb"), address.get("city")]
+    return ", ".join(part for part in parts if part and part != "undefined")
+
+def schedule(lat: float, lon: float, location_info: dict, shard_loader=None) -> bool:
+    """Queue a warm-up for this position. Returns False when it was skipped."""
+    if not _enabled:
+        return False
+    cell = geohash_encode(lat, lon, CELL_PRECISION)
+    if cell in _cells:
+        metrics_helper.incr("prefetch.skipped.cooldown")
+        # Still prime this exact location text, it costs nothing
+        _prime_location_text(lat, lon, location_info)
+        return False
+    with _bucket_lock:
+        limited = _bucket.try_take() > 0
+    if limited:
+        metrics_helper.incr("prefetch.skipped.rate_limited")
+        return False
+    if not _pending.acquire(blocking=False):
+        metrics_helper.incr("prefetch.skipped.busy")
+        return False
+
+    _cells.set(cell, {"used": False})
+    metrics_helper.incr("prefetch.scheduled")
+    future = _executor.submit(_warm, lat, lon, location_info, shard_loader)
+    future.add_done_callback(lambda _: _pending.release())
+    return True
+
+def _prime_location_text(lat, lon, location_info):
+    location_text = frontend_location_text((location_info or {}).get("address_details") or {})
+    if location_text:
+        prime_coordinates(location_text, lat, lon)
+
+def _warm(lat, lon, location_info, shard_loader):
+    try:
+        _prime_location_text(lat, lon, location_info)
+        # Same arguments as the default /chat search so the cached result is reused
+        restaurant_search.search(lat, lon, "", primed=True)
+
+        shard_cell = geohash_encode(lat, lon, SHARD_PRECISION)
+        area_name = (location_info or {}).get("area_name")
+        if shard_loader and area_name and _shards.get(shard_cell) is None:
+            records, vectors = shard_loader(area_name, SHARD_SIZE)
+            if records:
+                matrix = np.asarray(vectors, dtype=np.float32)
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                _shards.set(shard_cell, (records, matrix))
+        metrics_helper.incr("prefetch.completed")
+        print(f"🔥 Prefetched area around {lat:.4f},{lon:.4f} ({area_name})")
+    except Exception as e:
+        metrics_helper.incr("prefetch.failed")
+        print(f"⚠️ Prefetch failed: {e}")
+
+def note_chat(coords):
+    """Called by /chat once coordinates are known: counts chats landing in a prefetched cell."""
+    if not coords:
+        return
+    state = _cells.get(geohash_encode(coords["lat"], coords["lon"], CELL_PRECISION))
+    if state is not None and not state["used"]:
+        state["used"] = True
+        metrics_helper.incr("prefetch.cells_used")
+
+def local_shard_matches(coords, query_vector, top_k: int):
+    """Top-k restaurants of the prefetched shard of this area, or None if there is no shard."""
+    if not coords:
+        return None
+    shard = _shards.get(geohash_encode(coords["lat"], coords["lon"], SHARD_PRECISION))
+    if shard is None:
+        metrics_helper.incr("prefetch.rag_shard.miss")
+        return None
+    records, matrix = shard
+    query = np.asarray(query_vector, dtype=np.float32)
+    scores = matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    order = np.argsort(-scores)[:top_k]
+    metrics_helper.incr("prefetch.hit.rag_shard")
+    return [dict(records[i], score=float(scores[i])) for i in order]
+
+def stats() -> dict:
+    counters = metrics_helper.snapshot()["counters"]
+    completed = counters.get("prefetch.completed", 0)
+    return {
+        "enabled": _enabled,
+        "scheduled": int(counters.get("prefetch.scheduled", 0)),
+        "completed": int(completed),
+        "failed": int(counters.get("prefetch.failed", 0)),
+        "skipped": {
+            reason: int(counters.get(f"prefetch.skipped.{reason}", 0))
+            for reason in ("cooldown", "rate_limited", "busy")
+        },
+        "hits": {
+            resource: int(counters.get(f"prefetch.hit.{resource}", 0))
+            for resource in ("geocode", "foursquare", "rag_shard")
+        },
+        # Share of prefetched cells where a chat actually followed
+        "hit_rate": round(counters.get("prefetch.cells_used", 0) / completed, 4) if completed else 0.0,
+    }
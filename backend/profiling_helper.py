@@ -0,0 +1,220 @@
+"""
+Opt-in sampling profiler for live workers.
+
+A background thread reads the Python stacks of the threads being profiled every
+PROFILE_INTERVAL_MS (default 5 ms) with sys._current_frames(); nothing is traced, so the
+profiled code runs at full speed. Two ways to use it:
+- PROFILE_SAMPLE_RATE (0..1, default 0): fraction of /chat requests profiled individually
+- an admin-triggered capture of every thread for a few seconds (POST /admin/profile)
+
+Code marks its stages with `with stage("name"):`. Samples taken inside a stage get a
+"stage:<name>" root frame, so flame graphs split by stage (extract_entities, geocode, ...),
+and every stage's wall time is recorded as a timing in GET /metrics.
+
+Profiles are written to PROFILE_DIR (default backend/data/profiles) as collapsed stacks
+(`.collapsed`, for flamegraph.pl / speedscope / inferno) and speedscope JSON (`.speedscope.json`).
+Each sample is weighted by the wall time since the previous one, so values are milliseconds
+even when the sampler is delayed by threads holding the GIL.
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics_helper
+
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'profiles')
+)
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+MAX_CAPTURE_SECONDS = 60
+MAX_STACK_DEPTH = 128
+
+_stages = {}  # thread id -> stack of stage names
+
+@contextmanager
+def stage(name: str):
+    """Mark a stage of request processing (for profiles and per-stage timings)."""
+    thread_id = threading.get_ident()
+    stack = _stages.setdefault(thread_id, [])
+    stack.append(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics_helper.observe(f"stage.{name}_ms", (time.perf_counter() - started) * 1000)
+        stack.pop()
+        if not stack:
+            _stages.pop(thread_id, None)
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _collapse(frame, thread_id) -> tuple:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    stages = _stages.get(thread_id)
+    if stages:
+        names.insert(0, "stage:" + "/".join(stages))
+    return tuple(names)
+
+class Recording:
+    def __init__(self, name: str):
+        self.name = name
+        self.samples = Counter()  # collapsed stack -> milliseconds
+        self.started = time.monotonic()
+        self.duration = 0.0
+
+    def add(self, stack: tuple, weight_ms: float):
+        self.samples[stack] += weight_ms
+
+    def write(self, directory: str = PROFILE_DIR) -> dict:
+        """Write collapsed stacks and speedscope JSON; returns the file names."""
+        os.makedirs(directory, exist_ok=True)
+        base = f"{self.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{random.getrandbits(16):04x}"
+        collapsed = f"{base}.collapsed"
+        speedscope = f"{base}.speedscope.json"
+        with open(os.path.join(directory, collapsed), 'w', encoding='utf-8') as f:
+            for stack, weight_ms in self.samples.most_common():
+                f.write(f"{';'.join(stack)} {max(1, round(weight_ms))}\n")
+        with open(os.path.join(directory, speedscope), 'w', encoding='utf-8') as f:
+            json.dump(self.to_speedscope(), f)
+        return {"collapsed": collapsed, "speedscope": speedscope}
+
+    def to_speedscope(self) -> dict:
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, weight_ms in self.samples.items():
+            row = []
+            for name in stack:
+                if name not in index:
+                    index[name] = len(frames)
+                    frames.append({"name": name})
+                row.append(index[name])
+            samples.append(row)
+            weights.append(round(weight_ms, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "ai-hoi profiling_helper",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+class Sampler:
+    """Background thread sampling the stacks of registered threads (or all threads during a capture)."""
+
+    def __init__(self, interval: float = INTERVAL_SECONDS):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.targets = {}       # thread id -> Recording
+        self.capture = None     # Recording of every thread, while an admin capture runs
+        self.thread = None
+
+    def _ensure_running(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._loop, name="profiler", daemon=True)
+            self.thread.start()
+
+    def _loop(self):
+        own_id = threading.get_ident()
+        last = time.perf_counter()
+        while True:
+            with self.lock:
+                if not self.targets and self.capture is None:
+                    self.thread = None
+                    return
+                targets = dict(self.targets)
+                capture = self.capture
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            weight_ms, last = (now - last) * 1000, now
+            for thread_id, recording in targets.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    recording.add(_collapse(frame, thread_id), weight_ms)
+            if capture is not None:
+                for thread_id, frame in frames.items():
+                    if thread_id != own_id:
+                        capture.add(_collapse(frame, thread_id), weight_ms)
+            del frames
+            time.sleep(self.interval)
+
+    def start_thread(self, name: str) -> Recording:
+        recording = Recording(name)
+        with self.lock:
+            self.targets[threading.get_ident()] = recording
+            self._ensure_running()
+        return recording
+
+    def stop_thread(self) -> Recording:
+        with self.lock:
+            recording = self.targets.pop(threading.get_ident(), None)
+        if recording is not None:
+            recording.duration = time.monotonic() - recording.started
+        return recording
+
+    def capture_all(self, seconds: float, name: str = "capture") -> dict:
+        """Sample every thread for `seconds` (blocking) and write the profile."""
+        seconds = min(max(seconds, 0.1), MAX_CAPTURE_SECONDS)
+        with self.lock:
+            if self.capture is not None:
+                raise RuntimeError("A capture is already running")
+            self.capture = recording = Recording(name)
+            self._ensure_running()
+        try:
+            time.sleep(seconds)
+        finally:
+            with self.lock:
+                self.capture = None
+        recording.duration = seconds
+        files = recording.write()
+        metrics_helper.incr("profiling.captures")
+        return {"seconds": seconds, "stacks": len(recording.samples), **files}
+
+sampler = Sampler()
+
+def profiled(name: str, fn, *args, **kwargs):
+    """Run fn, profiling it for a PROFILE_SAMPLE_RATE fraction of calls (call from its worker thread)."""
+    if SAMPLE_RATE <= 0 or random.random() >= SAMPLE_RATE:
+        return fn(*args, **kwargs)
+    sampler.start_thread(name)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        recording = sampler.stop_thread()
+        if recording is not None and recording.samples:
+            files = recording.write()
+            metrics_helper.incr("profiling.requests")
+            print(f"🔬 Profiled {name} ({recording.duration * 1000:.0f} ms): {files['collapsed']}")
+
+def list_profiles() -> list:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted(os.listdir(PROFILE_DIR), reverse=True)
+
+def profile_path(file_name: str):
+    """Path of a written profile, or None (rejects anything outside PROFILE_DIR)."""
+    if os.path.basename(file_name) != file_name:
+        return None
+    path = os.path.join(PROFILE_DIR, file_name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,166 @@
+"""
+Restaurant search over Foursquare: several queries, widening radius, bounded latency.
+
+search() returns structured records (see location_helper.place_to_record) for:
+- every query at once: each dish mentioned ("phở hoặc bún bò") and a few common synonyms
+  ("cà phê" also searches "coffee"), at most SEARCH_MAX_QUERIES
+- concentric rings (SEARCH_RADII, default 1000,3000,8000 m): the next ring starts every
+  SEARCH_RING_STAGGER_MS (default 250) while the inner ones are still running, and no more
+  rings are started once SEARCH_MIN_RESULTS (default 5) distinct places are found
+- pagination: next pages of the widest ring are only fetched when all rings together found
+  too few places (at most SEARCH_MAX_PAGES pages per query)
+
+The whole search is bounded by SEARCH_BUDGET_MS (default 2500): whatever has arrived by then
+is returned, and late requests only fill the cache. Places are de-duplicated and listed
+innermost ring first, then by distance.
+"""
+
+import contextvars
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics_helper
+from fusion_helper import fold
+from location_helper import search_restaurants_page
+
+RADII = tuple(int(r) for r in os.getenv("SEARCH_RADII", "1000,3000,8000").split(","))
+MIN_RESULTS = int(os.getenv("SEARCH_MIN_RESULTS", "5"))
+PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+MAX_QUERIES = int(os.getenv("SEARCH_MAX_QUERIES", "3"))
+MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", "3"))
+RING_STAGGER_MS = float(os.getenv("SEARCH_RING_STAGGER_MS", "250"))
+BUDGET_MS = float(os.getenv("SEARCH_BUDGET_MS", "2500"))
+
+# Folded dish name -> other queries worth sending (Foursquare names are often in English)
+SYNONYMS = {
+    "ca phe": ["coffee"],
+    "cafe": ["cà phê"],
+    "tra sua": ["milk tea"],
+    "com tam": ["broken rice"],
+    "lau": ["hotpot"],
+    "do nuong": ["bbq"],
+    "nuong": ["bbq"],
+    "hai san": ["seafood"],
+    "oc": ["seafood"],
+    "chay": ["vegetarian"],
+    "com chay": ["vegetarian"],
+    "an chay": ["vegetarian"],
+    "bia": ["beer", "pub"],
+    "kem": ["ice cream"],
+    "banh ngot": ["bakery"],
+}
+
+_SPLIT_RE = re.compile(r"\s*(?:,|;|/|\bhoặc\b|\bhay là\b|\bhay\b|\bvà\b|\bor\b|\band\b)\s*", re.IGNORECASE)
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="places")
+
+def expand_queries(dishes) -> list:
+    """Distinct Foursquare queries for the dishes (a string or a list), synonyms included."""
+    if isinstance(dishes, str) or dishes is None:
+        dishes = [dishes or ""]
+    queries = []
+    for dish in dishes:
+        for part in _SPLIT_RE.split(dish or "") or [""]:
+            queries.append(part.strip())
+    for query in list(queries):
+        queries.extend(SYNONYMS.get(fold(query), []))
+
+    distinct, seen = [], set()
+    for query in queries:
+        if query and fold(query) not in seen:
+            seen.add(fold(query))
+            distinct.append(query)
+    return distinct[:MAX_QUERIES] or [""]
+
+def _submit(fn, *args, **kwargs):
+    # Copy the context so batch sharing and admission token accounting still apply
+    return _executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def search(lat: float, lon: float, dishes=None, min_results: int = MIN_RESULTS, radii: tuple = RADII,
+           page_size: int = PAGE_SIZE, max_results: int = 20, budget_ms: float = BUDGET_MS,
+           primed: bool = False) -> list:
+    """Structured restaurant records near (lat, lon) for `dishes`, innermost ring first.
+
+    :raises RuntimeError: when every request failed and nothing was found
+    """
+    started = time.perf_counter()
+    deadline = started + budget_ms / 1000
+    queries = expand_queries(dishes)
+    pending = {}       # future -> (ring, query, page)
+    pages = {}         # (ring, query) -> pages of records, in order
+    cursors = {}       # (ring, query) -> next-page cursor of the last page
+    errors = []
+    next_ring, next_ring_at = 0, started
+    requests_sent, budget_exhausted = 0, False
+
+    def launch(ring, query, page, cursor=None):
+        nonlocal requests_sent
+        future = _submit(search_restaurants_page, lat, lon, query, radii[ring], page_size,
+                         cursor=cursor, primed=primed)
+        pending[future] = (ring, query, page)
+        requests_sent += 1
+
+    def found():
+        places = {}
+        for ring, query in sorted(pages):
+            for page in pages[(ring, query)]:
+                for record in page:
+                    key = record.get("id") or (record.get("name"), record.get("address"))
+                    if key not in places:
+                        places[key] = dict(record, query=query or None, ring=radii[ring])
+        return list(places.values())
+
+    while True:
+        now = time.perf_counter()
+        enough = len(found()) >= min_results
+        # Start the next ring when it is due, or at once when the inner rings found too few
+        if not enough and next_ring < len(radii) and (now >= next_ring_at or not pending):
+            for query in queries:
+                launch(next_ring, query, 0)
+            next_ring, next_ring_at = next_ring + 1, now + RING_STAGGER_MS / 1000
+
+        # Every ring answered and still too few places: follow the widest ring's next pages
+        if not enough and not pending and next_ring == len(radii):
+            widest = len(radii) - 1
+            for query in queries:
+                cursor = cursors.get((widest, query))
+                page_count = len(pages.get((widest, query), []))
+                if cursor and page_count < MAX_PAGES and len(pages[(widest, query)][-1]) >= page_size:
+                    launch(widest, query, page_count, cursor)
+                    metrics_helper.incr("search.pages")
+        if enough or not pending:
+            break
+        if now >= deadline:
+            budget_exhausted = True
+            metrics_helper.incr("search.budget_exhausted")
+            break
+
+        timeout = deadline - now
+        if not enough and next_ring < len(radii):
+            timeout = min(timeout, max(0.0, next_ring_at - now))
+        done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            ring, query, page = pending.pop(future)
+            try:
+                records, cursor = future.result()
+            except Exception as e:
+                print(f"❌ Foursquare search failed ({query or 'restaurant'}, {radii[ring]} m): {e}")
+                metrics_helper.incr("search.errors")
+                errors.append(e)
+                continue
+            pages.setdefault((ring, query), []).append(records)
+            cursors[(ring, query)] = cursor
+
+    records = found()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    metrics_helper.observe("search.total_ms", elapsed_ms)
+    metrics_helper.observe("search.requests", requests_sent)
+    metrics_helper.observe("search.rings", next_ring)
+    if not records and errors and len(errors) == requests_sent:
+        raise RuntimeError(str(errors[0]))
+
+    records.sort(key=lambda r: (r["ring"], r["distance"] if r.get("distance") is not None else float("inf")))
+    print(f"🧭 Found {len(records)} places for {queries} in {next_ring} ring(s) up to {radii[max(next_ring - 1, 0)]} m "
+          f"({requests_sent} requests, {elapsed_ms:.0f}ms{', budget exhausted' if budget_exhausted else ''})")
+    return records[:max_results]
@@ -0,0 +1,188 @@
+"""
+Unified retrieval: one query embedding, every retriever queried concurrently with it.
+
+A query is embedded once (embed_query caches vectors for RETRIEVAL_EMBEDDING_CACHE_SECONDS,
+default 600, so /chat and /search-history share them) and the same vector is sent to
+each source in parallel:
+
+- knowledge:     restaurant records of the RAG index (default namespace of "ai-hoi"),
+                 answered from the prefetched area shard when there is one
+- restaurants:   text snippets ingested through POST /ingest-restaurants (namespace "restaurants")
+- conversations: similar past conversations from the local conversation index
+                 (only those scoring at least RETRIEVAL_MEMORY_MIN_SCORE, default 0.5)
+
+Sources fail independently (a failed source returns no results). Each source's time is
+recorded as a `retrieval.<source>_ms` timing in GET /metrics and returned with the results.
+"""
+
+import contextvars
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import clients
+import deployment_pool
+import metrics_helper
+import prefetch_helper
+import text_normalizer
+from batch_helper import batch_shared
+from cache_helper import TTLCache
+from conversation_index import conversation_index
+from singleflight import single_flight
+from vector_codec import embedding_params
+
+RAG_INDEX = "ai-hoi"
+SNIPPET_NAMESPACE = "restaurants"
+SOURCES = ("knowledge", "restaurants", "conversations")
+DEFAULT_TOP_K = {"knowledge": 5, "restaurants": 3, "conversations": 2}
+MEMORY_MIN_SCORE = float(os.getenv("RETRIEVAL_MEMORY_MIN_SCORE", "0.5"))
+
+_embeddings = TTLCache(float(os.getenv("RETRIEVAL_EMBEDDING_CACHE_SECONDS", "600")), 2000)
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+# ---------------------- Embedding ----------------------
+@batch_shared("embedding")
+@single_flight("embedding")
+def _embed(text: str):
+    response = deployment_pool.get_pool("embedding").embed(text, **embedding_params())
+    return response.data[0].embedding
+
+def embed_query(text: str, cache: bool = True):
+    """Embedding of `text`. Queries with the same canonical form, with or without diacritics,
+    are embedded once within the cache TTL."""
+    text = text_normalizer.canonical(text)
+    key = text_normalizer.fold(text)
+    vector = _embeddings.get(key) if cache else None
+    if vector is not None:
+        metrics_helper.incr("retrieval.embedding.cache_hits")
+        return vector
+    metrics_helper.incr("retrieval.embedding.cache_misses")
+    vector = _embed(text)
+    if cache:
+        _embeddings.set(key, vector)
+    return vector
+
+def _submit(fn, *args):
+    # Copy the context so batch sharing and admission token accounting still apply
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+def embed_in_background(text: str):
+    """Start embedding `text` now (e.g. while entities are extracted); returns a Future."""
+    return _submit(embed_query, text)
+
+# ---------------------- Sources ----------------------
+def match_to_record(match) -> dict:
+    """Structured restaurant record from a RAG index match."""
+    metadata = match.metadata or {}
+    return {
+        "id": match.id,
+        "name": metadata.get('name', 'N/A'),
+        "address": metadata.get('address', ''),
+        "cuisine": metadata.get('cuisine', ''),
+        "location": metadata.get('location', ''),
+        "price_range": metadata.get('price_range', ''),
+        "specialties": metadata.get('specialties', ''),
+        "description": metadata.get('description', ''),
+        "text": metadata.get('text', ''),
+        "score": match.score,
+        "source": "rag",
+    }
+
+@single_flight("rag_query", key=lambda vector, top_k, namespace=None: (tuple(vector), top_k, namespace))
+def query_rag_index(vector, top_k: int, namespace=None):
+    """Query the RAG index (identical concurrent queries share one request)."""
+    return clients.pinecone_index(RAG_INDEX).query(
+        vector=vector,
+        top_k=top_k,
+        include_metadata=True,
+        namespace=namespace
+    )
+
+def _knowledge(vector, top_k, coords):
+    # The area shard prefetched on /location only holds the restaurants closest to one area
+    # query: merge its matches with the global ones, and fall back to it if Pinecone fails
+    local_records = prefetch_helper.local_shard_matches(coords, vector, top_k) or []
+    try:
+        records = [match_to_record(match) for match in query_rag_index(vector, top_k).matches]
+    except Exception as e:
+        if not local_records:
+            raise
+        metrics_helper.incr("prefetch.rag_shard.fallback")
+        print(f"⚠️ RAG query failed ({e}), answering from the prefetched area shard")
+        return local_records
+    seen = {record["id"] for record in records}
+    records += [record for record in local_records if record["id"] not in seen]
+    records.sort(key=lambda record: -(record.get("score") or 0.0))
+    return records[:top_k]
+
+def _snippets(vector, top_k, coords):
+    results = query_rag_index(vector, top_k, SNIPPET_NAMESPACE)
+    return [
+        {"id": match.id, "text": match.metadata["text"], "score": match.score}
+        for match in results.matches if match.metadata and match.metadata.get("text")
+    ]
+
+def _conversations(vector, top_k, coords):
+    results, _ = conversation_index.search(vector, limit=top_k)
+    return [record for record in results if record["score"] >= MEMORY_MIN_SCORE]
+
+RETRIEVERS = {
+    "knowledge": _knowledge,
+    "restaurants": _snippets,
+    "conversations": _conversations,
+}
+
+# ---------------------- Retrieval ----------------------
+class Retrieval:
+    def __init__(self, vector, results: dict, timings: dict, errors: dict):
+        self.vector = vector
+        self.results = results    # source -> records, best first
+        self.timings = timings    # "embed", each source and "total", in ms
+        self.errors = errors      # source -> error message
+
+    def merged(self) -> list:
+        """Every result, tagged with its `retriever`, best score first."""
+        records = [dict(record, retriever=source) for source, found in self.results.items() for record in found]
+        return sorted(records, key=lambda record: -(record.get("score") or 0.0))
+
+    def to_dict(self) -> dict:
+        return {"results": self.merged(), "timings_ms": self.timings, "errors": self.errors}
+
+def _timed(source, vector, top_k, coords):
+    started = time.perf_counter()
+    records = RETRIEVERS[source](vector, top_k, coords)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    metrics_helper.observe(f"retrieval.{source}_ms", elapsed_ms)
+    return records, elapsed_ms
+
+def retrieve(query: str, coords=None, sources=SOURCES, top_k: dict = None, vector=None) -> Retrieval:
+    """Embed `query` once (unless `vector`, a vector or an embed_in_background Future, is given)
+    and query `sources` concurrently."""
+    started = time.perf_counter()
+    top_k = {**DEFAULT_TOP_K, **(top_k or {})}
+    try:
+        if vector is None:
+            vector = embed_query(query)
+        elif isinstance(vector, Future):
+            vector = vector.result()  # from embed_in_background
+    except Exception as e:
+        print(f"❌ Query embedding failed: {e}")
+        metrics_helper.incr("retrieval.embedding.errors")
+        return Retrieval(None, {source: [] for source in sources}, {}, {"embed": str(e)})
+    timings = {"embed": (time.perf_counter() - started) * 1000}
+
+    futures = {source: _submit(_timed, source, vector, top_k[source], coords) for source in sources}
+    results, errors = {}, {}
+    for source, future in futures.items():
+        try:
+            results[source], timings[source] = future.result()
+        except Exception as e:
+            print(f"❌ Retrieval from {source} failed: {e}")
+            metrics_helper.incr(f"retrieval.{source}.errors")
+            results[source], errors[source] = [], str(e)
+    timings["total"] = (time.perf_counter() - started) * 1000
+    metrics_helper.observe("retrieval.total_ms", timings["total"])
+
+    summary = ", ".join(f"{source} {len(results[source])} in {timings.get(source, 0):.0f}ms" for source in sources)
+    print(f"🔎 Retrieved {summary} (embedding {timings['embed']:.0f}ms)")
+    return Retrieval(vector, results, {name: round(ms, 1) for name, ms in timings.items()}, errors)
@@ -0,0 +1,116 @@
+"""
+Server-side chat sessions.
+
+Clients send only the new turn plus a session ID; the server keeps a compact history
+per session: the last few messages verbatim and a rolling summary of everything older.
+Older messages are folded into the summary incrementally in the background, so the
+work per turn stays constant however long the conversation gets.
+
+Session IDs are always issued by the server. A session that expired (or lives on another
+worker) is not silently recreated under the client's ID: the caller is told, so the client
+can send its history again to seed a new session.
+"""
+
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import model_router
+from cache_helper import TTLCache
+
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+RECENT_MESSAGES = int(os.getenv("SESSION_RECENT_MESSAGES", "6"))  # kept verbatim
+
+_sessions = TTLCache(SESSION_TTL_SECONDS, MAX_SESSIONS)
+_summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="session-summary")
+
+class ChatSession:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.summary = ""          # rolling summary of messages no longer kept verbatim
+        self.messages = []         # recent {"role", "content"} dicts
+        self.turns = 0
+        self.dishes = []           # dishes asked about, stored with the saved conversation
+        self.folding = False
+        self.lock = threading.Lock()
+
+    def history(self) -> list:
+        """Compact history: the rolling summary (if any) followed by the recent messages."""
+        with self.lock:
+            history = list(self.messages)
+            if self.summary:
+                history.insert(0, {"role": "system", "content": f"Tóm tắt phần trước của cuộc hội thoại: {self.summary}"})
+            return history
+
+    def append(self, user_text: str, answer: str):
+        """Add one exchange and fold the overflow into the summary in the background."""
+        with self.lock:
+            self.messages.append({"role": "user", "content": user_text})
+            self.messages.append({"role": "assistant", "content": answer})
+            self.turns += 1
+            overflow = len(self.messages) > RECENT_MESSAGES and not self.folding
+            if overflow:
+                self.folding = True
+        if overflow:
+            _summarizer.submit(self._fold)
+
+    def _fold(self):
+        with self.lock:
+            count = len(self.messages) - RECENT_MESSAGES
+            old_messages = self.messages[:count]
+            summary = self.summary
+        try:
+            new_summary = summarize_incrementally(summary, old_messages)
+            with self.lock:
+                self.summary = new_summary
+                # Messages appended meanwhile are after the folded ones, so slicing is safe
+                del self.messages[:count]
+        except Exception as e:
+            print(f"⚠️ Session {self.id}: could not fold history into summary: {e}")
+        finally:
+            with self.lock:
+                self.folding = False
+
+def summarize_incrementally(summary: str, messages: list) -> str:
+    """Extend an existing conversation summary with a few more messages."""
+    new_text = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    prompt = f"""Update the conversation summary with the new messages. Keep it short (2-3 sentences),
+    keeping: dishes mentioned, locations, budget/preferences and any restaurants recommended.
+
+    Current summary:
+    {summary or "(empty)"}
+
+    New messages:
+    {new_text}
+
+    Updated summary:"""
+    response = model_router.complete(
+        "summarization",
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.3
+    )
+    return response.choices[0].message.content.strip()
+
+def find_session(session_id: str):
+    """The live session `session_id` (its TTL refreshed), or None when unknown or expired."""
+    session = _sessions.get(session_id) if session_id else None
+    if session is not None:
+        _sessions.set(session_id, session)  # refresh TTL
+    return session
+
+def new_session(seed_history: list = None) -> ChatSession:
+    """A new session under a server-issued ID, optionally seeded with the client's history."""
+    session = ChatSession(uuid.uuid4().hex)
+    if seed_history:
+        session.messages = [{"role": msg["role"], "content": msg["content"]} for msg in seed_history]
+        session.turns = sum(1 for msg in seed_history if msg["role"] == "user")
+    _sessions.set(session.id, session)
+    return session
+
+def drop_session(session_id: str):
+    _sessions.pop(session_id)
+
+def active_sessions() -> int:
+    return len(_sessions)
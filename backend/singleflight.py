@@ -0,0 +1,67 @@
+"""
+Single-flight request coalescing for upstream calls.
+
+While a call of a @single_flight function is in progress, identical concurrent calls
+(same name and arguments) wait for it and get its result instead of issuing their
+own upstream request. Nothing is cached once the call completes.
+"""
+
+import functools
+import threading
+from concurrent.futures import Future
+
+import metrics_helper
+from batch_helper import make_key
+
+_lock = threading.Lock()
+_inflight = {}
+_names = set()
+
+def do(name, fn, args=(), kwargs=None, key=None):
+    """Run fn(*args, **kwargs), sharing the call with identical in-flight ones."""
+    kwargs = kwargs or {}
+    key = key if key is not None else make_key(name, args, kwargs)
+    with _lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    metrics_helper.incr(f"singleflight.{name}.calls")
+    if not leader:
+        metrics_helper.incr(f"singleflight.{name}.coalesced")
+        return future.result()
+
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+    return future.result()
+
+def single_flight(name, key=None):
+    """Decorator form of do(). `key(*args, **kwargs)` may override the coalescing key."""
+    _names.add(name)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            call_key = (name, key(*args, **kwargs)) if key else None
+            return do(name, fn, args, kwargs, key=call_key)
+        return wrapper
+    return decorator
+
+def stats() -> dict:
+    """Calls, coalesced calls and coalescing ratio per single-flight function."""
+    result = {}
+    counters = metrics_helper.snapshot()["counters"]
+    for name in sorted(_names):
+        calls = f"singleflight.{name}.calls"
+        coalesced = f"singleflight.{name}.coalesced"
+        result[name] = {
+            "calls": int(counters.get(calls, 0)),
+            "coalesced": int(counters.get(coalesced, 0)),
+            "coalescing_ratio": metrics_helper.ratio(coalesced, calls),
+        }
+    return result
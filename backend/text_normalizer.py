@@ -0,0 +1,180 @@
+"""
+Canonical form of Vietnamese text, so that equivalent queries share caches and index keys.
+
+canonical() turns "Q1 có quán BÚN BÒ HẾ nào ngon ko??" and "quận 1 có quán bún bò huế nào ngon
+không?" into the same string:
+- Unicode NFC (NFD input from macOS / iOS keyboards is recomposed)
+- old-style tone placement in open syllables ("hoà" → "hòa", "khoẻ" → "khỏe", "thuỷ" → "thủy")
+- whitespace collapsed, trailing "?!." dropped, repeated punctuation and stretched letters
+  shortened ("ngonnn" → "ngon")
+- lowercase
+- abbreviations and teencode expanded ("ko"/"k"/"hok" → "không", "dc" → "được", "Q1" → "quận 1",
+  "tp.hcm" → "thành phố hồ chí minh", "cf" → "cà phê")
+- common dish names restored with their diacritics and typos fixed ("bun bo hue" / "bún bò hế" →
+  "bún bò huế")
+- optionally, diacritics folded away (fold_diacritics=True)
+
+Text typed without accents keeps most of its words unaccented ("q.1 co quan bun bo hue nao ngon k?"
+gives "quận 1 co quan bún bò huế nao ngon không"), so caches key on cache_key(), the canonical form
+with diacritics folded, which it shares with the accented question.
+
+All tables are compiled once at import; a query takes a few tens of microseconds.
+recompose() is the cheap, case- and wording-preserving part (NFC and tone placement only), applied
+to the restaurant text that gets embedded.
+
+Every normalized query is counted in GET /metrics: `normalize.repeat.raw` counts queries seen
+before verbatim, `normalize.repeat.canonical` those seen before in cache_key() form. The difference
+is the cache hit rate gained (NORMALIZE_WINDOW_SECONDS, default 3600, of history).
+"""
+
+import os
+import re
+import unicodedata
+
+import metrics_helper
+from cache_helper import TTLCache
+
+# ---------------------- Tables ----------------------
+# One character in, one character out: folded text stays aligned with the original
+_FOLD_TABLE = {}
+for _base, _variants in {
+    "a": "àáảãạăằắẳẵặâầấẩẫậ", "e": "èéẻẽẹêềếểễệ", "i": "ìíỉĩị", "o": "òóỏõọôồốổỗộơờớởỡợ",
+    "u": "ùúủũụưừứửữự", "y": "ỳýỷỹỵ", "d": "đ",
+}.items():
+    for _char in _variants:
+        _FOLD_TABLE[ord(_char)] = _base
+        _FOLD_TABLE[ord(_char.upper())] = _base.upper()
+
+# "oà/oè/uỳ" at the end of a syllable carry the tone on the first vowel ("hòa", "thủy");
+# "qu" is a consonant, so "quý" / "quà" keep theirs (checked in _move_tone)
+_TONE_PLACEMENT_RE = re.compile(r"[oO][àáảãạèéẻẽẹÀÁẢÃẠÈÉẺẼẸ]|[uU][ỳýỷỹỵỲÝỶỸỴ]")
+
+# Whole-word abbreviations and teencode (matched on lowercase text)
+ABBREVIATIONS = {
+    "ko": "không", "k": "không", "kh": "không", "khg": "không", "hok": "không", "hông": "không",
+    "hem": "không", "dc": "được", "đc": "được", "dk": "được", "đk": "được",
+    "j": "gì", "z": "vậy", "dz": "vậy", "ntn": "như thế nào", "bn": "bao nhiêu", "bnhiu": "bao nhiêu",
+    "mn": "mọi người", "mng": "mọi người", "mik": "mình", "mk": "mình", "mh": "mình",
+    "r": "rồi", "trc": "trước", "wa": "quá", "wá": "quá", "vs": "với", "lm": "làm",
+    "bít": "biết", "bik": "biết", "thik": "thích", "iu": "yêu",
+    "cf": "cà phê", "cafe": "cà phê", "caphe": "cà phê",
+    "tp.hcm": "thành phố hồ chí minh", "tp hcm": "thành phố hồ chí minh", "tphcm": "thành phố hồ chí minh",
+    "hcm": "hồ chí minh", "sg": "sài gòn", "hn": "hà nội", "tp": "thành phố",
+}
+_ABBREVIATION_RE = re.compile(
+    r"(?<!\w)(" + "|".join(sorted(map(re.escape, ABBREVIATIONS), key=len, reverse=True)) + r")(?!\w)"
+)
+# "q1", "Q.3", "quan 7", "p.12" -> "quận 1", "phường 12"
+_NUMBERED_RE = re.compile(r"(?<!\w)(q|quan|p|phuong)\.?\s*(\d{1,2})(?!\w)")
+_NUMBERED = {"q": "quận", "quan": "quận", "p": "phường", "phuong": "phường"}
+
+# Dish names (two syllables or more, so their unaccented form is unambiguous), restored in
+# text typed without diacritics; DISH_TYPOS are fixed whatever the accents ("bún bò hế")
+DISHES = (
+    "phở bò", "phở gà", "bún bò huế", "bún bò", "bún chả", "bún riêu", "bún đậu mắm tôm", "bún đậu",
+    "bún thịt nướng", "bún mắm", "bánh mì", "bánh xèo", "bánh cuốn", "bánh canh", "bánh bèo",
+    "bánh khọt", "bánh tráng trộn", "bánh tráng nướng", "cơm tấm", "cơm gà", "cơm chiên", "cơm niêu",
+    "hủ tiếu", "mì quảng", "cao lầu", "cà phê", "cà phê sữa đá", "trà sữa", "bò kho", "bò bía",
+    "gỏi cuốn", "chả giò", "hải sản", "nem nướng", "cháo lòng", "bột chiên", "sinh tố", "lẩu thái",
+    "lẩu mắm", "gà nướng", "vịt quay",
+)
+DISH_TYPOS = {
+    "bun bo he": "bún bò huế", "bun bo hu": "bún bò huế", "hu tiu": "hủ tiếu", "banh my": "bánh mì",
+    "ca fe": "cà phê", "ca fe sua da": "cà phê sữa đá",
+}
+_STRETCHED_RE = re.compile(r"([^\W\d_])\1{2,}")
+_REPEATED_PUNCTUATION_RE = re.compile(r"([!?.,])\1+")
+
+def fold(text: str) -> str:
+    """Text without Vietnamese diacritics (same length and case as the input NFC text)."""
+    return text.translate(_FOLD_TABLE)
+
+def _move_tone(match) -> str:
+    text, start, end = match.string, match.start(), match.end()
+    if (start and text[start - 1] in "qQ") or (end < len(text) and text[end].isalpha()):
+        return match.group(0)  # "quý", or a closed syllable ("hoạch")
+    first, second = match.group(0)
+    decomposed = unicodedata.normalize("NFD", second)
+    return unicodedata.normalize("NFC", first + decomposed[1:]) + decomposed[0]
+
+def _dish_table():
+    table = {fold(dish): dish for dish in DISHES}
+    table.update(DISH_TYPOS)
+    pattern = re.compile(r"(?<!\w)(" + "|".join(sorted(map(re.escape, table), key=len, reverse=True)) + r")(?!\w)")
+    return table, pattern
+
+_DISHES, _DISH_RE = _dish_table()
+
+def _restore_dishes(text: str) -> str:
+    folded = fold(text)
+    pieces, last = [], 0
+    for match in _DISH_RE.finditer(folded):
+        span = match.group(1)
+        if span not in DISH_TYPOS and text[match.start():match.end()] != span:
+            continue  # already accented: "lâu dễ" is not "lẩu dê"
+        pieces.append(text[last:match.start()])
+        pieces.append(_DISHES[match.group(1)])
+        last = match.end()
+    pieces.append(text[last:])
+    return "".join(pieces)
+
+def _expand_abbreviation(match) -> str:
+    token = match.group(1)
+    # "50 k" is a price, not "không"
+    if token == "k" and match.string[:match.start()].rstrip()[-1:].isdigit():
+        return token
+    return ABBREVIATIONS[token]
+
+def recompose(text: str) -> str:
+    """NFC and old-style tone placement only; ASCII text is returned as is."""
+    if not text or text.isascii():
+        return text
+    if not unicodedata.is_normalized("NFC", text):
+        text = unicodedata.normalize("NFC", text)
+    return _TONE_PLACEMENT_RE.sub(_move_tone, text)
+
+def canonical(text: str, fold_diacritics: bool = False, lowercase: bool = True, expand: bool = True) -> str:
+    """Canonical form of `text` (see the module docstring).
+    With lowercase=False and expand=False only the Unicode form, tone placement and whitespace change."""
+    if not text:
+        return text or ""
+    text = " ".join(recompose(text).split())
+    if lowercase:
+        text = text.lower()
+    if expand:
+        text = _REPEATED_PUNCTUATION_RE.sub(r"\1", _STRETCHED_RE.sub(r"\1", text))
+        text = _NUMBERED_RE.sub(lambda m: f"{_NUMBERED[m.group(1)]} {m.group(2)}", text)
+        text = _ABBREVIATION_RE.sub(_expand_abbreviation, text)
+        text = _restore_dishes(text).rstrip(" ?!.")
+    return fold(text) if fold_diacritics else text
+
+def cache_key(text: str) -> str:
+    """Diacritic-insensitive key for the query caches (embedding, extraction, places, geocoding)."""
+    return canonical(text, fold_diacritics=True)
+
+# ---------------------- Measurement ----------------------
+_seen_raw = TTLCache(float(os.getenv("NORMALIZE_WINDOW_SECONDS", "3600")), 20000)
+_seen_canonical = TTLCache(float(os.getenv("NORMALIZE_WINDOW_SECONDS", "3600")), 20000)
+
+def normalize_query(text: str) -> str:
+    """canonical() for a user query, counting how often it (or its canonical form) repeats."""
+    result = canonical(text)
+    metrics_helper.incr("normalize.queries")
+    if result != text:
+        metrics_helper.incr("normalize.changed")
+    if text in _seen_raw:
+        metrics_helper.incr("normalize.repeat.raw")
+    key = fold(result)
+    if key in _seen_canonical:
+        metrics_helper.incr("normalize.repeat.canonical")
+    _seen_raw.set(text, True)
+    _seen_canonical.set(key, True)
+    return result
+
+def stats() -> dict:
+    """Share of queries changed by normalization and repeat (cache-hit) rates without and with it."""
+    return {
+        "changed_rate": metrics_helper.ratio("normalize.changed", "normalize.queries"),
+        "raw_repeat_rate": metrics_helper.ratio("normalize.repeat.raw", "normalize.queries"),
+        "canonical_repeat_rate": metrics_helper.ratio("normalize.repeat.canonical", "normalize.queries"),
+    }
@@ -0,0 +1,292 @@
+"""
+Materialized trend views over the conversation history.
+
+Each answered chat turn appends one small event (dish, district, recommended restaurants,
+time) to a local log. A periodic job folds only the new events into running aggregates and
+writes a compact view:
+- top dishes per district
+- popular restaurants (most often recommended)
+- activity and top dishes per time of day
+
+The chat path only reads the latest view (`trend_context`), so no LLM synthesis is needed
+to give answers a sense of what other users are asking for.
+
+    python trend_views.py            # fold new events once
+    python trend_views.py --watch    # keep folding every TRENDS_REFRESH_SECONDS
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import gazetteer
+import text_normalizer
+from fusion_helper import fold
+
+DATA_DIR = os.getenv(
+    "TRENDS_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+)
+EVENTS_PATH = os.path.join(DATA_DIR, 'conversation_events.jsonl')
+STATE_PATH = os.path.join(DATA_DIR, 'trend_state.json')
+VIEW_PATH = os.path.join(DATA_DIR, 'trend_view.json')
+LOCK_PATH = os.path.join(DATA_DIR, 'trends.lock')
+JOB_LOCK_PATH = os.path.join(DATA_DIR, 'trends_job.lock')
+
+REFRESH_SECONDS = float(os.getenv("TRENDS_REFRESH_SECONDS", "300"))
+MAX_KEYS = 500   # entries kept per counter in the running state
+TOP_N = 5        # entries per list in the compact view
+
+# Parts of the day, by local hour
+PERIODS = (
+    ("sáng", range(5, 10)),
+    ("trưa", range(10, 14)),
+    ("chiều", range(14, 17)),
+    ("tối", range(17, 22)),
+    ("khuya", (22, 23, 0, 1, 2, 3, 4)),
+)
+
+_LAT_LON_RE = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+_DISTRICT_RE = re.compile(r'\b(quận|quan|district|huyện|huyen|q\.?\s*\d+|thành phố thủ đức|tp\.? thủ đức|thu duc)', re.IGNORECASE)
+
+_view = None
+_view_mtime = None
+_view_lock = threading.Lock()
+
+@contextmanager
+def _locked(path=None, blocking=True):
+    """Exclusive file lock shared by the API workers and the aggregation job.
+    Yields False when `blocking` is off and the lock is held elsewhere."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(path or LOCK_PATH, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def period_of(hour: int) -> str:
+    for name, hours in PERIODS:
+        if hour in hours:
+            return name
+    return "khuya"
+
+def district_of(location_text: str) -> str:
+    """Canonical district of a location text ("Lê Lợi, Quận 1, Hồ Chí Minh" and "q1" -> "Quận 1").
+    A "lat,lon" location resolves to the nearest known district, or "" when there is none."""
+    coordinates = _LAT_LON_RE.match(location_text or "")
+    if coordinates:
+        place = gazetteer.nearest(float(coordinates.group(1)), float(coordinates.group(2)))
+        return place["name"] if place else ""
+    parts = [part.strip() for part in (location_text or "").split(",") if part.strip()]
+    for part in parts:
+        place = gazetteer.lookup(part)
+        if place is not None and place["kind"] == "district":
+            return place["name"]
+    district = next((part for part in parts if _DISTRICT_RE.search(part)), None)
+    if district is None:
+        # The frontend sends "road, suburb, city": the suburb is the district-level part
+        district = parts[1] if len(parts) == 3 else (parts[0] if parts else "")
+    return text_normalizer.canonical(district).title()
+
+# ---------------------- Recording (chat path) ----------------------
+def record_turn(location_text: str, facts: dict):
+    """Append one answered chat turn to the event log (cheap, no LLM call)."""
+    event = {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "dish": facts.get("food") or "",
+        "district": district_of(facts.get("place") or location_text),
+        "restaurants": facts.get("restaurants", []),
+    }
+    try:
+        with _locked(), open(EVENTS_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"⚠️ Could not record conversation event: {e}")
+
+# ---------------------- Aggregation (offline job) ----------------------
+def _empty_state() -> dict:
+    return {
+        "events": 0,
+        "names": {},                # folded key -> display name
+        "dishes": {},
+        "district_dishes": {},      # district key -> {dish key: count}
+        "restaurants": {},
+        "hours": [0] * 24,
+        "period_dishes": {},        # period -> {dish key: count}
+        "updated_at": None,
+    }
+
+def load_state(path=STATE_PATH) -> dict:
+    if not os.path.exists(path):
+        return _empty_state()
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _bump(counter: dict, key: str, by: int = 1):
+    counter[key] = counter.get(key, 0) + by
+
+def _prune(counter: dict) -> dict:
+    if len(counter) <= MAX_KEYS:
+        return counter
+    return dict(Counter(counter).most_common(MAX_KEYS))
+
+def fold_event(state: dict, event: dict):
+    """Add one event to the running aggregates."""
+    names = state["names"]
+    state["events"] += 1
+    hour = datetime.fromisoformat(event["ts"]).hour
+    state["hours"][hour] += 1
+
+    dish_key = fold(event.get("dish"))
+    district_key = fold(event.get("district"))
+    if dish_key:
+        names.setdefault(dish_key, event["dish"])
+        _bump(state["dishes"], dish_key)
+        _bump(state["period_dishes"].setdefault(period_of(hour), {}), dish_key)
+        if district_key:
+            names.setdefault(district_key, event["district"])
+            _bump(state["district_dishes"].setdefault(district_key, {}), dish_key)
+    for restaurant in event.get("restaurants", []):
+        restaurant_key = fold(restaurant)
+        if restaurant_key:
+            names.setdefault(restaurant_key, restaurant)
+            _bump(state["restaurants"], restaurant_key)
+
+def build_view(state: dict) -> dict:
+    """Compact view read by the chat path: display names and counts, top entries only."""
+    names = state["names"]
+
+    def top(counter, n=TOP_N):
+        return [[names.get(key, key), count] for key, count in Counter(counter).most_common(n)]
+
+    return {
+        "generated_at": state["updated_at"],
+        "events": state["events"],
+        "top_dishes": top(state["dishes"], 10),
+        "popular_restaurants": top(state["restaurants"], 10),
+        "districts": {
+            key: {"name": names.get(key, key), "top_dishes": top(dishes)}
+            for key, dishes in state["district_dishes"].items()
+        },
+        "hours": state["hours"],
+        "periods": {period: top(dishes) for period, dishes in state["period_dishes"].items()},
+    }
+
+def refresh() -> int:
+    """Fold events logged since the last run into the state and rewrite the view.
+    Returns the number of new events (0 if another process is already refreshing)."""
+    with _locked(JOB_LOCK_PATH, blocking=False) as acquired:
+        return _refresh() if acquired else 0
+
+def _refresh() -> int:
+    processing_path = f"{EVENTS_PATH}.processing"
+    with _locked():
+        # Leftover from an interrupted run is processed first
+        if not os.path.exists(processing_path):
+            if not os.path.exists(EVENTS_PATH):
+                return 0
+            os.replace(EVENTS_PATH, processing_path)
+
+    state = load_state()
+    new_events = 0
+    with open(processing_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                fold_event(state, json.loads(line))
+                new_events += 1
+            except (ValueError, KeyError) as e:
+                print(f"⚠️ Skipping malformed conversation event: {e}")
+
+    for key in ("dishes", "restaurants"):
+        state[key] = _prune(state[key])
+    for key in ("district_dishes", "period_dishes"):
+        state[key] = {group: _prune(counter) for group, counter in state[key].items()}
+    state["updated_at"] = datetime.now().isoformat(timespec="seconds")
+
+    _write_json(STATE_PATH, state)
+    _write_json(VIEW_PATH, build_view(state))
+    os.remove(processing_path)
+    print(f"📈 Trend views updated with {new_events} new events (total {state['events']})")
+    return new_events
+
+def start_background_refresh(interval: float = REFRESH_SECONDS):
+    """Refresh the views periodically in a daemon thread (for single-process deployments)."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh()
+            except Exception as e:
+                print(f"⚠️ Trend view refresh failed: {e}")
+
+    if interval > 0:
+        threading.Thread(target=loop, name="trend-views", daemon=True).start()
+
+# ---------------------- Reading (chat path) ----------------------
+def load_view():
+    """Latest compact view, re-read only when the job has rewritten it."""
+    global _view, _view_mtime
+    try:
+        mtime = os.path.getmtime(VIEW_PATH)
+    except OSError:
+        return None
+    with _view_lock:
+        if mtime != _view_mtime:
+            with open(VIEW_PATH, 'r', encoding='utf-8') as f:
+                _view = json.load(f)
+            _view_mtime = mtime
+        return _view
+
+def _format_counts(entries) -> str:
+    return ", ".join(f"{name} ({count})" for name, count in entries)
+
+def trend_context(location_text: str, now: datetime = None) -> str:
+    """A few lines of trends relevant to this location and time, for the prompt."""
+    view = load_view()
+    if not view or not view["events"]:
+        return ""
+    now = now or datetime.now()
+    lines = [f"Xu hướng từ {view['events']} lượt hỏi trước:"]
+
+    district = view["districts"].get(fold(district_of(location_text)))
+    if district and district["top_dishes"]:
+        lines.append(f"- Món được hỏi nhiều ở {district['name']}: {_format_counts(district['top_dishes'])}")
+    elif view["top_dishes"]:
+        lines.append(f"- Món được hỏi nhiều nhất: {_format_counts(view['top_dishes'][:TOP_N])}")
+
+    period = period_of(now.hour)
+    if view["periods"].get(period):
+        lines.append(f"- Món được hỏi nhiều vào buổi {period}: {_format_counts(view['periods'][period])}")
+    if view["popular_restaurants"]:
+        lines.append(f"- Nhà hàng được gợi ý nhiều: {_format_counts(view['popular_restaurants'][:TOP_N])}")
+    return "\n".join(lines) if len(lines) > 1 else ""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fold new conversation events into the trend views")
+    parser.add_argument('--watch', action='store_true', help="keep refreshing every TRENDS_REFRESH_SECONDS")
+    args = parser.parse_args(argv)
+    refresh()
+    while args.watch:
+        time.sleep(REFRESH_SECONDS)
+        refresh()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Record / replay of outbound HTTP calls (Azure OpenAI, Pinecone, Nominatim, Foursquare,
+ElevenLabs) for deterministic performance runs.
+
+Calls are intercepted at the transport level, so every client is covered without changing
+call sites: httpx (OpenAI, ElevenLabs) and urllib3 (requests, Pinecone).
+
+    UPSTREAM_CASSETTE_MODE=record  UPSTREAM_CASSETTE=cassettes/prod-mix.jsonl.gz
+    UPSTREAM_CASSETTE_MODE=replay  UPSTREAM_CASSETTE=cassettes/prod-mix.jsonl.gz
+    UPSTREAM_REPLAY_LATENCY=original|zero   (replay: sleep the recorded duration, or not at all)
+
+A cassette is gzipped JSONL, one entry per call: method, URL, a hash of the request body,
+status, content type, response body and duration, plus the gen_answer stage that made the
+call. Credentials are never written (auth headers and `api-key`-style query parameters are
+dropped). On replay, calls are matched on method + URL + body hash, in recorded order;
+a call with an unknown body falls back to the next recording of the same method + URL.
+Unmatched calls fail instead of reaching the network.
+"""
+
+import atexit
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import metrics_helper
+
+SECRET_PARAMS = {"api-key", "api_key", "key", "token", "access_token"}
+TEXT_TYPES = ("json", "text", "xml", "javascript")
+
+class CassetteMiss(ConnectionError):
+    """A replayed call has no recording."""
+
+def _normalize_url(url: str) -> str:
+    parts = urlsplit(str(url))
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in SECRET_PARAMS)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}" + (f"?{urlencode(query)}" if query else "")
+
+def _body_hash(body) -> str:
+    if body is None:
+        return ""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if not isinstance(body, (bytes, bytearray)):
+        return "stream"  # file-like / generator bodies are not hashed
+    try:
+        # JSON bodies hash the same regardless of key order
+        body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return hashlib.sha1(body).hexdigest()[:16]
+
+def _current_stage() -> str:
+    try:
+        from profiling_helper import _stages
+    except ImportError:
+        return ""
+    stages = _stages.get(threading.get_ident())
+    return "/".join(stages) if stages else ""
+
+class Cassette:
+    def __init__(self, path: str, mode: str, latency: str = "original"):
+        self.path = path
+        self.mode = mode
+        self.zero_latency = latency == "zero"
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.by_key = defaultdict(deque)
+        self.by_url = defaultdict(deque)
+        self.file = None
+        if mode == "record":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            opener = gzip.open if path.endswith(".gz") else open
+            self.file = opener(path, "at", encoding="utf-8")
+            atexit.register(self.close)  # a gzip member is only readable once closed
+        else:
+            self._load()
+
+    def _load(self):
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "rt", encoding="utf-8") as f:
+            try:
+                lines = list(f)
+            except EOFError:
+                lines = []  # a recording process that was killed leaves no gzip trailer
+                print(f"⚠️ Cassette {self.path} is truncated, re-record it")
+            for line in lines:
+                entry = json.loads(line)
+                self.by_key[(entry["method"], entry["url"], entry["body_hash"])].append(entry)
+                self.by_url[(entry["method"], entry["url"])].append(entry)
+        print(f"📼 Replaying {sum(len(q) for q in self.by_key.values())} recorded upstream calls from {self.path}")
+
+    def record(self, method, url, body, status, headers, content: bytes, elapsed_ms: float):
+        content_type = headers.get("content-type", "")
+        if any(kind in content_type for kind in TEXT_TYPES):
+            encoded, encoding = content.decode("utf-8", errors="replace"), "text"
+        else:
+            encoded, encoding = base64.b64encode(content).decode("ascii"), "base64"
+        entry = {
+            "t": round(time.monotonic() - self.started, 3),
+            "method": method.upper(),
+            "url": _normalize_url(url),
+            "body_hash": _body_hash(body),
+            "stage": _current_stage(),
+            "status": status,
+            "content_type": content_type,
+            "encoding": encoding,
+            "body": encoded,
+            "elapsed_ms": round(elapsed_ms, 1),
+        }
+        with self.lock:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+        metrics_helper.incr("cassette.recorded")
+
+    def replay(self, method, url, body) -> dict:
+        method, url = method.upper(), _normalize_url(url)
+        with self.lock:
+            queue = self.by_key.get((method, url, _body_hash(body)))
+            fuzzy = not queue
+            if fuzzy:
+                queue = self.by_url.get((method, url))
+            if not queue:
+                metrics_helper.incr("cassette.misses")
+                raise CassetteMiss(f"No recording for {method} {url}")
+            # Keep the last recording around for calls repeated more often than recorded
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+        metrics_helper.incr("cassette.replayed_fuzzy" if fuzzy else "cassette.replayed")
+        if not self.zero_latency:
+            time.sleep(entry["elapsed_ms"] / 1000)
+        return entry
+
+    def close(self):
+        if self.file is not None:
+            with self.lock:
+                self.file.close()
+                self.file = None
+
+def _entry_content(entry) -> bytes:
+    if entry["encoding"] == "text":
+        return entry["body"].encode("utf-8")
+    return base64.b64decode(entry["body"])
+
+# ---------------------- Transport hooks ----------------------
+def _patch_httpx(cassette: Cassette):
+    import httpx
+    original_send = httpx.Client.send
+
+    def send(self, request, *args, **kwargs):
+        if cassette.mode == "replay":
+            entry = cassette.replay(request.method, request.url, request.content)
+            return httpx.Response(
+                entry["status"],
+                headers={"content-type": entry["content_type"]},
+                content=_entry_content(entry),
+                request=request,
+            )
+        started = time.perf_counter()
+        response = original_send(self, request, *args, **kwargs)
+        content = response.read()
+        cassette.record(request.method, request.url, request.content, response.status_code,
+                        response.headers, content, (time.perf_counter() - started) * 1000)
+        return response
+
+    httpx.Client.send = send
+
+def _patch_urllib3(cassette: Cassette):
+    import urllib3
+    from urllib3.connectionpool import HTTPConnectionPool
+    original_urlopen = HTTPConnectionPool.urlopen
+
+    def urlopen(self, method, url, body=None, headers=None, *args, **kwargs):
+        full_url = url if url.startswith("http") else f"{self.scheme}://{self.host}:{self.port}{url}"
+        if cassette.mode == "replay":
+            entry = cassette.replay(method, full_url, body)
+            return urllib3.HTTPResponse(
+                body=io.BytesIO(_entry_content(entry)),
+                headers={"content-type": entry["content_type"]},
+                status=entry["status"],
+                preload_content=kwargs.get("preload_content", True),
+                decode_content=False,
+            )
+        started = time.perf_counter()
+        response = original_urlopen(self, method, url, body, headers, *args, **kwargs)
+        streaming = not kwargs.get("preload_content", True)
+        # requests streams without decoding; record the decoded body either way
+        content = response.read(decode_content=True) if streaming else response.data
+        cassette.record(method, full_url, body, response.status, response.headers, content,
+                        (time.perf_counter() - started) * 1000)
+        if streaming:
+            # ... and serve it again from a fresh, already decoded response
+            response.release_conn()
+            headers = {k: v for k, v in response.headers.items()
+                       if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+            return urllib3.HTTPResponse(
+                body=io.BytesIO(content),
+                headers=headers,
+                status=response.status,
+                preload_content=False,
+                decode_content=False,
+            )
+        return response
+
+    HTTPConnectionPool.urlopen = urlopen
+
+_cassette = None
+
+def install(path: str, mode: str, latency: str = "original") -> Cassette:
+    """Start recording to / replaying from `path` for every httpx and urllib3 call of this process."""
+    global _cassette
+    if _cassette is not None:
+        return _cassette
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown cassette mode '{mode}', expected record or replay")
+    _cassette = Cassette(path, mode, latency)
+    for patch in (_patch_httpx, _patch_urllib3):
+        try:
+            patch(_cassette)
+        except ImportError:
+            pass  # client library not installed, nothing to intercept
+    print(f"📼 Upstream cassette: {mode} {path}")
+    return _cassette
+
+def install_from_env():
+    """Install the cassette configured by UPSTREAM_CASSETTE_MODE / UPSTREAM_CASSETTE, if any."""
+    mode = (os.getenv("UPSTREAM_CASSETTE_MODE") or "off").lower()
+    if mode == "off":
+        return None
+    path = os.getenv("UPSTREAM_CASSETTE") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', 'cassettes', 'upstream.jsonl.gz'
+    )
+    return install(path, mode, os.getenv("UPSTREAM_REPLAY_LATENCY", "original").lower())
+
+def stats() -> dict:
+    if _cassette is None:
+        return {"mode": "off"}
+    counters = metrics_helper.snapshot()["counters"]
+    return {
+        "mode": _cassette.mode,
+        "path": _cassette.path,
+        **{name: int(counters.get(f"cassette.{name}", 0))
+           for name in ("recorded", "replayed", "replayed_fuzzy", "misses")},
+    }
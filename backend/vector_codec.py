@@ -0,0 +1,143 @@
+"""
+Embedding size and storage formats.
+
+text-embedding-3 models can return shortened embeddings (the `dimensions` parameter), which
+is the same as truncating the full vector and re-normalizing it. EMBEDDING_DIMENSIONS sets
+the size used everywhere (default 1536); changing it requires re-creating and re-ingesting
+the Pinecone indexes (and `conversation_index.py rebuild`).
+
+Local vector indexes store rows with one of these codecs:
+- float32: 4 bytes per dimension
+- int8:    1 byte per dimension plus a per-row scale (~4x smaller, scored about as fast as float32)
+- pq:      product quantization, `m` bytes per row (trained codebooks, used by the benchmark)
+"""
+
+import os
+
+import numpy as np
+
+FULL_DIMENSIONS = 1536  # text-embedding-3-small
+_BLOCK_BYTES = 512 * 1024  # float32 block widened from int8 codes per product (stays in cache)
+
+def embedding_dimensions() -> int:
+    """Configured embedding size (read at call time, after .env has been loaded)."""
+    return int(os.getenv("EMBEDDING_DIMENSIONS") or FULL_DIMENSIONS)
+
+def embedding_params() -> dict:
+    """Extra embeddings.create() arguments for the configured size."""
+    dims = embedding_dimensions()
+    return {} if dims == FULL_DIMENSIONS else {"dimensions": dims}
+
+def normalize(matrix) -> np.ndarray:
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+def shorten(matrix, dims: int) -> np.ndarray:
+    """Truncate embeddings to `dims` and re-normalize (what the API does for `dimensions`)."""
+    return normalize(np.atleast_2d(np.asarray(matrix, dtype=np.float32))[:, :dims])
+
+class Float32Codec:
+    name = "float32"
+
+    def row_dtype(self, dim: int) -> np.dtype:
+        return np.dtype([("v", np.float32, (dim,))])
+
+    def encode(self, matrix) -> np.ndarray:
+        matrix = normalize(matrix)
+        rows = np.empty(len(matrix), dtype=self.row_dtype(matrix.shape[1]))
+        rows["v"] = matrix
+        return rows
+
+    def scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return rows["v"] @ query
+
+class Int8Codec:
+    """Symmetric per-row int8 quantization: v ≈ codes * scale."""
+    name = "int8"
+
+    def row_dtype(self, dim: int) -> np.dtype:
+        return np.dtype([("v", np.int8, (dim,)), ("scale", np.float32)])
+
+    def encode(self, matrix) -> np.ndarray:
+        matrix = normalize(matrix)
+        scale = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127
+        rows = np.empty(len(matrix), dtype=self.row_dtype(matrix.shape[1]))
+        rows["v"] = np.clip(np.rint(matrix / scale[:, None]), -127, 127)
+        rows["scale"] = scale
+        return rows
+
+    def scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # Widen a cache-sized block at a time: casting the whole matrix first costs ~4x the product
+        codes = rows["v"]
+        block_rows = max(1, _BLOCK_BYTES // (4 * codes.shape[1]))
+        block = np.empty((min(block_rows, len(codes)), codes.shape[1]), dtype=np.float32)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block_rows):
+            chunk = codes[start:start + block_rows]
+            widened = block[:len(chunk)]
+            np.copyto(widened, chunk, casting='unsafe')
+            np.dot(widened, query, out=scores[start:start + len(chunk)])
+        return scores * rows["scale"]
+
+class PQCodec:
+    """Product quantization: `m` sub-vectors, each replaced by the nearest of up to 256 centroids.
+    Scoring uses per-query lookup tables (asymmetric distance computation)."""
+    name = "pq"
+
+    def __init__(self, codebooks: np.ndarray):
+        self.codebooks = codebooks  # (m, k, dim // m)
+
+    @classmethod
+    def train(cls, matrix, m: int, k: int = 256, iterations: int = 15, seed: int = 0) -> "PQCodec":
+        matrix = normalize(matrix)
+        n, dim = matrix.shape
+        if dim % m:
+            raise ValueError(f"dimension {dim} is not divisible by m={m}")
+        if n <= k:
+            # Every training vector would become its own centroid: recall would look perfect
+            raise ValueError(f"PQ with {k} centroids needs more than {k} training vectors, got {n}")
+        rng = np.random.default_rng(seed)
+        sub_dim = dim // m
+        codebooks = np.empty((m, k, sub_dim), dtype=np.float32)
+        for j in range(m):
+            data = matrix[:, j * sub_dim:(j + 1) * sub_dim]
+            centroids = data[rng.choice(n, k, replace=False)].copy()
+            for _ in range(iterations):
+                assign = cls._nearest(data, centroids)
+                for c in range(k):
+                    members = data[assign == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+            codebooks[j] = centroids
+        return cls(codebooks)
+
+    @staticmethod
+    def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (data ** 2).sum(1)[:, None] - 2 * data @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        return distances.argmin(axis=1)
+
+    def row_dtype(self, dim: int = None) -> np.dtype:
+        return np.dtype([("c", np.uint8, (len(self.codebooks),))])
+
+    def encode(self, matrix) -> np.ndarray:
+        matrix = normalize(matrix)
+        m, _, sub_dim = self.codebooks.shape
+        rows = np.empty(len(matrix), dtype=self.row_dtype())
+        for j in range(m):
+            rows["c"][:, j] = self._nearest(matrix[:, j * sub_dim:(j + 1) * sub_dim], self.codebooks[j])
+        return rows
+
+    def scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        m, _, sub_dim = self.codebooks.shape
+        # tables[j, c] = centroid c of sub-space j · query sub-vector j
+        tables = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(m, sub_dim))
+        codes = rows["c"]
+        return tables[np.arange(m), codes].sum(axis=1)
+
+CODECS = {"float32": Float32Codec, "int8": Int8Codec}
+
+def get_codec(name: str):
+    """Codec for an append-only local index (PQ needs trained codebooks, so it is not offered here)."""
+    if name not in CODECS:
+        raise ValueError(f"Unknown vector storage '{name}', expected one of {sorted(CODECS)}")
+    return CODECS[name]()
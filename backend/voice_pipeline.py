@@ -0,0 +1,370 @@
+"""
+Full-duplex voice conversations over one WebSocket (GET /voice, upgraded).
+
+Instead of three sequential HTTP requests (upload the clip to /speech-to-text, post the text
+to /chat, post the answer to /text-to-speech and wait for the whole MP3), the client streams
+microphone audio in and gets the answer back on the same connection:
+
+    client -> server
+        {"type": "start", "session_id": ..., "location": "lat,lon", "format": "webm" | "pcm16",
+         "sample_rate": 8000-48000, "audio_format": "opus" | "mp3" | ...}
+                                                   configure the connection (optional, resendable)
+        <binary frames>                            audio of the current utterance
+        {"type": "end"}                            utterance finished (push-to-talk release)
+        {"type": "text", "text": "..."}            a typed turn (skips speech-to-text)
+        {"type": "interrupt"}                      stop speaking the current answer (barge-in)
+
+    server -> client
+        {"type": "ready", "session_id": ..., "audio_format": ...}
+        {"type": "transcript", "text": ...}
+        {"type": "answer", "text": ..., "session_id": ..., "session_expired": bool}
+        {"type": "audio", "index": i, "text": sentence, "format": "mp3", "bytes": n} + <binary frame>
+        {"type": "turn_end", "latency_ms": {...}}
+        {"type": "error", "status": 429 | 503 | 400 | 500, "detail": ...}
+
+Transcription starts as soon as the utterance ends: on {"type": "end"}, or for raw 16-bit PCM
+when VOICE_END_SILENCE_MS (default 700) of silence follows speech (server-side endpointing).
+The answer is split into sentences that are synthesized VOICE_TTS_PARALLEL (default 2) at a
+time and sent in order, so the first sentence plays while the rest is still being synthesized.
+The client can keep streaming the next utterance while an answer is being spoken.
+Answer audio uses `audio_format` from the start message, or the format negotiated from the
+upgrade request's Accept and network-hint headers (see audio_formats.py).
+
+Each turn is admitted once, on the voice lane: the client's rate bucket is charged once per
+turn and a turn is never shed after its transcript was sent. The admission reserves the
+expected LLM tokens of the answer in the TPM budget, like /chat. On barge-in, speech-to-text,
+answer and sentence synthesis calls not started yet are skipped; the slot is held until the
+one already running returns.
+
+Per-phase latency (ms, from the end of the utterance) is sent with every turn_end and
+recorded as `voice.<phase>_ms` timings in GET /metrics: stt, chat, first_audio (turn-around
+until the first audio frame), tts and total; `speech` is the length of the utterance upload.
+"""
+
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from fastapi import HTTPException
+
+import audio_formats
+import metrics_helper
+from audio_formats import pcm_to_wav
+
+END_SILENCE_MS = float(os.getenv("VOICE_END_SILENCE_MS", "700"))
+VAD_THRESHOLD = float(os.getenv("VOICE_VAD_THRESHOLD", "500"))  # RMS of 16-bit samples
+TTS_PARALLEL = int(os.getenv("VOICE_TTS_PARALLEL", "2"))
+MAX_UTTERANCE_BYTES = int(os.getenv("VOICE_MAX_UTTERANCE_BYTES", str(10 * 1024 * 1024)))
+MIN_SENTENCE_CHARS = 20
+FRAME_MS = 20
+SAMPLE_RATES = (8000, 48000)  # accepted range of `sample_rate` for raw PCM
+
+# ---------------------- Audio ----------------------
+class Endpointer:
+    """Energy-based end-of-utterance detection on 16-bit PCM: speech, then END_SILENCE_MS of silence."""
+
+    def __init__(self, sample_rate: int, end_silence_ms: float = END_SILENCE_MS, threshold: float = VAD_THRESHOLD):
+        self.frame_bytes = int(sample_rate * FRAME_MS / 1000) * 2
+        self.end_silence_ms = end_silence_ms
+        self.threshold = threshold
+        self.pending = b""
+        self.heard_speech = False
+        self.silence_ms = 0.0
+
+    def feed(self, chunk: bytes) -> bool:
+        """Add audio; True once the utterance has ended."""
+        data = self.pending + chunk
+        usable = len(data) - len(data) % self.frame_bytes
+        self.pending = data[usable:]
+        if usable == 0:
+            return False
+        frames = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32).reshape(-1, self.frame_bytes // 2)
+        for rms in np.sqrt((frames ** 2).mean(axis=1)):
+            if rms >= self.threshold:
+                self.heard_speech = True
+                self.silence_ms = 0.0
+            elif self.heard_speech:
+                self.silence_ms += FRAME_MS
+                if self.silence_ms >= self.end_silence_ms:
+                    return True
+        return False
+
+# ---------------------- Text ----------------------
+_MARKDOWN_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_MARKDOWN_MARKS = re.compile(r"[*_`#>|]+")
+_LIST_MARKER = re.compile(r"^\s*(?:[-+•]|\d+[.)])\s+", re.MULTILINE)
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+def speech_text(markdown: str) -> str:
+    """Answer text without markdown syntax, so TTS doesn't read out symbols."""
+    text = _MARKDOWN_LINK.sub(r"\1", markdown)
+    text = _LIST_MARKER.sub("", text)
+    return _MARKDOWN_MARKS.sub("", text).strip()
+
+def split_sentences(text: str, min_chars: int = MIN_SENTENCE_CHARS) -> list:
+    """Sentences (and list items) to synthesize one by one; very short pieces join the next one."""
+    sentences, current = [], ""
+    for piece in _SENTENCE_END.split(text):
+        piece = piece.strip()
+        if not piece:
+            continue
+        current = f"{current} {piece}".strip()
+        if len(current) >= min_chars:
+            sentences.append(current)
+            current = ""
+    if current:
+        if sentences and len(current) < min_chars:
+            sentences[-1] = f"{sentences[-1]} {current}"
+        else:
+            sentences.append(current)
+    return sentences
+
+# ---------------------- Connection ----------------------
+class Turn:
+    def __init__(self, audio: bytes = b"", text: str = "", audio_format: str = "webm",
+                 sample_rate: int = 16000, started: float = None):
+        self.audio = audio
+        self.text = text
+        self.format = audio_format
+        self.sample_rate = sample_rate
+        self.ended = time.perf_counter()
+        self.started = started or self.ended
+
+class VoiceConnection:
+    """One WebSocket: a receiver collecting utterances and a worker answering them in order."""
+
+    def __init__(self, websocket, admission, transcribe, answer, synthesize):
+        self.websocket = websocket
+        self.admission = admission
+        self.transcribe = transcribe      # (audio bytes) -> object with .text
+        self.answer = answer              # (text, location, session_id) -> (answer, session_id)
+        self.synthesize = synthesize      # (text, audio format) -> audio bytes
+        self.session_id = None
+        self.location = ""
+        self.format = "webm"
+        self.sample_rate = 16000
+        self.audio_format = audio_formats.negotiate(getattr(websocket, "headers", None) or {})
+        self.turns = asyncio.Queue()
+        self.current = None
+        self.interrupted = False
+        self.send_lock = asyncio.Lock()
+        self._reset_utterance()
+
+    def _reset_utterance(self):
+        self.buffer = bytearray()
+        self.utterance_started = None
+        self.endpointer = Endpointer(self.sample_rate) if self.format == "pcm16" else None
+
+    async def send_json(self, payload: dict):
+        async with self.send_lock:
+            await self.websocket.send_text(json.dumps(payload, ensure_ascii=False))
+
+    async def send_audio(self, meta: dict, audio: bytes):
+        # Metadata and its binary frame go out back to back
+        async with self.send_lock:
+            await self.websocket.send_text(json.dumps(meta, ensure_ascii=False))
+            await self.websocket.send_bytes(audio)
+
+    async def run(self):
+        worker = asyncio.create_task(self._work())
+        try:
+            await self._receive()
+        finally:
+            worker.cancel()
+            if self.current is not None:
+                self.current.cancel()
+
+    # ---- receiving ----
+    async def _receive(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                await self._on_audio(message["bytes"])
+            elif message.get("text") is not None:
+                await self._on_control(message["text"])
+
+    async def _on_audio(self, chunk: bytes):
+        if self.utterance_started is None:
+            self.utterance_started = time.perf_counter()
+        self.buffer.extend(chunk)
+        if len(self.buffer) > MAX_UTTERANCE_BYTES:
+            self._reset_utterance()
+            await self.send_json({"type": "error", "status": 413, "detail": "Utterance too long"})
+            return
+        if self.endpointer is not None and self.endpointer.feed(chunk):
+            metrics_helper.incr("voice.endpointed")
+            self._finish_utterance()
+
+    async def _on_control(self, raw: str):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            await self.send_json({"type": "error", "status": 400, "detail": "Invalid JSON message"})
+            return
+        kind = message.get("type")
+        if kind == "start":
+            self.session_id = message.get("session_id") or self.session_id
+            self.location = message.get("location", self.location)
+            self.format = message.get("format", self.format)
+            if "sample_rate" in message:
+                try:
+                    sample_rate = int(message["sample_rate"])
+                except (TypeError, ValueError):
+                    sample_rate = None
+                if sample_rate is None or not SAMPLE_RATES[0] <= sample_rate <= SAMPLE_RATES[1]:
+                    await self.send_json({"type": "error", "status": 400, "detail":
+                                          f"sample_rate must be an integer from {SAMPLE_RATES[0]} to {SAMPLE_RATES[1]}"})
+                else:
+                    self.sample_rate = sample_rate
+            if message.get("audio_format"):
+                try:
+                    self.audio_format = audio_formats.negotiate({}, message["audio_format"])
+                except ValueError as e:
+                    await self.send_json({"type": "error", "status": 400, "detail": str(e)})
+            self._reset_utterance()
+            await self.send_json({"type": "ready", "session_id": self.session_id, "audio_format": self.audio_format})
+        elif kind == "end":
+            self._finish_utterance()
+        elif kind == "text":
+            self.turns.put_nowait(Turn(text=message.get("text", "")))
+        elif kind == "interrupt":
+            if self.current is not None and not self.current.done():
+                metrics_helper.incr("voice.interrupted")
+                self.interrupted = True
+                self.current.cancel()
+        else:
+            await self.send_json({"type": "error", "status": 400, "detail": f"Unknown message type '{kind}'"})
+
+    def _finish_utterance(self):
+        if self.buffer:
+            audio = bytes(self.buffer)
+            if self.format == "pcm16":
+                audio = pcm_to_wav(audio, self.sample_rate)
+            self.turns.put_nowait(Turn(audio=audio, audio_format=self.format,
+                                       sample_rate=self.sample_rate, started=self.utterance_started))
+        self._reset_utterance()
+
+    # ---- answering ----
+    async def _work(self):
+        while True:
+            turn = await self.turns.get()
+            self.interrupted = False
+            self.current = asyncio.create_task(self._answer_turn(turn))
+            try:
+                await self.current
+            except asyncio.CancelledError:
+                if not self.interrupted:
+                    raise  # the connection is closing
+                await self.send_json({"type": "turn_end", "interrupted": True})
+            except HTTPException as e:
+                # Rate limited / shed by admission control
+                await self.send_json({"type": "error", "status": e.status_code, "detail": e.detail,
+                                      "retry_after": (e.headers or {}).get("Retry-After")})
+            except Exception as e:
+                print(f"🎙️ Voice turn failed: {e}")
+                metrics_helper.incr("voice.errors")
+                await self.send_json({"type": "error", "status": 500, "detail": str(e)})
+            finally:
+                self.current = None
+
+    async def _answer_turn(self, turn: Turn):
+        # One admission per turn: the client's rate bucket is charged once, and a turn is never
+        # shed between its transcript and its answer
+        cancelled = threading.Event()
+        inflight = set()
+        async with self.admission.admit("voice", self.websocket) as slot:
+
+            async def run(fn, *args):
+                # A barge-in stops waiting, but blocking work already started keeps the slot
+                # until it returns; work not started yet is skipped
+                future = asyncio.ensure_future(slot.run(_unless_cancelled, cancelled, fn, *args))
+                inflight.add(future)
+                future.add_done_callback(inflight.discard)
+                return await asyncio.shield(future)
+
+            try:
+                await self._run_turn(turn, run)
+            except asyncio.CancelledError:
+                cancelled.set()
+                if inflight:
+                    await asyncio.gather(*inflight, return_exceptions=True)
+                raise
+
+    async def _run_turn(self, turn: Turn, run):
+        latency = {"speech": (turn.ended - turn.started) * 1000}
+        phase_started = turn.ended
+
+        def mark(phase):
+            nonlocal phase_started
+            now = time.perf_counter()
+            latency[phase] = (now - phase_started) * 1000
+            phase_started = now
+            return now
+
+        text = turn.text
+        if turn.audio:
+            transcription = await run(self.transcribe, turn.audio)
+            text = transcription.text or ""
+            mark("stt")
+            await self.send_json({"type": "transcript", "text": text})
+        if not text.strip():
+            await self.send_json({"type": "turn_end", "empty": True})
+            return
+
+        previous_session = self.session_id
+        answer, self.session_id = await run(self.answer, text, self.location, self.session_id)
+        mark("chat")
+        # An expired session is replaced by a new one: tell the client its history was lost
+        await self.send_json({"type": "answer", "text": answer, "session_id": self.session_id,
+                              "session_expired": previous_session is not None and previous_session != self.session_id})
+
+        sentences = split_sentences(speech_text(answer))
+        tts_started = phase_started
+        limit = asyncio.Semaphore(TTS_PARALLEL)
+        audio_format = self.audio_format
+
+        async def synthesize(sentence):
+            async with limit:
+                return await run(self.synthesize, sentence, audio_format)
+
+        tasks = [asyncio.create_task(synthesize(sentence)) for sentence in sentences]
+        try:
+            for index, (sentence, task) in enumerate(zip(sentences, tasks)):
+                audio = await task
+                await self.send_audio(
+                    {"type": "audio", "index": index, "text": sentence, "format": audio_format, "bytes": len(audio)},
+                    audio
+                )
+                if index == 0:
+                    latency["first_audio"] = (time.perf_counter() - turn.ended) * 1000
+        finally:
+            for task in tasks:
+                task.cancel()
+        latency["tts"] = (time.perf_counter() - tts_started) * 1000
+        latency["total"] = (time.perf_counter() - turn.ended) * 1000
+
+        for phase, value in latency.items():
+            metrics_helper.observe(f"voice.{phase}_ms", value)
+        metrics_helper.incr("voice.turns")
+        await self.send_json({"type": "turn_end", "sentences": len(sentences),
+                              "latency_ms": {phase: round(value, 1) for phase, value in latency.items()}})
+
+class TurnCancelled(Exception):
+    """Raised in place of work that was about to start after a barge-in."""
+
+def _unless_cancelled(cancelled, fn, *args):
+    if cancelled.is_set():
+        raise TurnCancelled()
+    return fn(*args)
+
+async def serve(websocket, admission, transcribe, answer, synthesize):
+    """Accept a voice WebSocket and run it until the client disconnects."""
+    await websocket.accept()
+    metrics_helper.incr("voice.connections")
+    await VoiceConnection(websocket, admission, transcribe, answer, synthesize).run()
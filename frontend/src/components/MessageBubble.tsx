@@ -24,9 +24,14 @@ export default function MessageBubble({ role, text, isTyping }: MessageBubblePro
 
     setIsLoading(true);
     try {
+      // Opus is ~4x smaller than the old 128 kbps MP3; fall back to MP3 where it can't play
+      const canPlayOpus = new Audio().canPlayType('audio/ogg; codecs=opus') !== '';
       const response = await fetch(`${DEFAULT_BACKEND}/text-to-speech`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: {
+          'Content-Type': 'application/json',
+          Accept: canPlayOpus ? 'audio/ogg; codecs=opus, audio/mpeg;q=0.8' : 'audio/mpeg',
+        },
         body: JSON.stringify({ text }),
       });
 
@@ -73,7 +73,9 @@ const VoiceRecorder: React.FC<VoiceRecorderProps> = ({ onTranscription }) => {
     try {
       console.log('🎤 Sử dụng backend fallback...');
       const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-      const mediaRecorder = new MediaRecorder(stream);
+      // Speech needs far less than the default bitrate; Opus at 24 kbps keeps uploads small
+      const mimeType = MediaRecorder.isTypeSupported('audio/webm;codecs=opus') ? 'audio/webm;codecs=opus' : undefined;
+      const mediaRecorder = new MediaRecorder(stream, { mimeType, audioBitsPerSecond: 24000 });
       mediaRecorderRef.current = mediaRecorder;
       audioChunksRef.current = [];
 
@@ -85,7 +87,7 @@ const VoiceRecorder: React.FC<VoiceRecorderProps> = ({ onTranscription }) => {
       };
 
       mediaRecorder.onstop = async () => {
-        const audioBlob = new Blob(audioChunksRef.current, { type: 'audio/webm' });
+        const audioBlob = new Blob(audioChunksRef.current, { type: mediaRecorder.mimeType || 'audio/webm' });
         console.log('🔊 Recording stopped. Total size:', audioBlob.size, 'bytes');
         console.log('📦 Audio format:', audioBlob.type);
         
@@ -34,20 +34,52 @@ export async function getUserLocation() {
   }
 }
 
+// Server-side chat session: once the backend has issued one, only the new turn is sent
+let sessionId: string | null = null;
+const CHAT_RETRIES = 2;
+
 export async function sendChatMessage(
   text: string, 
   location: string = "",
   history: Array<{ role: string; content: string }> = []
 ) {
   try {
+    // History only seeds a new session; an existing session keeps it on the server
+    let payload: Record<string, unknown> = sessionId
+      ? { text, location, session_id: sessionId }
+      : { text, location, history };
     console.log('Sending request to:', `${DEFAULT_BACKEND}/chat`);
-    console.log('Request payload:', { text, location, history });
+    console.log('Request payload:', payload);
     
-    const res = await fetch(`${DEFAULT_BACKEND}/chat`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ text, location, history })
-    });
+    // Retries carry the same key: the backend answers them from the first attempt
+    const idempotencyKey = crypto.randomUUID();
+    let res: Response | null = null;
+    for (let attempt = 0; attempt <= CHAT_RETRIES; attempt++) {
+      try {
+        res = await fetch(`${DEFAULT_BACKEND}/chat`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey },
+          body: JSON.stringify(payload)
+        });
+        if (res.status < 500 || attempt === CHAT_RETRIES) break;
+      } catch (networkError) {
+        if (attempt === CHAT_RETRIES) throw networkError;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000 * (attempt + 1)));
+    }
+    if (!res) {
+      throw new Error('No response from server');
+    }
+    if (res.status === 409 && sessionId) {
+      // The server session expired (or lives on another worker): seed a new one with the history
+      sessionId = null;
+      payload = { text, location, history };
+      res = await fetch(`${DEFAULT_BACKEND}/chat`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': crypto.randomUUID() },
+        body: JSON.stringify(payload)
+      });
+    }
     
     if (!res.ok) {
       const errorData = await res.text();
@@ -55,7 +87,11 @@ export async function sendChatMessage(
       throw new Error(`Server error: ${res.status} - ${errorData}`);
     }
     
-    return res.json();
+    const data = await res.json();
+    if (data.session_id) {
+      sessionId = data.session_id;
+    }
+    return data;
   } catch (error) {
     console.error('Network or parsing error:', error);
     throw error;